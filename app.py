@@ -1,38 +1,44 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, g, render_template, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
+import click
 import json
 import os
 import csv
 import io
+import base64
+import zlib
 from datetime import datetime, timedelta
-from collections import defaultdict
 import uuid
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack
+from functools import wraps
+from itertools import groupby
+from operator import itemgetter
+
+import metrics
+from backup import ChangeLog, DocumentReader
+from events import EventLog
+from indexes import SEARCH_FIELDS
+from jobs import JobRunner
+from jsonprovider import OrjsonProvider
+from storage import DATE_FORMAT, INDEXED_FIELDS, BatchError, LoadError, create_store, migrate_json_to_sqlite
+from tenants import ENVIRON_KEY, Tenant, TenantMiddleware, TenantProxy, TenantRegistry
 
 app = Flask(__name__, static_folder='static', static_url_path='/static')
-CORS(app)
+app.json_provider_class = OrjsonProvider
+app.json = OrjsonProvider(app)
+CORS(app, expose_headers=['X-Total-Count', 'X-Next-Cursor'])
 
 # For Render, we'll use a relative path in the file system
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_FILE = os.path.join(BASE_DIR, 'data', 'business_data.json')
+DATA_FILE = os.environ.get('DATA_FILE', os.path.join(BASE_DIR, 'data', 'business_data.json'))
 
 def load_data():
-    """Load business data from JSON file"""
-    try:
-        os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
-        
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, 'r') as f:
-                data = json.load(f)
-                data = validate_data(data)
-                return data
-        else:
-            # Create default data file
-            default_data = get_default_data()
-            save_data(default_data)
-            return default_data
-    except Exception as e:
-        print(f"Error loading data: {e}")
-        return get_default_data()
+    """Load business data from the configured store"""
+    return store.load()
 
 def get_default_data():
     """Return default data structure"""
@@ -141,100 +147,285 @@ def get_default_data():
         "settings": {"tax_rate": 16.0, "currency": "KES", "company_name": "Business Suite Pro"}
     }
 
+def validate_product(product):
+    """Fill in missing product fields and coerce numeric strings"""
+    product.setdefault("price", 0)
+    product.setdefault("stock", 0)
+    product.setdefault("cost", 0)
+    product.setdefault("category", "")
+    product.setdefault("supplier", "")
+    product.setdefault("min_stock", 5)
+    product.setdefault("max_stock", 100)
+    product.setdefault("sku", "")
+    product.setdefault("description", "")
+    product.setdefault("status", "active")
+    product.setdefault("last_updated", datetime.now().isoformat())
+    
+    numeric_fields = ["price", "stock", "cost", "min_stock", "max_stock"]
+    for field in numeric_fields:
+        if field in product and isinstance(product[field], str):
+            try:
+                if field == "stock":
+                    product[field] = int(float(product[field]))
+                else:
+                    product[field] = float(product[field])
+            except:
+                product[field] = 0
+    return product
+
+def validate_customer(customer):
+    """Fill in missing customer fields and coerce numeric strings"""
+    customer.setdefault("total_spent", 0)
+    customer.setdefault("total_orders", 0)
+    customer.setdefault("last_order", "")
+    customer.setdefault("type", "Regular")
+    customer.setdefault("address", "")
+    customer.setdefault("city", "")
+    customer.setdefault("country", "Kenya")
+    customer.setdefault("status", "active")
+    customer.setdefault("join_date", datetime.now().strftime("%Y-%m-%d"))
+    
+    if isinstance(customer.get("total_spent"), str):
+        try:
+            customer["total_spent"] = float(customer["total_spent"])
+        except:
+            customer["total_spent"] = 0
+    
+    if isinstance(customer.get("total_orders"), str):
+        try:
+            customer["total_orders"] = int(customer["total_orders"])
+        except:
+            customer["total_orders"] = 0
+    return customer
+
+def validate_transaction(transaction):
+    """Fill in missing transaction fields and coerce the amount"""
+    transaction.setdefault("amount", 0)
+    transaction.setdefault("customer", "")
+    transaction.setdefault("supplier", "")
+    transaction.setdefault("description", "")
+    transaction.setdefault("items", [])
+    transaction.setdefault("payment_method", "Cash")
+    transaction.setdefault("status", "completed")
+    
+    if not isinstance(transaction.get("amount"), (int, float)):
+        try:
+            transaction["amount"] = float(transaction["amount"])
+        except:
+            transaction["amount"] = 0
+    return transaction
+
+def validate_supplier(supplier):
+    supplier.setdefault("products", [])
+    supplier.setdefault("status", "active")
+    supplier.setdefault("address", "")
+    supplier.setdefault("phone", "")
+    return supplier
+
+def validate_note(note):
+    note.setdefault("category", "General")
+    note.setdefault("priority", "medium")
+    note.setdefault("created_at", datetime.now().isoformat())
+    note.setdefault("updated_at", datetime.now().isoformat())
+    return note
+
+RECORD_VALIDATORS = {
+    'products': validate_product,
+    'customers': validate_customer,
+    'transactions': validate_transaction,
+    'suppliers': validate_supplier,
+    'notes': validate_note
+}
+
+# Version of the stored data's shape. Raise it when records need reshaping
+# and append the step that brings version N-1 data up to N to MIGRATIONS.
+SCHEMA_VERSION = 1
+
+def normalize_records(data):
+    """Version 1: every record has been through its RECORD_VALIDATORS entry"""
+    for collection, validate_record in RECORD_VALIDATORS.items():
+        for record in data[collection]:
+            validate_record(record)
+    return data
+
+MIGRATIONS = [normalize_records]
+
 def validate_data(data):
-    """Validate and fix data structure"""
+    """Bring a dataset up to SCHEMA_VERSION.
+
+    A dataset already at the current version is returned as is: its records
+    were validated when they were written. Older data is migrated step by
+    step and stamped with the version, and the store writes it back so this
+    happens once per file.
+    """
     required_keys = ["products", "transactions", "customers", "suppliers", "notes", "settings"]
     for key in required_keys:
         if key not in data:
             default_data = get_default_data()
             data[key] = default_data[key] if key in default_data else []
     
-    # Validate products
-    for product in data["products"]:
-        product.setdefault("price", 0)
-        product.setdefault("stock", 0)
-        product.setdefault("cost", 0)
-        product.setdefault("category", "")
-        product.setdefault("supplier", "")
-        product.setdefault("min_stock", 5)
-        product.setdefault("max_stock", 100)
-        product.setdefault("sku", "")
-        product.setdefault("description", "")
-        product.setdefault("status", "active")
-        product.setdefault("last_updated", datetime.now().isoformat())
-        
-        numeric_fields = ["price", "stock", "cost", "min_stock", "max_stock"]
-        for field in numeric_fields:
-            if field in product and isinstance(product[field], str):
-                try:
-                    if field == "stock":
-                        product[field] = int(float(product[field]))
-                    else:
-                        product[field] = float(product[field])
-                except:
-                    product[field] = 0
-    
-    # Validate customers
-    for customer in data["customers"]:
-        customer.setdefault("total_spent", 0)
-        customer.setdefault("total_orders", 0)
-        customer.setdefault("last_order", "")
-        customer.setdefault("type", "Regular")
-        customer.setdefault("address", "")
-        customer.setdefault("city", "")
-        customer.setdefault("country", "Kenya")
-        customer.setdefault("status", "active")
-        customer.setdefault("join_date", datetime.now().strftime("%Y-%m-%d"))
-        
-        if isinstance(customer.get("total_spent"), str):
-            try:
-                customer["total_spent"] = float(customer["total_spent"])
-            except:
-                customer["total_spent"] = 0
-        
-        if isinstance(customer.get("total_orders"), str):
-            try:
-                customer["total_orders"] = int(customer["total_orders"])
-            except:
-                customer["total_orders"] = 0
-    
-    # Validate transactions
-    for transaction in data["transactions"]:
-        transaction.setdefault("amount", 0)
-        transaction.setdefault("customer", "")
-        transaction.setdefault("supplier", "")
-        transaction.setdefault("description", "")
-        transaction.setdefault("items", [])
-        transaction.setdefault("payment_method", "Cash")
-        transaction.setdefault("status", "completed")
-        
-        if isinstance(transaction.get("amount"), str):
-            try:
-                transaction["amount"] = float(transaction["amount"])
-            except:
-                transaction["amount"] = 0
-    
-    # Validate suppliers
-    for supplier in data["suppliers"]:
-        supplier.setdefault("products", [])
-        supplier.setdefault("status", "active")
-        supplier.setdefault("address", "")
-        supplier.setdefault("phone", "")
-    
-    # Validate notes
-    for note in data["notes"]:
-        note.setdefault("category", "General")
-        note.setdefault("priority", "medium")
-        note.setdefault("created_at", datetime.now().isoformat())
-        note.setdefault("updated_at", datetime.now().isoformat())
-    
+    version = data.get('schema_version', 0)
+    if version == SCHEMA_VERSION:
+        return data
+    if not isinstance(version, int) or version > SCHEMA_VERSION:
+        raise ValueError(f"Data schema version {version} is newer than this app ({SCHEMA_VERSION})")
+    for migrate in MIGRATIONS[version:]:
+        data = migrate(data)
+    data['schema_version'] = SCHEMA_VERSION
     return data
 
 def save_data(data):
-    """Save business data to JSON file"""
-    os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
+    """Replace the whole dataset in the configured store"""
+    store.save(data)
+
+# Storage backend: "json" rewrites one document, "journal" appends to a log,
+# "sqlite" keeps indexed tables in SQLITE_FILE
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')
+JOURNAL_COMPACT_THRESHOLD = int(os.environ.get('JOURNAL_COMPACT_THRESHOLD', 1000))
+SQLITE_FILE = os.environ.get('SQLITE_FILE', os.path.join(BASE_DIR, 'data', 'business_data.db'))
+
+# Prometheus metrics at /api/metrics. PROFILE_SLOW_REQUESTS=<ms> also samples
+# the stacks of requests slower than that into PROFILE_DIR.
+PROFILE_SLOW_REQUESTS = float(os.environ.get('PROFILE_SLOW_REQUESTS', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, 'data', 'profiles'))
+
+# Every write is appended to EVENTS_FILE, which each worker's /api/events
+# stream tails; streams end after EVENTS_STREAM_SECONDS and the browser
+# reconnects where it left off. Each stream holds one of the worker's
+# threads, so a worker serves at most EVENTS_MAX_STREAMS of them and keeps
+# the rest of its threads for ordinary requests.
+EVENTS_FILE = os.environ.get('EVENTS_FILE', f"{DATA_FILE}.events")
+EVENTS_STREAM_SECONDS = int(os.environ.get('EVENTS_STREAM_SECONDS', 300))
+EVENTS_MAX_STREAMS = int(os.environ.get('EVENTS_MAX_STREAMS', 4))
+
+# Every write's record changes are also kept in CHANGES_FILE, numbered, for
+# delta backups; it starts afresh past CHANGES_MAX_BYTES
+CHANGES_FILE = os.environ.get('CHANGES_FILE', f"{DATA_FILE}.changes")
+CHANGES_MAX_BYTES = int(os.environ.get('CHANGES_MAX_BYTES', 64 * 1024 * 1024))
+
+# Multi-tenant mode: TENANT_MODE=subdomain, header or path gives every
+# business its own directory under TENANTS_DIR in place of DATA_FILE and the
+# files next to it. Each worker keeps at most TENANT_CACHE_SIZE tenants open,
+# and with TENANT_CACHE_MB fewer once their data adds up to more than that.
+TENANT_MODE = os.environ.get('TENANT_MODE', '')
+TENANTS_DIR = os.environ.get('TENANTS_DIR', os.path.join(BASE_DIR, 'data', 'tenants'))
+TENANT_HEADER = os.environ.get('TENANT_HEADER', 'X-Tenant')
+TENANT_DOMAIN = os.environ.get('TENANT_DOMAIN')
+TENANT_CACHE_SIZE = int(os.environ.get('TENANT_CACHE_SIZE', 16))
+TENANT_CACHE_MB = float(os.environ.get('TENANT_CACHE_MB', 0))
+
+def open_dataset(data_file, sqlite_file, events_file, changes_file):
+    """Create a store plus the event and change logs that follow its writes"""
+    dataset_store = create_store(STORAGE_BACKEND, data_file, validate_data, get_default_data,
+                                 compact_threshold=JOURNAL_COMPACT_THRESHOLD, sqlite_file=sqlite_file)
+    dataset_events = EventLog(events_file)
+    dataset_changes = ChangeLog(changes_file, max_bytes=CHANGES_MAX_BYTES)
+    dataset_store.add_listener(dataset_events.listener)
+    dataset_store.add_listener(dataset_changes.listener)
+    return dataset_store, dataset_events, dataset_changes
+
+def tenant_files(directory):
+    """Return the (data file, SQLite file) of a tenant directory"""
+    return os.path.join(directory, 'business_data.json'), os.path.join(directory, 'business_data.db')
+
+def open_tenant(name, directory):
+    data_file, sqlite_file = tenant_files(directory)
+    tenant_store, tenant_events, tenant_changes = open_dataset(
+        data_file, sqlite_file, f"{data_file}.events", f"{data_file}.changes")
+    metrics.instrument_store(tenant_store)
+    return Tenant(name, directory, tenant_store, tenant_events, tenant_changes)
+
+if TENANT_MODE:
+    tenants = TenantRegistry(TENANTS_DIR, open_tenant, max_open=TENANT_CACHE_SIZE,
+                             max_bytes=int(TENANT_CACHE_MB * 1024 * 1024) or None)
+    app.wsgi_app = TenantMiddleware(app.wsgi_app, TENANT_MODE, header=TENANT_HEADER, domain=TENANT_DOMAIN)
+    # Each resolves to the current request's tenant
+    store, event_log, change_log = (TenantProxy(tenants, name) for name in ('store', 'event_log', 'change_log'))
+else:
+    tenants = None
+    store, event_log, change_log = open_dataset(DATA_FILE, SQLITE_FILE, EVENTS_FILE, CHANGES_FILE)
+
+metrics.install(app, None if tenants else store, list(INDEXED_FIELDS),
+                profile_threshold_ms=PROFILE_SLOW_REQUESTS, profile_dir=PROFILE_DIR)
+
+# Served without a tenant in multi-tenant mode
+TENANT_FREE_ENDPOINTS = ('health_check', 'metrics', 'static')
+
+@app.before_request
+def select_tenant():
+    """In multi-tenant mode, open the dataset of the business the request is for"""
+    if tenants is None or request.endpoint in TENANT_FREE_ENDPOINTS:
+        return None
+    try:
+        g.tenant = tenants.get(request.environ.get(ENVIRON_KEY))
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    return None
+
+def current_tenant_name():
+    """Return the current tenant's name, or '' when serving a single business"""
+    return tenants.current().name if tenants else ''
+
+def job_tenant(params):
+    """Run a job against the data of the tenant that submitted it"""
+    return tenants.activate(params['tenant'])
+
+# Background jobs for slow exports and reports; results are kept in JOBS_DIR
+# for JOB_TTL_SECONDS after they finish
+JOBS_DIR = os.environ.get('JOBS_DIR', os.path.join(BASE_DIR, 'data', 'jobs'))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_TTL_SECONDS = int(os.environ.get('JOB_TTL_SECONDS', 3600))
+jobs = JobRunner(JOBS_DIR, workers=JOB_WORKERS, ttl=JOB_TTL_SECONDS, context=job_tenant if tenants else None)
+
+def tenant_option(command):
+    """Add --tenant to a CLI command; in multi-tenant mode it runs against that tenant's data"""
+    @click.option('--tenant', help="Tenant to run against when TENANT_MODE is set")
+    @wraps(command)
+    def wrapper(tenant, *args, **kwargs):
+        if tenants is None:
+            return command(*args, **kwargs)
+        if not tenant:
+            raise click.ClickException("--tenant is required when TENANT_MODE is set")
+        try:
+            with tenants.activate(tenant):
+                return command(*args, **kwargs)
+        except LookupError as e:
+            raise click.ClickException(str(e))
+    return wrapper
+
+@app.cli.command('create-tenant')
+@click.argument('name')
+def create_tenant_command(name):
+    """Add a business in multi-tenant mode; its data is seeded on first use"""
+    if tenants is None:
+        raise click.ClickException("TENANT_MODE is not set")
+    try:
+        tenants.create(name)
+    except LookupError as e:
+        raise click.ClickException(str(e))
+    print(f"Created tenant {name} in {tenants.path(name)}")
+
+@app.cli.command('migrate-sqlite')
+@tenant_option
+def migrate_sqlite_command():
+    """Copy DATA_FILE (or the tenant's data file) into SQLITE_FILE for STORAGE_BACKEND=sqlite"""
+    data_file, sqlite_file = tenant_files(tenants.current().directory) if tenants else (DATA_FILE, SQLITE_FILE)
+    if not os.path.exists(data_file):
+        raise click.ClickException(f"Data file not found: {data_file}")
+    counts = migrate_json_to_sqlite(data_file, sqlite_file, validate_data, get_default_data)
+    for collection, count in counts.items():
+        print(f"{collection}: {count} records")
+    print(f"Migrated {data_file} to {sqlite_file}")
+
+@app.cli.command('migrate-data')
+@tenant_option
+def migrate_data_command():
+    """Bring the stored data up to SCHEMA_VERSION now rather than on the first load"""
+    store.invalidate()
+    version = store.load().get('schema_version')
+    if version != SCHEMA_VERSION:
+        raise click.ClickException("The data could not be loaded; see the error above")
+    print(f"Data is at schema version {version}")
 
 @app.route('/')
 def index():
@@ -246,188 +437,558 @@ def health_check():
     """Health check endpoint"""
     return jsonify({"status": "healthy", "timestamp": datetime.now().isoformat()})
 
+@app.errorhandler(LoadError)
+def data_unavailable(e):
+    """The data file can't be read (or is from a newer version): refuse reads and writes alike"""
+    return jsonify({"error": str(e)}), 503
+
+# Conditional GET: read endpoints send an ETag derived from the store's data
+# version and answer 304 when the client already has it. Computed payloads
+# (dashboard, analytics) are also kept in a small LRU keyed by that ETag.
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 256))
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+# Responses of at least GZIP_MIN_BYTES are gzipped for clients that accept it
+GZIP_MIN_BYTES = int(os.environ.get('GZIP_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 1))
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain', 'text/html', 'text/csv')
+
+def accepts_gzip():
+    return request.accept_encodings['gzip'] > 0
+
+@app.after_request
+def compress_response(response):
+    """Gzip a large enough JSON or text response for clients that accept it"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    body = response.get_data()
+    if len(body) < GZIP_MIN_BYTES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if not accepts_gzip():
+        return response
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    response.set_data(compressor.compress(body) + compressor.flush())
+    response.headers['Content-Encoding'] = 'gzip'
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # The compressed bytes differ, but the representation is the same
+        response.set_etag(etag, weak=True)
+    return response
+
+def cached_get(cache=False, time_bucket=None):
+    """Add ETag/304 handling to a GET view, optionally caching its response.
+
+    time_bucket (seconds) folds the clock into the ETag for views whose
+    output depends on the current time as well as on the data. ETags are
+    weak, so gzipped and plain responses share them; cached responses are
+    kept already compressed.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            version = store.version()
+            if time_bucket:
+                version += f"-{int(time.time() // time_bucket)}"
+            etag = hashlib.sha1(f"{current_tenant_name()}|{version}|{request.full_path}".encode()).hexdigest()
+            
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                cached = None
+                key = (etag, accepts_gzip())
+                if cache:
+                    with _response_cache_lock:
+                        cached = _response_cache.get(key)
+                        if cached is not None:
+                            _response_cache.move_to_end(key)
+                if cached is not None:
+                    body, status, headers = cached
+                    response = app.response_class(body, status=status, headers=headers)
+                else:
+                    response = app.make_response(view(*args, **kwargs))
+                    if cache and response.status_code == 200:
+                        compress_response(response)
+                        with _response_cache_lock:
+                            _response_cache[key] = (response.get_data(), response.status_code,
+                                                    list(response.headers.items()))
+                            while len(_response_cache) > RESPONSE_CACHE_SIZE:
+                                _response_cache.popitem(last=False)
+            
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+def clear_response_cache():
+    with _response_cache_lock:
+        _response_cache.clear()
+
+MAX_PAGE_SIZE = 1000
+
+def encode_cursor(values):
+    """Turn the (sort value, id) of a page's last record into an opaque token"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(token):
+    values = json.loads(base64.urlsafe_b64decode(token.encode()))
+    if (not isinstance(values, list) or len(values) != 2
+            or not all(value is None or isinstance(value, (str, int, float)) for value in values)):
+        raise ValueError("Invalid cursor")
+    return values
+
+def list_filters(collection):
+    """Read exact-match field filters and the from/to date range from the query string.
+
+    Raises ValueError for a date range on anything but transactions, or a
+    limit below 1.
+    """
+    args = request.args
+    text_fields = [name for name, default in INDEXED_FIELDS[collection] if isinstance(default, str)]
+    filters = {field: args[field] for field in text_fields if field in args}
+    if collection != 'transactions' and ('from' in args or 'to' in args):
+        raise ValueError("from/to only apply to transactions")
+    if 'limit' in args and int(args['limit']) < 1:
+        raise ValueError("limit must be at least 1")
+    
+    date_from = args.get('from')
+    date_to = args.get('to')
+    if date_to and len(date_to) == 10:
+        date_to += ' 23:59:59'
+    return filters, date_from, date_to
+
+def requested_fields():
+    """Return the field names listed in fields=a,b,c, or None for whole records"""
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(',') if field.strip()]
+
+def project(records, fields):
+    """Keep only `fields` of each record; None keeps them all"""
+    if fields is None:
+        return records
+    return [{field: record[field] for field in fields if field in record} for record in records]
+
+def list_collection(collection):
+    """Serve a list endpoint with optional filtering, sorting and pagination.
+
+    Query parameters: any indexed text field as an exact filter (e.g.
+    type=sale&status=completed), from/to for transaction dates, sort=<field>
+    or sort=-<field>, limit, the cursor returned in X-Next-Cursor and
+    fields=<field>,... to send only those fields of each record. The body
+    stays a plain list; the total match count is sent in X-Total-Count.
+    """
+    args = request.args
+    sort = args.get('sort', 'id')
+    descending = sort.startswith('-')
+    sort = sort.lstrip('-')
+    
+    try:
+        filters, date_from, date_to = list_filters(collection)
+        limit = min(int(args['limit']), MAX_PAGE_SIZE) if 'limit' in args else None
+        after = decode_cursor(args['cursor']) if 'cursor' in args else None
+        records, total = store.list_records(collection, filters, date_from, date_to,
+                                            sort, descending, limit, after)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    response = jsonify(project(records, requested_fields()))
+    response.headers['X-Total-Count'] = str(total)
+    if limit is not None and len(records) == limit and records:
+        last = records[-1]
+        default = dict(INDEXED_FIELDS[collection]).get(sort)
+        response.headers['X-Next-Cursor'] = encode_cursor([last.get(sort, default), last.get('id')])
+    return response
+
+def prepare_product(product):
+    """Give a new product a generated SKU and timestamp, then its defaults"""
+    product.pop("id", None)  # ids are allocated by the store
+    product.setdefault("sku", f"PROD-{datetime.now().strftime('%Y%m%d%H%M%S')}")
+    product['last_updated'] = datetime.now().isoformat()
+    return validate_product(product)
+
+def prepare_customer(customer):
+    """Apply the defaults and numeric coercion every new customer gets"""
+    customer.pop("id", None)  # ids are allocated by the store
+    return validate_customer(customer)
+
+def prepare_transaction(transaction):
+    """Apply the defaults and amount coercion every new transaction gets"""
+    transaction.pop("id", None)  # ids are allocated by the store
+    return validate_transaction(transaction)
+
+def prepare_note(note):
+    """Give a new note its id, timestamps and defaults"""
+    note['id'] = str(uuid.uuid4())
+    note['created_at'] = datetime.now().isoformat()
+    note['updated_at'] = note['created_at']
+    note.setdefault('content', '')
+    return validate_note(note)
+
 # Products API
 @app.route('/api/products', methods=['GET'])
+@cached_get()
 def get_products():
-    data = load_data()
-    return jsonify(data['products'])
+    return list_collection('products')
 
 @app.route('/api/products', methods=['POST'])
 def add_product():
-    data = load_data()
-    product = request.json
-    
-    product.setdefault("price", 0)
-    product.setdefault("stock", 0)
-    product.setdefault("cost", 0)
-    product.setdefault("category", "")
-    product.setdefault("supplier", "")
-    product.setdefault("min_stock", 5)
-    product.setdefault("max_stock", 100)
-    product.setdefault("sku", f"PROD-{datetime.now().strftime('%Y%m%d%H%M%S')}")
-    product.setdefault("description", "")
-    product.setdefault("status", "active")
-    
-    numeric_fields = ["price", "stock", "cost", "min_stock", "max_stock"]
-    for field in numeric_fields:
-        if field in product and isinstance(product[field], str):
-            try:
-                if field == "stock":
-                    product[field] = int(float(product[field]))
-                else:
-                    product[field] = float(product[field])
-            except:
-                product[field] = 0
-    
-    product['id'] = max([p['id'] for p in data['products']], default=0) + 1
-    product['last_updated'] = datetime.now().isoformat()
-    data['products'].append(product)
-    save_data(data)
+    product = prepare_product(request.json)
+    store.insert('products', product)
     return jsonify(product), 201
 
 @app.route('/api/products/<int:product_id>', methods=['DELETE'])
 def delete_product(product_id):
-    data = load_data()
-    data['products'] = [p for p in data['products'] if p['id'] != product_id]
-    save_data(data)
+    store.delete('products', product_id)
     return jsonify({"message": "Product deleted"}), 200
 
 # Customers API
 @app.route('/api/customers', methods=['GET'])
+@cached_get()
 def get_customers():
-    data = load_data()
-    return jsonify(data['customers'])
+    return list_collection('customers')
 
 @app.route('/api/customers', methods=['POST'])
 def add_customer():
-    data = load_data()
-    customer = request.json
-    
-    customer.setdefault("total_spent", 0)
-    customer.setdefault("total_orders", 0)
-    customer.setdefault("last_order", "")
-    customer.setdefault("type", "Regular")
-    customer.setdefault("address", "")
-    customer.setdefault("city", "")
-    customer.setdefault("country", "Kenya")
-    customer.setdefault("status", "active")
-    customer.setdefault("join_date", datetime.now().strftime("%Y-%m-%d"))
-    
-    customer['id'] = max([c['id'] for c in data['customers']], default=0) + 1
-    data['customers'].append(customer)
-    save_data(data)
+    customer = prepare_customer(request.json)
+    store.insert('customers', customer)
     return jsonify(customer), 201
 
+@app.route('/api/customers/<int:customer_id>/totals', methods=['GET'])
+def get_customer_totals(customer_id):
+    """Spend, order count and last order day of a customer, derived from the ledger"""
+    totals = store.customer_totals(customer_id)
+    if totals is None:
+        return jsonify({"error": "Customer not found"}), 404
+    spent, orders, last_order = totals
+    return jsonify({'total_spent': spent, 'total_orders': orders, 'last_order': last_order})
+
 @app.route('/api/customers/<int:customer_id>', methods=['DELETE'])
 def delete_customer(customer_id):
-    data = load_data()
-    data['customers'] = [c for c in data['customers'] if c['id'] != customer_id]
-    save_data(data)
+    store.delete('customers', customer_id)
     return jsonify({"message": "Customer deleted"}), 200
 
 # Transactions API
 @app.route('/api/transactions', methods=['GET'])
+@cached_get()
 def get_transactions():
-    data = load_data()
-    return jsonify(data['transactions'])
+    return list_collection('transactions')
 
 @app.route('/api/transactions', methods=['POST'])
 def add_transaction():
-    data = load_data()
-    transaction = request.json
+    transaction = prepare_transaction(request.json)
+    transaction['date'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        # Sale and purchase items move product stock in the same commit
+        store.insert_transaction(transaction)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(transaction), 201
+
+# Bulk import API
+MAX_IMPORT_ERRORS = 1000
+
+def read_import_rows():
+    """Yield (row number, dict or error message) from an uploaded CSV or NDJSON file.
+
+    The upload is read line by line, either from a multipart "file" field or
+    from the raw request body; the format comes from the file extension, the
+    format= parameter or the content type.
+    """
+    if 'file' in request.files:
+        upload = request.files['file']
+        stream, name, content_type = upload.stream, upload.filename or '', upload.content_type or ''
+    else:
+        stream, name, content_type = request.stream, '', request.content_type or ''
     
-    transaction.setdefault("amount", 0)
-    transaction.setdefault("customer", "")
-    transaction.setdefault("supplier", "")
-    transaction.setdefault("description", "")
-    transaction.setdefault("items", [])
-    transaction.setdefault("payment_method", "Cash")
-    transaction.setdefault("status", "completed")
+    fmt = request.args.get('format')
+    if not fmt:
+        is_csv = name.endswith('.csv') or 'csv' in content_type
+        fmt = 'csv' if is_csv else 'ndjson'
+    
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if fmt == 'csv':
+        for row_number, row in enumerate(csv.DictReader(text), start=1):
+            # Empty cells mean "use the default", as a missing JSON key would
+            yield row_number, {k: v for k, v in row.items() if k and v not in ('', None)}
+    else:
+        for row_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield row_number, "Invalid JSON"
+                continue
+            yield row_number, row if isinstance(row, dict) else "Row must be a JSON object"
+
+def import_product(row):
+    if not row.get('name'):
+        return "name is required"
+    return prepare_product(row)
+
+def import_customer(row):
+    if not row.get('name'):
+        return "name is required"
+    return prepare_customer(row)
+
+def import_transaction(row):
+    if not row.get('type'):
+        return "type is required"
+    if isinstance(row.get('items'), str):
+        try:
+            row['items'] = json.loads(row['items'])
+        except ValueError:
+            return "items must be a JSON list"
+    if 'date' in row:
+        try:
+            datetime.strptime(row['date'], DATE_FORMAT)
+        except (TypeError, ValueError):
+            return "date must use the format YYYY-MM-DD HH:MM:SS"
+    else:
+        row['date'] = datetime.now().strftime(DATE_FORMAT)
+    return prepare_transaction(row)
+
+IMPORTERS = {
+    'products': import_product,
+    'customers': import_customer,
+    'transactions': import_transaction
+}
+
+@app.route('/api/<collection>/import', methods=['POST'])
+def bulk_import(collection):
+    """Import many products, customers or transactions with one commit"""
+    if collection not in IMPORTERS:
+        return jsonify({"error": "Invalid import type"}), 400
     
+    importer = IMPORTERS[collection]
+    records = []
+    row_numbers = []
+    errors = []
+    failed = 0
     try:
-        transaction["amount"] = float(transaction["amount"])
-    except:
-        transaction["amount"] = 0
+        for row_number, row in read_import_rows():
+            if isinstance(row, dict):
+                row = importer(row)
+            if isinstance(row, str):
+                failed += 1
+                if len(errors) < MAX_IMPORT_ERRORS:
+                    errors.append({"row": row_number, "error": row})
+                continue
+            records.append(row)
+            row_numbers.append(row_number)
+    except (UnicodeDecodeError, csv.Error) as e:
+        return jsonify({"error": f"Could not read upload: {e}"}), 400
     
-    transaction['id'] = max([t['id'] for t in data['transactions']], default=0) + 1
-    transaction['date'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    data['transactions'].append(transaction)
-    save_data(data)
-    return jsonify(transaction), 201
+    if records and collection == 'transactions':
+        # Imported sales and purchases move stock like any other
+        try:
+            store.apply([('create', collection, record) for record in records])
+        except BatchError as e:
+            errors = [{"row": row_numbers[e.index], "error": str(e)}]
+            return jsonify({"imported": 0, "failed": failed + 1, "errors": errors}), 400
+    elif records:
+        store.insert_many(collection, records)
+    
+    status = 201 if records else (400 if failed else 200)
+    return jsonify({"imported": len(records), "failed": failed, "errors": errors}), status
+
+# Batch API
+MAX_BATCH_OPERATIONS = 1000
+
+def import_note(row):
+    if not row.get('title'):
+        return "title is required"
+    return prepare_note(row)
+
+# Batch creates get the same checks as imported rows
+BATCH_CREATORS = dict(IMPORTERS, notes=import_note)
+
+def read_batch_operation(operation):
+    """Check one batch operation; returns (op, collection, record or id) or an error message"""
+    if not isinstance(operation, dict):
+        return "Operation must be a JSON object"
+    op, collection = operation.get('op'), operation.get('collection')
+    if collection not in BATCH_CREATORS:
+        return f"Invalid collection '{collection}'"
+    if op == 'create':
+        record = operation.get('record')
+        if not isinstance(record, dict):
+            return "record must be a JSON object"
+        record = BATCH_CREATORS[collection](record)
+        return record if isinstance(record, str) else (op, collection, record)
+    if op == 'delete':
+        record_id = operation.get('id')
+        if collection == 'notes' and not isinstance(record_id, str):
+            return "id must be a string"
+        if collection != 'notes' and (not isinstance(record_id, int) or isinstance(record_id, bool)):
+            return "id must be an integer"
+        return op, collection, record_id
+    return "op must be 'create' or 'delete'"
+
+@app.route('/api/batch', methods=['POST'])
+def apply_batch():
+    """Create and delete products, customers, transactions and notes with one commit.
+
+    Either every operation is applied or none is; the response lists one
+    result per operation, in order.
+    """
+    body = request.get_json(silent=True)
+    operations = body.get('operations') if isinstance(body, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "Expected a JSON object with a list of operations"}), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({"error": f"A batch holds at most {MAX_BATCH_OPERATIONS} operations"}), 400
+    
+    checked = [read_batch_operation(operation) for operation in operations]
+    errors = {i: error for i, error in enumerate(checked) if isinstance(error, str)}
+    if not errors:
+        try:
+            results = store.apply(checked)
+        except BatchError as e:
+            errors = {e.index: str(e)}
+    if errors:
+        failures = [{"status": 400, "error": errors[i]} if i in errors else {"status": 424, "error": "Not applied"}
+                    for i in range(len(operations))]
+        return jsonify({"error": "No operations were applied", "results": failures}), 400
+    
+    return jsonify({"results": [{"status": 201, "record": result} if op == 'create' else {"status": 200, "deleted": result}
+                                for (op, _, _), result in zip(checked, results)]}), 200
 
 # Suppliers API
 @app.route('/api/suppliers', methods=['GET'])
+@cached_get()
 def get_suppliers():
     data = load_data()
-    return jsonify(data['suppliers'])
+    return jsonify(project(data['suppliers'], requested_fields()))
+
+@app.cli.command('rebuild-rollups')
+@tenant_option
+def rebuild_rollups_command():
+    """Recompute the daily sales rollups from the transaction ledger"""
+    result = store.rebuild_sales_rollups()
+    print(f"Rebuilt sales rollups for {result['days']} days")
+    for day in result['mismatched_days']:
+        print(f"  corrected {day}")
+
+@app.cli.command('rebuild-customer-totals')
+@tenant_option
+def rebuild_customer_totals_command():
+    """Recompute every customer's spend and order count from the transaction ledger"""
+    result = store.rebuild_customer_totals()
+    print(f"Rebuilt totals for {result['customers']} customers")
+    for name in result['mismatched_customers']:
+        print(f"  corrected {name}")
 
 # Analytics API
-@app.route('/api/analytics/sales')
-def get_sales_analytics():
-    data = load_data()
-    days = int(request.args.get('days', 30))
-    
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=days)
-    
-    daily_sales = {}
-    product_sales = defaultdict(float)
-    
-    for transaction in data['transactions']:
-        if transaction['type'] == 'sale':
-            try:
-                trans_date = datetime.strptime(transaction['date'], '%Y-%m-%d %H:%M:%S')
-                if start_date <= trans_date <= end_date:
-                    date_str = trans_date.strftime('%Y-%m-%d')
-                    daily_sales[date_str] = daily_sales.get(date_str, 0) + transaction.get('amount', 0)
-                    
-                    if 'items' in transaction:
-                        for item in transaction['items']:
-                            quantity = item.get('quantity', 1)
-                            price = item.get('price', 0)
-                            product_sales[item.get('name', 'Unknown')] += quantity * price
-            except:
-                continue
+@app.route('/api/analytics/sales/rebuild', methods=['POST'])
+def rebuild_sales_rollups():
+    """Recompute this worker's sales rollups and report days that had drifted"""
+    result = store.rebuild_sales_rollups()
+    clear_response_cache()
+    return jsonify(result)
+
+@app.route('/api/analytics/customers/rebuild', methods=['POST'])
+def rebuild_customer_totals():
+    """Recompute this worker's customer totals and report customers that had drifted"""
+    result = store.rebuild_customer_totals()
+    clear_response_cache()
+    return jsonify(result)
+
+GRANULARITIES = ('day', 'week', 'month')
+
+def parse_range_bound(name, value, end_of_day):
+    """Parse a from/to query value given as YYYY-MM-DD or YYYY-MM-DD HH:MM:SS"""
+    try:
+        if len(value) == 10:
+            day = datetime.strptime(value, '%Y-%m-%d')
+            return day.replace(hour=23, minute=59, second=59) if end_of_day else day
+        return datetime.strptime(value, DATE_FORMAT)
+    except ValueError:
+        raise ValueError(f"'{name}' must be YYYY-MM-DD or YYYY-MM-DD HH:MM:SS")
+
+def bucket_label(day, granularity):
+    """Return the label of the bucket `day` falls in: the day, its week's Monday or its month"""
+    if granularity == 'week':
+        return (day - timedelta(days=day.weekday())).isoformat()
+    if granularity == 'month':
+        return day.strftime('%Y-%m')
+    return day.isoformat()
+
+def sales_range_args():
+    """Read granularity and the from/to (or days) range of a sales query; raises ValueError"""
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    if 'to' in request.args:
+        end_date = parse_range_bound('to', request.args['to'], end_of_day=True)
+    else:
+        end_date = datetime.now()
+    if 'from' in request.args:
+        start_date = parse_range_bound('from', request.args['from'], end_of_day=False)
+    else:
+        start_date = end_date - timedelta(days=int(request.args.get('days', 30)))
+    if start_date > end_date:
+        raise ValueError("'from' must not be after 'to'")
+    return start_date, end_date, granularity
+
+def sales_report(start_date, end_date, granularity):
+    """Build the sales analytics payload for a date range"""
+    daily_sales = store.sales_by_day(start_date, end_date)
     
-    dates = []
-    sales = []
-    current_date = start_date
-    while current_date <= end_date:
-        date_str = current_date.strftime('%Y-%m-%d')
-        dates.append(date_str)
-        sales.append(daily_sales.get(date_str, 0))
-        current_date += timedelta(days=1)
+    buckets = OrderedDict()
+    day_count = 0
+    current_day = start_date.date()
+    while current_day <= end_date.date():
+        label = bucket_label(current_day, granularity)
+        buckets[label] = buckets.get(label, 0) + daily_sales.get(current_day.isoformat(), 0)
+        day_count += 1
+        current_day += timedelta(days=1)
+    sales = list(buckets.values())
     
-    top_products = sorted(product_sales.items(), key=lambda x: x[1], reverse=True)[:10]
+    top_products = store.sales_by_product(start_date, end_date, limit=10)
     
-    return jsonify({
-        'dates': dates,
+    return {
+        'dates': list(buckets),
         'sales': sales,
+        'granularity': granularity,
+        'from': start_date.strftime(DATE_FORMAT),
+        'to': end_date.strftime(DATE_FORMAT),
         'top_products': top_products,
         'total_sales': sum(sales),
-        'avg_daily_sales': sum(sales) / len(sales) if sales else 0
-    })
+        'avg_daily_sales': sum(sales) / day_count if day_count else 0
+    }
+
+@app.route('/api/analytics/sales')
+@cached_get(cache=True, time_bucket=60)
+def get_sales_analytics():
+    try:
+        start_date, end_date, granularity = sales_range_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(sales_report(start_date, end_date, granularity))
 
 @app.route('/api/analytics/balance')
+@cached_get(cache=True)
 def get_balance():
-    data = load_data()
-    
     try:
-        income = sum(t.get('amount', 0) for t in data['transactions'] if t.get('type') == 'sale')
-        expenses = sum(t.get('amount', 0) for t in data['transactions'] if t.get('type') in ['purchase', 'expense'])
-        stock_value = sum(p.get('price', 0) * p.get('stock', 0) for p in data['products'])
-        active_customers = len([c for c in data['customers'] if c.get('status') == 'active'])
-        gross_profit = income - expenses
+        totals = store.balance_totals()
         
         return jsonify({
-            'income': income,
-            'expenses': expenses,
-            'stock_value': stock_value,
-            'gross_profit': gross_profit,
-            'total_customers': len(data['customers']),
-            'total_active_customers': active_customers,
-            'total_products': len(data['products'])
+            'income': totals['income'],
+            'expenses': totals['expenses'],
+            'stock_value': totals['stock_value'],
+            'gross_profit': totals['income'] - totals['expenses'],
+            'total_customers': totals['total_customers'],
+            'total_active_customers': totals['total_active_customers'],
+            'total_products': totals['total_products']
         })
+    except LoadError:
+        raise
     except:
         return jsonify({
             'income': 0,
@@ -439,215 +1000,597 @@ def get_balance():
             'total_products': 0
         })
 
+# Live updates API
+event_streams = threading.BoundedSemaphore(EVENTS_MAX_STREAMS)
+
+@app.route('/api/events')
+def stream_events():
+    """Server-Sent Events stream of every change, whichever worker made it"""
+    if not event_streams.acquire(blocking=False):
+        return jsonify({"error": "Too many live update streams; try again shortly"}), 503, {'Retry-After': '5'}
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        # Bound now: the stream outlives the request context the tenant lives in
+        events = event_log.follow(last_event_id, duration=EVENTS_STREAM_SECONDS)
+    except Exception:
+        event_streams.release()
+        raise
+    
+    def generate():
+        yield "retry: 2000\n\n"
+        for event_id, event in events:
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            id_line = f"id: {event_id}\n" if event_id is not None else ""
+            yield f"{id_line}data: {json.dumps(event)}\n\n"
+    
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs once the server is done with the stream, even if it never started
+    response.call_on_close(event_streams.release)
+    return response
+
 # Notes API
 @app.route('/api/notes', methods=['GET'])
+@cached_get()
 def get_notes():
     data = load_data()
-    return jsonify(data['notes'])
+    return jsonify(project(data['notes'], requested_fields()))
 
 @app.route('/api/notes', methods=['POST'])
 def add_note():
-    data = load_data()
     note = request.json
     
     if not note.get('title'):
         return jsonify({"error": "Note title is required"}), 400
     
-    note['id'] = str(uuid.uuid4())
-    note['created_at'] = datetime.now().isoformat()
-    note['updated_at'] = note['created_at']
-    note.setdefault('content', '')
-    note.setdefault('category', 'General')
+    prepare_note(note)
     
-    data['notes'].append(note)
-    save_data(data)
+    store.insert('notes', note)
     return jsonify(note), 201
 
 @app.route('/api/notes/<note_id>', methods=['DELETE'])
 def delete_note(note_id):
-    data = load_data()
-    data['notes'] = [n for n in data['notes'] if n['id'] != note_id]
-    save_data(data)
+    store.delete('notes', note_id)
     return jsonify({"message": "Note deleted"}), 200
 
+# Search API
+@app.route('/api/search')
+def search():
+    """Ranked search over products, customers, transactions and notes.
+
+    q is matched per word against whole words and word prefixes; collections
+    is an optional comma-separated subset to search.
+    """
+    query = request.args.get('q', '')
+    collections = None
+    if request.args.get('collections'):
+        collections = set(request.args['collections'].split(','))
+        unknown = collections - set(SEARCH_FIELDS)
+        if unknown:
+            return jsonify({"error": f"Cannot search {', '.join(sorted(unknown))}"}), 400
+    
+    try:
+        limit = min(int(request.args.get('limit', 20)), MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    
+    total, matches = store.search(query, collections, limit)
+    return jsonify({
+        'query': query,
+        'total': total,
+        'results': [
+            {'collection': collection, 'score': score, 'record': record}
+            for score, collection, record in matches
+        ]
+    })
+
 # Export API
+# CSV header -> (record field, default) for each exportable collection
+EXPORT_COLUMNS = {
+    'products': [('id', 'id', ''), ('name', 'name', ''), ('category', 'category', ''),
+                 ('price', 'price', 0), ('stock', 'stock', 0), ('cost', 'cost', 0),
+                 ('supplier', 'supplier', '')],
+    'customers': [('id', 'id', ''), ('name', 'name', ''), ('email', 'email', ''),
+                  ('phone', 'contact', ''), ('type', 'type', 'Regular'),
+                  ('total_orders', 'total_orders', 0), ('total_spent', 'total_spent', 0),
+                  ('status', 'status', 'active')],
+    'transactions': [('id', 'id', ''), ('date', 'date', ''), ('type', 'type', ''),
+                     ('amount', 'amount', 0), ('customer', 'customer', ''),
+                     ('supplier', 'supplier', ''), ('description', 'description', '')]
+}
+EXPORT_CHUNK_ROWS = 500
+
+def csv_chunks(records, columns):
+    """Yield CSV text a few hundred rows at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([header for header, _, _ in columns])
+    rows = 0
+    for record in records:
+        writer.writerow([record.get(field, default) for _, field, default in columns])
+        rows += 1
+        if rows % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def gzip_chunks(chunks):
+    """Gzip a stream of text chunks without buffering the whole output"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode('utf-8'))
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
 @app.route('/api/export/csv/<export_type>')
 def export_csv(export_type):
-    data = load_data()
+    """Stream a CSV export; accepts the list filters (type, status, from/to, ...) and gzip=1"""
+    if export_type not in EXPORT_COLUMNS:
+        return jsonify({"error": "Invalid export type"}), 400
     
-    if export_type == 'products':
-        output = io.StringIO()
-        writer = csv.DictWriter(output, fieldnames=['id', 'name', 'category', 'price', 'stock', 'cost', 'supplier'])
-        writer.writeheader()
-        for product in data['products']:
-            row = {
-                'id': product.get('id', ''),
-                'name': product.get('name', ''),
-                'category': product.get('category', ''),
-                'price': product.get('price', 0),
-                'stock': product.get('stock', 0),
-                'cost': product.get('cost', 0),
-                'supplier': product.get('supplier', '')
-            }
-            writer.writerow(row)
-        output.seek(0)
-        
-        return send_file(
-            io.BytesIO(output.getvalue().encode()),
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name='products_export.csv'
-        )
-    
-    elif export_type == 'customers':
-        output = io.StringIO()
-        writer = csv.DictWriter(output, fieldnames=['id', 'name', 'email', 'phone', 'type', 'total_orders', 'total_spent', 'status'])
-        writer.writeheader()
-        for customer in data['customers']:
-            row = {
-                'id': customer.get('id', ''),
-                'name': customer.get('name', ''),
-                'email': customer.get('email', ''),
-                'phone': customer.get('contact', ''),
-                'type': customer.get('type', 'Regular'),
-                'total_orders': customer.get('total_orders', 0),
-                'total_spent': customer.get('total_spent', 0),
-                'status': customer.get('status', 'active')
-            }
-            writer.writerow(row)
-        output.seek(0)
-        
-        return send_file(
-            io.BytesIO(output.getvalue().encode()),
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name='customers_export.csv'
-        )
-    
-    elif export_type == 'transactions':
-        output = io.StringIO()
-        writer = csv.DictWriter(output, fieldnames=['id', 'date', 'type', 'amount', 'customer', 'supplier', 'description'])
-        writer.writeheader()
-        for transaction in data['transactions']:
-            row = {
-                'id': transaction.get('id', ''),
-                'date': transaction.get('date', ''),
-                'type': transaction.get('type', ''),
-                'amount': transaction.get('amount', 0),
-                'customer': transaction.get('customer', ''),
-                'supplier': transaction.get('supplier', ''),
-                'description': transaction.get('description', '')
-            }
-            writer.writerow(row)
-        output.seek(0)
-        
-        return send_file(
-            io.BytesIO(output.getvalue().encode()),
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name='transactions_export.csv'
-        )
+    try:
+        filters, date_from, date_to = list_filters(export_type)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    records = store.iter_records(export_type, filters, date_from, date_to)
+    chunks = csv_chunks(records, EXPORT_COLUMNS[export_type])
     
-    return jsonify({"error": "Invalid export type"}), 400
+    filename = f'{export_type}_export.csv'
+    mimetype = 'text/csv'
+    if request.args.get('gzip') in ('1', 'true'):
+        chunks = gzip_chunks(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    else:
+        chunks = (chunk.encode('utf-8') for chunk in chunks)
+    
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
 
 # Backup API
+# A full backup is stamped with the data version it was taken at, and
+# backup?since=<version> returns only the writes after that version, so
+# regular backups can be small. Restoring a full backup together with such
+# deltas rebuilds the data as of the newest delta or of an earlier point.
+def backup_since():
+    """Return the since= version of a delta backup, or None for a full one"""
+    since = request.args.get('since')
+    if since is None:
+        return None
+    try:
+        return int(since)
+    except ValueError:
+        raise ValueError("'since' must be the backup_version of an earlier backup")
+
+def backup_document(since=None):
+    """Return (backup, filename); raises LookupError if a delta since `since` can't be made"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if since is None:
+        # The version is read before the data, so the data may already hold
+        # a few later writes; replaying those from a delta is harmless
+        version = change_log.last_seq()
+        return {'backup_version': version, **load_data()}, f'business_backup_{timestamp}.json'
+    
+    changes = change_log.since(since)
+    version = changes[-1]['seq'] if changes else since
+    delta = {'backup_version': version, 'since': since, 'changes': changes}
+    return delta, f'business_backup_{timestamp}_changes_{since}-{version}.json'
+
 @app.route('/api/backup')
 def backup_data():
-    data = load_data()
-    backup_bytes = json.dumps(data, indent=2).encode('utf-8')
+    try:
+        backup, filename = backup_document(backup_since())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except LookupError as e:
+        return jsonify({"error": f"{e}; take a full backup instead"}), 410
+    backup_bytes = json.dumps(backup, indent=2).encode('utf-8')
     
     return send_file(
         io.BytesIO(backup_bytes),
         mimetype='application/json',
         as_attachment=True,
-        download_name=f'business_backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
+        download_name=filename
     )
 
-@app.route('/api/restore', methods=['POST'])
-def restore_data():
+# Restores stream the upload: records are parsed, validated and staged one
+# at a time, and the store swaps the new dataset in only if the whole file
+# could be read. Invalid records are skipped and reported. Deltas are small
+# and are read whole, then folded into the records as they stream past.
+RESTORE_PROGRESS_RECORDS = 1000
+
+def restore_upload():
+    """Return the uploaded backup file, or raise ValueError"""
     if 'file' not in request.files:
-        return jsonify({"error": "No file provided"}), 400
+        raise ValueError("No file provided")
     
     file = request.files['file']
     if file.filename == '':
-        return jsonify({"error": "No file selected"}), 400
-    
-    if file and file.filename.endswith('.json'):
+        raise ValueError("No file selected")
+    if not file.filename.endswith('.json'):
+        raise ValueError("Invalid file format. Please upload a JSON file")
+    return file
+
+def parse_until(until):
+    """Parse the until= point of a restore into a version, a datetime or None"""
+    if until is None:
+        return None
+    if until.isdigit():
+        return int(until)
+    return parse_range_bound('until', until, end_of_day=True)
+
+def read_deltas(streams):
+    """Load delta backups and join them into one chain; returns (since, writes)"""
+    deltas = []
+    for n, stream in enumerate(streams, 1):
         try:
-            data = json.load(file)
-            validated_data = validate_data(data)
-            save_data(validated_data)
-            return jsonify({"message": "Data restored successfully"}), 200
-        except:
-            return jsonify({"error": "Invalid JSON file"}), 400
+            delta = json.load(stream)
+        except ValueError:
+            raise ValueError(f"Delta {n} is not valid JSON")
+        if not (isinstance(delta, dict) and isinstance(delta.get('since'), int)
+                and isinstance(delta.get('backup_version'), int) and isinstance(delta.get('changes'), list)):
+            raise ValueError(f"Delta {n} is not a delta backup")
+        deltas.append(delta)
+    
+    deltas.sort(key=itemgetter('since'))
+    for previous, delta in zip(deltas, deltas[1:]):
+        if delta['since'] > previous['backup_version']:
+            raise ValueError(f"Changes between versions {previous['backup_version']} and {delta['since']} are missing")
+    # Deltas may overlap; each write is applied once, in order
+    writes = {}
+    for delta in deltas:
+        for write in delta['changes']:
+            writes[write['seq']] = write
+    return deltas[0]['since'], [writes[seq] for seq in sorted(writes)]
+
+def fold_writes(writes, until):
+    """Collapse writes up to `until` into {(collection, id): record, or None if deleted}.
+
+    Returns (changes, version of the last write folded in or None, writes folded in).
+    """
+    if isinstance(until, datetime):
+        until = until.isoformat(timespec='seconds')
+    changes = {}
+    version = None
+    folded = 0
+    for write in writes:
+        if until is not None and (write['seq'] if isinstance(until, int) else write['time']) > until:
+            break
+        for entry in write.get('entries', []):
+            collection = entry.get('collection')
+            if collection not in RECORD_VALIDATORS:
+                continue
+            if entry.get('op') == 'put':
+                record = RECORD_VALIDATORS[collection](entry['record'])
+                changes[(collection, record.get('id'))] = record
+            elif entry.get('op') == 'delete':
+                changes[(collection, entry.get('id'))] = None
+        version = write['seq']
+        folded += 1
+    return changes, version, folded
+
+def apply_changes(collection, records, changes):
+    """Replace or drop `records` that `changes` touches, then append the new ones"""
+    for record in records:
+        key = (collection, record.get('id'))
+        if key in changes:
+            record = changes.pop(key)
+            if record is None:
+                continue
+        yield record
+    for key in [key for key in changes if key[0] == collection]:
+        record = changes.pop(key)
+        if record is not None:
+            yield record
+
+def restore_records(collection, items, report, on_record):
+    """Validate the records of one collection as they are read, skipping bad ones"""
+    validate_record = RECORD_VALIDATORS[collection]
+    seen_ids = set()
+    restored = 0
+    for n, (_, _, record) in enumerate(items):
+        on_record()
+        if not isinstance(record, dict):
+            error = "Record must be a JSON object"
+        elif isinstance(record.get('id'), (list, dict)):
+            error = "id must be a number or a string"
+        elif 'id' in record and record['id'] in seen_ids:
+            error = f"Duplicate id {record['id']}"
+        else:
+            try:
+                record = validate_record(record)
+            except Exception as e:
+                error = str(e)
+            else:
+                if 'id' in record:
+                    seen_ids.add(record['id'])
+                restored += 1
+                report['restored'][collection] = restored
+                yield record
+                continue
+        report['failed'] += 1
+        if len(report['errors']) < MAX_IMPORT_ERRORS:
+            report['errors'].append({"collection": collection, "index": n, "error": error})
+
+def restore_backup(stream, deltas=(), until=None, progress=None):
+    """Replace the dataset with the backup JSON in binary `stream`; returns a report.
+
+    `deltas` are binary streams of delta backups to apply on top, up to the
+    version or datetime `until` if given. Raises ValueError, leaving the
+    data untouched, if the files are not readable or don't fit together.
+    """
+    reader = DocumentReader(io.TextIOWrapper(stream, encoding='utf-8-sig'))
+    report = {"restored": {}, "failed": 0, "errors": []}
+    records_read = [0]
+    changes = {}
+    if deltas:
+        since, writes = read_deltas(deltas)
+        changes, version, report['changes_applied'] = fold_writes(writes, until)
+    elif until is not None:
+        raise ValueError("'until' needs delta backups to apply")
+    
+    def check_base(base_version):
+        if not deltas:
+            report['version'] = base_version
+            return
+        if not isinstance(base_version, int):
+            raise ValueError("The backup has no backup_version to apply deltas to")
+        if since > base_version:
+            raise ValueError(f"Changes between versions {base_version} and {since} are missing")
+        if (version if version is not None else since) < base_version:
+            raise ValueError(f"The backup was taken at version {base_version}, after the requested point")
+        report['version'] = version if version is not None else base_version
     
-    return jsonify({"error": "Invalid file format. Please upload a JSON file"}), 400
+    def on_record():
+        records_read[0] += 1
+        if progress and records_read[0] % RESTORE_PROGRESS_RECORDS == 0:
+            progress(reader.position)
+    
+    def members():
+        nonlocal schema_version
+        base_version = None
+        for key, group in groupby(reader, key=itemgetter(1)):
+            kind, _, value = next(group)
+            if key == 'backup_version':
+                base_version = value
+                check_base(base_version)
+            elif key == 'schema_version':
+                if not isinstance(value, int):
+                    raise ValueError("'schema_version' must be a number")
+                if value > SCHEMA_VERSION:
+                    raise ValueError(f"The backup has data schema version {value}, newer than this app's")
+                schema_version = value
+            elif key in RECORD_VALIDATORS:
+                if kind != 'list':
+                    raise ValueError(f"'{key}' must be a list")
+                report['restored'][key] = 0
+                records = restore_records(key, group, report, on_record)
+                yield key, apply_changes(key, records, changes)
+            elif kind == 'list':
+                yield key, [item for _, _, item in group]
+            elif key == 'settings' and not isinstance(value, dict):
+                raise ValueError("'settings' must be an object")
+            else:
+                yield key, value
+        if base_version is None:
+            check_base(None)
+        # Keep the backup's own version so validate_data() runs the
+        # MIGRATIONS it is missing
+        yield 'schema_version', schema_version
+    
+    schema_version = 0
+    store.restore(members())
+    # Migrate now rather than on the next request
+    store.load()
+    return report
+
+@app.route('/api/restore', methods=['POST'])
+def restore_data():
+    try:
+        file = restore_upload()
+        deltas = [delta.stream for delta in request.files.getlist('deltas')]
+        report = restore_backup(file.stream, deltas, parse_until(request.args.get('until')))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return jsonify({"message": "Data restored successfully", **report}), 200
+
+# Background jobs API
+# POST /api/jobs/<kind> takes the same query parameters as the matching
+# synchronous endpoint; each kind reads them while the request is still
+# around and its job function runs later from those params alone.
+@jobs.register('backup')
+def run_backup_job(params, output_file, progress):
+    backup, filename = backup_document(params['since'])
+    with open(output_file, 'w') as f:
+        json.dump(backup, f, indent=2)
+    return filename, 'application/json'
+
+def export_job_params():
+    collection = request.args.get('collection')
+    if collection not in EXPORT_COLUMNS:
+        raise ValueError(f"collection must be one of {', '.join(EXPORT_COLUMNS)}")
+    filters, date_from, date_to = list_filters(collection)
+    return {'collection': collection, 'filters': filters, 'from': date_from, 'to': date_to,
+            'gzip': request.args.get('gzip') in ('1', 'true')}
+
+@jobs.register('export')
+def run_export_job(params, output_file, progress):
+    collection = params['collection']
+    
+    def counted(records):
+        for done, record in enumerate(records, 1):
+            if done % EXPORT_CHUNK_ROWS == 0:
+                progress(done)
+            yield record
+    
+    records = counted(store.iter_records(collection, params['filters'], params['from'], params['to']))
+    chunks = csv_chunks(records, EXPORT_COLUMNS[collection])
+    filename = f'{collection}_export.csv'
+    mimetype = 'text/csv'
+    if params['gzip']:
+        chunks = gzip_chunks(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    else:
+        chunks = (chunk.encode('utf-8') for chunk in chunks)
+    with open(output_file, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+    return filename, mimetype
+
+def restore_job_params():
+    # Uploads only live as long as the request, so keep copies for the job
+    file = restore_upload()
+    until = request.args.get('until')
+    parse_until(until)
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    upload_names = []
+    for upload in [file] + request.files.getlist('deltas'):
+        upload_names.append(f'upload-{uuid.uuid4().hex}.json')
+        upload.save(os.path.join(JOBS_DIR, upload_names[-1]))
+    return {'upload': upload_names[0], 'deltas': upload_names[1:], 'until': until}
+
+@jobs.register('restore')
+def run_restore_job(params, output_file, progress):
+    upload_files = [os.path.join(JOBS_DIR, name) for name in [params['upload']] + params['deltas']]
+    until = parse_until(params['until'])
+    try:
+        size = os.path.getsize(upload_files[0])
+        with ExitStack() as stack:
+            streams = [stack.enter_context(open(path, 'rb')) for path in upload_files]
+            report = restore_backup(streams[0], streams[1:], until, lambda done: progress(done, size))
+    finally:
+        for path in upload_files:
+            os.remove(path)
+    with open(output_file, 'w') as f:
+        json.dump(report, f)
+    return 'restore_report.json', 'application/json'
+
+def sales_report_job_params():
+    start_date, end_date, granularity = sales_range_args()
+    return {'from': start_date.strftime(DATE_FORMAT), 'to': end_date.strftime(DATE_FORMAT),
+            'granularity': granularity}
+
+@jobs.register('sales-report')
+def run_sales_report_job(params, output_file, progress):
+    report = sales_report(datetime.strptime(params['from'], DATE_FORMAT),
+                          datetime.strptime(params['to'], DATE_FORMAT), params['granularity'])
+    with open(output_file, 'w') as f:
+        json.dump(report, f)
+    return f"sales_report_{params['from'][:10]}_{params['to'][:10]}.json", 'application/json'
+
+JOB_PARAMS = {
+    'backup': lambda: {'since': backup_since()},
+    'export': export_job_params,
+    'restore': restore_job_params,
+    'sales-report': sales_report_job_params
+}
+
+def job_status(job):
+    """Return the client-facing view of a job"""
+    status = {key: job[key] for key in ('id', 'kind', 'params', 'status', 'progress', 'error', 'created_at',
+                                        'started_at', 'finished_at', 'expires_at', 'filename', 'size')}
+    status['url'] = f"{request.script_root}/api/jobs/{job['id']}"
+    if job['status'] == 'done':
+        status['download_url'] = f"{status['url']}/download"
+    return status
+
+@app.route('/api/jobs/<kind>', methods=['POST'])
+def submit_job(kind):
+    """Start a background job, or join the identical one that is already pending"""
+    if kind not in JOB_PARAMS:
+        return jsonify({"error": f"Unknown job type. Use one of {', '.join(JOB_PARAMS)}"}), 404
+    try:
+        params = JOB_PARAMS[kind]()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if tenants:
+        params['tenant'] = current_tenant_name()
+    
+    job, created = jobs.submit(kind, params)
+    status = job_status(job)
+    # 200 when joining a job another request already started
+    return jsonify(status), 202 if created else 200, {'Location': status['url']}
+
+def find_job(job_id):
+    """Return the job if it exists and belongs to the current tenant, else None"""
+    job = jobs.get(job_id)
+    if job is not None and tenants and job['params'].get('tenant') != current_tenant_name():
+        return None
+    return job
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    return jsonify(job_status(job))
+
+@app.route('/api/jobs/<job_id>/download')
+def download_job(job_id):
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    if job['status'] != 'done':
+        return jsonify({"error": f"Job is {job['status']}"}), 409
+    return send_file(jobs.artifact_path(job_id), mimetype=job['mimetype'],
+                     as_attachment=True, download_name=job['filename'])
+
+# Settings API
+@app.route('/api/settings')
+@cached_get()
+def get_settings():
+    """The business's own settings block (company name, currency, tax rate)"""
+    return jsonify(load_data()['settings'])
 
 # Dashboard API
 @app.route('/api/dashboard')
+@cached_get(cache=True)
 def get_dashboard_data():
-    data = load_data()
-    
-    total_sales = sum(t.get('amount', 0) for t in data['transactions'] if t.get('type') == 'sale')
-    active_customers = len([c for c in data['customers'] if c.get('status') == 'active'])
-    stock_value = sum(p.get('price', 0) * p.get('stock', 0) for p in data['products'])
-    expenses = sum(t.get('amount', 0) for t in data['transactions'] if t.get('type') in ['purchase', 'expense'])
-    gross_profit = total_sales - expenses
-    
-    recent_transactions = sorted(data['transactions'], key=lambda x: x.get('date', ''), reverse=True)[:5]
-    top_customers = sorted(data['customers'], key=lambda x: x.get('total_spent', 0), reverse=True)[:5]
-    
-    stock_alerts = []
-    for product in data['products']:
-        stock = product.get('stock', 0)
-        min_stock = product.get('min_stock', 5)
-        if stock <= min_stock:
-            alert = {
-                'name': product.get('name', ''),
-                'stock': stock,
-                'min_stock': min_stock,
-                'status': 'Out of Stock' if stock == 0 else 'Low Stock'
-            }
-            stock_alerts.append(alert)
-    
-    return jsonify({
-        'stats': {
-            'total_sales': total_sales,
-            'total_products': len(data['products']),
-            'total_customers': active_customers,
-            'stock_value': stock_value,
-            'gross_profit': gross_profit
-        },
-        'recent_transactions': recent_transactions,
-        'top_customers': top_customers,
-        'stock_alerts': stock_alerts
-    })
+    """Dashboard figures; fields=stats,stock_alerts computes only the sections named"""
+    sections = {
+        'stats': dashboard_stats,
+        'recent_transactions': lambda: store.recent_transactions(5),
+        'top_customers': lambda: store.top_customers(5),
+        'stock_alerts': lambda: store.stock_alerts()
+    }
+    fields = requested_fields() or list(sections)
+    return jsonify({name: sections[name]() for name in fields if name in sections})
+
+def dashboard_stats():
+    totals = store.balance_totals()
+    return {
+        'total_sales': totals['income'],
+        'total_products': totals['total_products'],
+        'total_customers': totals['total_active_customers'],
+        'stock_value': totals['stock_value'],
+        'gross_profit': totals['income'] - totals['expenses']
+    }
 
 # Customer Analytics API
 @app.route('/api/analytics/customers')
+@cached_get(cache=True)
 def get_customer_analytics():
-    data = load_data()
-    
-    customer_types = defaultdict(int)
-    for customer in data['customers']:
-        customer_type = customer.get('type', 'Regular')
-        customer_types[customer_type] += 1
-    
-    repeat_customers = len([c for c in data['customers'] if c.get('total_orders', 0) > 1])
-    repeat_rate = (repeat_customers / len(data['customers']) * 100) if data['customers'] else 0
+    stats = store.customer_stats()
     
-    total_spent = sum(c.get('total_spent', 0) for c in data['customers'])
-    total_orders = sum(c.get('total_orders', 0) for c in data['customers'])
-    avg_order_value = total_spent / total_orders if total_orders > 0 else 0
+    repeat_rate = (stats['repeat_customers'] / stats['total_customers'] * 100) if stats['total_customers'] else 0
+    avg_order_value = stats['total_spent'] / stats['total_orders'] if stats['total_orders'] > 0 else 0
     
-    top_customers = sorted(data['customers'], key=lambda x: x.get('total_spent', 0), reverse=True)[:5]
     top_customers_list = [
         {"name": c['name'], "total_spent": c.get('total_spent', 0), "total_orders": c.get('total_orders', 0)}
-        for c in top_customers
+        for c in store.top_customers(5)
     ]
     
     return jsonify({
-        'customer_distribution': dict(customer_types),
+        'customer_distribution': stats['customer_types'],
         'repeat_rate': repeat_rate,
         'avg_order_value': avg_order_value,
         'top_customers': top_customers_list,
@@ -0,0 +1,210 @@
+"""Full and delta backups.
+
+A backup is one JSON object whose collections can run to hundreds of
+megabytes, so DocumentReader walks it member by member and hands out the
+elements of array members one at a time. Only a single record (or a single
+non-array member such as "settings") is ever held in memory.
+
+ChangeLog numbers every write and keeps its record-level changes, so a
+delta backup only has to carry what changed since an earlier backup's
+version.
+"""
+import json
+
+from events import MAX_BYTES, EventLog
+
+CHUNK_SIZE = 64 * 1024
+# A single record or member larger than this is treated as malformed
+MAX_VALUE_CHARS = 16 * 1024 * 1024
+WHITESPACE = ' \t\n\r'
+
+class DocumentReader:
+    """Iterate over the members of a JSON object read from a text stream.
+
+    Yields ('list', key, None) when an array member starts, then
+    ('item', key, element) for each of its elements, and ('value', key,
+    value) for any other member. Raises ValueError if the document is not a
+    JSON object or is malformed; what was yielded before that stays valid.
+    """
+
+    def __init__(self, stream, chunk_size=CHUNK_SIZE, max_value_chars=MAX_VALUE_CHARS):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.max_value_chars = max_value_chars
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._consumed = 0
+        self._eof = False
+
+    @property
+    def position(self):
+        """Characters of the document read so far"""
+        return self._consumed + self._pos
+
+    def __iter__(self):
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+        else:
+            while True:
+                key = self._value()
+                if not isinstance(key, str):
+                    raise self._error("Expected a member name")
+                self._expect(':')
+                if self._peek() == '[':
+                    self._pos += 1
+                    yield 'list', key, None
+                    if self._peek() == ']':
+                        self._pos += 1
+                    else:
+                        while True:
+                            yield 'item', key, self._value()
+                            if self._next() == ']':
+                                break
+                            self._pos -= 1
+                            self._expect(',')
+                else:
+                    yield 'value', key, self._value()
+                if self._next() == '}':
+                    break
+                self._pos -= 1
+                self._expect(',')
+        if self._peek() != '':
+            raise self._error("Extra data after the document")
+
+    def _value(self):
+        """Decode the JSON value at the current position"""
+        self._peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError as e:
+                if self._eof or len(self._buf) - self._pos > self.max_value_chars:
+                    raise self._error(e.msg) from None
+            else:
+                # A number can run on into the next chunk
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return value
+            # Read ahead as much again as is buffered, so a large value is
+            # re-scanned a logarithmic number of times rather than once per chunk
+            self._fill(max(size, len(self._buf) - self._pos))
+            size *= 2
+
+    def _peek(self):
+        """Skip whitespace and return the next character, or '' at the end"""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if self._eof:
+                return ''
+            self._fill(self.chunk_size)
+
+    def _next(self):
+        char = self._peek()
+        self._pos += 1
+        return char
+
+    def _expect(self, char):
+        if self._next() != char:
+            self._pos -= 1
+            raise self._error(f"Expected '{char}'")
+
+    def _fill(self, size):
+        # Drop what has been consumed, then append the next chunk
+        self._consumed += self._pos
+        self._buf = self._buf[self._pos:]
+        self._pos = 0
+        chunk = self.stream.read(size)
+        if chunk:
+            self._buf += chunk
+        else:
+            self._eof = True
+
+    def _error(self, message):
+        return ValueError(f"{message} (character {self.position})")
+
+class ChangeLog(EventLog):
+    """Numbered, shared log of the records every write put or deleted.
+
+    Each line holds one write's changes as journal entries (see
+    storage.apply_journal); its seq is the data version after that write.
+    Replacing the whole dataset is logged as a reset, which no delta can
+    span. The file starts afresh past `max_bytes`, so only recent versions
+    can be used as the base of a delta.
+    """
+
+    def __init__(self, path, max_bytes=MAX_BYTES):
+        super().__init__(path, max_bytes)
+        self._missed = False
+
+    def listener(self, collection, changes):
+        """Store listener that logs every write.
+
+        A write that can't be logged would silently be left out of every
+        later delta, so a reset is logged in its place as soon as appending
+        works again, and until then since() refuses to build deltas.
+        """
+        if collection is None:
+            event = {'reset': True}
+        else:
+            entries = []
+            for old, new in changes:
+                if new is None:
+                    entries.append({'op': 'delete', 'collection': collection, 'id': old.get('id')})
+                else:
+                    entries.append({'op': 'put', 'collection': collection, 'record': new})
+            event = {'entries': entries}
+        if self._missed:
+            self._log_missed()
+        try:
+            self.publish(event)
+        except Exception:
+            self._missed = True
+            self._log_missed()
+            raise
+
+    def _log_missed(self):
+        try:
+            self.publish({'reset': True})
+        except Exception as e:
+            print(f"Error logging a missed change: {e}")
+        else:
+            self._missed = False
+
+    def since(self, version):
+        """Return the logged writes after `version`, oldest first.
+
+        Raises LookupError if they are no longer all in the log, or if the
+        dataset was replaced since then.
+        """
+        if self._missed:
+            raise LookupError("A write could not be logged")
+        changes = []
+        try:
+            with open(self.path, 'rb') as f:
+                lines = f.read().split(b'\n')
+        except FileNotFoundError:
+            lines = []
+        newest = None
+        for line in lines:
+            try:
+                change = json.loads(line)
+            except ValueError:
+                continue
+            # A rotated file opens with a copy of the previous file's last line
+            if newest is None and version < change['seq'] - 1:
+                raise LookupError(f"Changes after version {version} are no longer kept")
+            newest = change['seq']
+            if newest <= version:
+                continue
+            if change.get('reset'):
+                raise LookupError(f"The data was replaced after version {version}")
+            changes.append(change)
+        if version > (newest or 0):
+            raise LookupError(f"Version {version} is newer than the data")
+        return changes
@@ -0,0 +1,11 @@
+"""Benchmarks for Business Suite Pro.
+
+- generate: write synthetic business_data.json files of a given size
+- run: drive every route and report latency percentiles, throughput and
+  peak memory, optionally comparing against a saved baseline
+- concurrency: POST from several processes at once and check that no id
+  was handed out twice and no write was lost
+
+    python -m benchmarks.generate --size 100k --output data/bench_100k.json
+    python -m benchmarks.run --data data/bench_100k.json --baseline benchmarks/baselines/100k.json
+"""
@@ -0,0 +1,105 @@
+"""Hammer the write endpoints from several processes and check nothing was lost.
+
+Each worker process imports the app against the same data file (as gunicorn
+workers would) and POSTs records as fast as it can. Afterwards every id a
+worker was handed must exist exactly once, and the collection must have
+grown by exactly the number of successful POSTs.
+
+    python -m benchmarks.concurrency --backend journal --workers 8 --requests 200
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINTS = {
+    'transactions': lambda worker, i: {"type": "sale", "amount": 100, "customer": f"Worker {worker}",
+                                       "items": [{"name": "Stress item", "quantity": 1, "price": 100}]},
+    'customers': lambda worker, i: {"name": f"Worker {worker} customer {i}"},
+    'products': lambda worker, i: {"name": f"Worker {worker} product {i}", "price": 10, "stock": 1},
+}
+
+def configure(workdir, backend):
+    os.environ['DATA_FILE'] = os.path.join(workdir, 'business_data.json')
+    os.environ['SQLITE_FILE'] = os.path.join(workdir, 'business_data.db')
+    os.environ['STORAGE_BACKEND'] = backend
+    # Compact often so snapshots are rewritten while other workers append
+    os.environ['JOURNAL_COMPACT_THRESHOLD'] = '50'
+    sys.path.insert(0, ROOT)
+
+def worker(workdir, backend, worker_id, requests, start, results):
+    configure(workdir, backend)
+    import app as app_module
+    client = app_module.app.test_client()
+    start.wait()
+
+    ids, failures = {collection: [] for collection in ENDPOINTS}, 0
+    for i in range(requests):
+        for collection, body in ENDPOINTS.items():
+            response = client.post(f'/api/{collection}', json=body(worker_id, i))
+            if response.status_code == 201:
+                ids[collection].append(response.get_json()['id'])
+            else:
+                failures += 1
+    results.put((ids, failures))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', default='json', choices=['json', 'journal', 'sqlite'])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=50, help='POSTs per worker and collection')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bizsuite-stress-')
+    configure(workdir, args.backend)
+    import app as app_module
+    before = {collection: len(app_module.load_data()[collection]) for collection in ENDPOINTS}
+
+    ctx = multiprocessing.get_context('spawn')
+    start, results = ctx.Event(), ctx.Queue()
+    processes = [ctx.Process(target=worker, args=(workdir, args.backend, n, args.requests, start, results))
+                 for n in range(args.workers)]
+    for process in processes:
+        process.start()
+    # Let every worker finish importing so they really do write at once
+    time.sleep(2)
+    started = time.perf_counter()
+    start.set()
+    reports = [results.get() for _ in processes]
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join()
+
+    app_module.store.invalidate()
+    data = app_module.load_data()
+    ok = True
+    for collection in ENDPOINTS:
+        handed_out = [i for ids, _ in reports for i in ids[collection]]
+        stored = Counter(r['id'] for r in data[collection])
+        duplicates = [i for i, count in Counter(handed_out).items() if count > 1]
+        duplicates += [i for i, count in stored.items() if count > 1]
+        missing = [i for i in handed_out if i not in stored]
+        growth = len(data[collection]) - before[collection]
+        print(f"{collection}: {len(handed_out)} created, grew by {growth}, "
+              f"{len(set(duplicates))} duplicate ids, {len(missing)} lost")
+        if duplicates or missing or growth != len(handed_out):
+            ok = False
+
+    failures = sum(f for _, f in reports)
+    total = args.workers * args.requests * len(ENDPOINTS)
+    print(f"{total} writes from {args.workers} processes in {elapsed:.2f}s "
+          f"({total / elapsed:.0f} writes/s), {failures} failed requests")
+    shutil.rmtree(workdir, ignore_errors=True)
+    if not ok or failures:
+        print("FAILED")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Write a synthetic business_data.json with realistic proportions.
+
+Products, customers and suppliers scale with the number of transactions.
+Transactions are streamed to the file one at a time, so a million-row
+dataset doesn't have to fit in memory while it is generated.
+"""
+import argparse
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+CATEGORIES = ['Drums', 'Tanks', 'Buckets', 'Jerrycans', 'Basins', 'Crates', 'Pipes', 'Fittings']
+CITIES = ['Nairobi', 'Mombasa', 'Kisumu', 'Nakuru', 'Eldoret', 'Thika', 'Machakos']
+FIRST_NAMES = ['John', 'Jane', 'Peter', 'Mary', 'Robert', 'Grace', 'David', 'Faith', 'James', 'Susan']
+LAST_NAMES = ['Doe', 'Smith', 'Otieno', 'Wanjiru', 'Kimani', 'Achieng', 'Mwangi', 'Njeri', 'Omondi']
+PAYMENT_METHODS = ['M-Pesa', 'Cash', 'Bank Transfer', 'Card']
+# sale-heavy mix, like a shop's real ledger
+TRANSACTION_TYPES = ['sale'] * 14 + ['purchase'] * 3 + ['expense'] * 2 + ['refund']
+
+def make_products(rng, count, suppliers):
+    products = []
+    for i in range(1, count + 1):
+        category = rng.choice(CATEGORIES)
+        cost = rng.randint(50, 5000)
+        products.append({
+            "id": i, "name": f"{category[:-1]} {i} ({rng.randint(5, 500)}L)",
+            "price": round(cost * rng.uniform(1.2, 1.8)), "stock": rng.randint(0, 200),
+            "cost": cost, "category": category, "supplier": rng.choice(suppliers)["name"],
+            "min_stock": rng.randint(2, 10), "max_stock": rng.randint(50, 300),
+            "barcode": f"BC{i:08d}", "unit": "piece", "sku": f"{category[:4].upper()}-{i:05d}",
+            "description": f"{category[:-1]} product {i}", "status": "active",
+            "last_updated": "2024-01-01T00:00:00"
+        })
+    return products
+
+def make_customers(rng, count):
+    customers = []
+    for i in range(1, count + 1):
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}"
+        city = rng.choice(CITIES)
+        customers.append({
+            "id": i, "name": name, "contact": f"07{rng.randint(10000000, 99999999)}",
+            "email": f"customer{i}@example.com", "total_spent": 0, "total_orders": 0,
+            "last_order": "", "type": rng.choice(['Regular', 'Regular', 'VIP', 'Wholesale']),
+            "address": f"{rng.randint(1, 999)} Main St, {city}", "city": city, "country": "Kenya",
+            "status": rng.choice(['active'] * 9 + ['inactive']), "join_date": "2023-01-01"
+        })
+    return customers
+
+def make_suppliers(rng, count):
+    return [
+        {"id": i, "name": f"Supplier {i} Ltd", "contact": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+         "email": f"sales@supplier{i}.co.ke", "phone": f"07{rng.randint(10000000, 99999999)}",
+         "products": [], "status": "active", "address": f"Industrial Area, {rng.choice(CITIES)}"}
+        for i in range(1, count + 1)
+    ]
+
+def make_notes(rng, count):
+    return [
+        {"id": str(i), "title": f"Note {i}", "content": f"Follow up on order batch {i}",
+         "category": rng.choice(['Meeting', 'Task', 'Idea', 'General']),
+         "priority": rng.choice(['low', 'medium', 'high']),
+         "created_at": "2024-01-01T09:00:00", "updated_at": "2024-01-01T09:00:00"}
+        for i in range(1, count + 1)
+    ]
+
+def make_transaction(rng, transaction_id, date, products, customers, suppliers):
+    transaction_type = rng.choice(TRANSACTION_TYPES)
+    transaction = {
+        "id": transaction_id, "date": date.strftime('%Y-%m-%d %H:%M:%S'), "type": transaction_type,
+        "amount": 0, "customer": "", "supplier": "", "items": [], "description": "",
+        "payment_method": rng.choice(PAYMENT_METHODS), "status": "completed"
+    }
+    if transaction_type in ('sale', 'refund'):
+        items = []
+        for product in rng.sample(products, rng.randint(1, min(3, len(products)))):
+            items.append({"name": product["name"], "quantity": rng.randint(1, 5), "price": product["price"]})
+        transaction["customer"] = rng.choice(customers)["name"]
+        transaction["amount"] = sum(item["quantity"] * item["price"] for item in items)
+        transaction["description"] = f"{transaction_type.title()} of {len(items)} item(s)"
+        if transaction_type == 'sale':
+            transaction["items"] = items
+    else:
+        transaction["supplier"] = rng.choice(suppliers)["name"]
+        transaction["amount"] = rng.randint(500, 50000)
+        transaction["description"] = 'Restock' if transaction_type == 'purchase' else 'Operating expense'
+    return transaction
+
+def generate(path, transactions, seed=42, years=3):
+    """Write a dataset with `transactions` ledger rows spread over `years` to `path`"""
+    rng = random.Random(seed)
+    suppliers = make_suppliers(rng, max(5, transactions // 5000))
+    products = make_products(rng, max(50, transactions // 200), suppliers)
+    customers = make_customers(rng, max(20, transactions // 20))
+    notes = make_notes(rng, max(10, transactions // 1000))
+
+    end = datetime.now().replace(microsecond=0)
+    start = end - timedelta(days=365 * years)
+    step = (end - start) / max(transactions, 1)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write('{')
+        for key, records in (("products", products), ("customers", customers),
+                             ("suppliers", suppliers), ("notes", notes)):
+            f.write(f'"{key}": {json.dumps(records)}, ')
+        f.write('"settings": {"tax_rate": 16.0, "currency": "KES", "company_name": "Business Suite Pro"}, ')
+        f.write('"transactions": [')
+        for i in range(transactions):
+            if i:
+                f.write(', ')
+            transaction = make_transaction(rng, i + 1, start + step * i, products, customers, suppliers)
+            f.write(json.dumps(transaction))
+        f.write(']}')
+
+    return {"products": len(products), "customers": len(customers), "suppliers": len(suppliers),
+            "notes": len(notes), "transactions": transactions}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', choices=sorted(SIZES), default='10k',
+                        help='number of transactions (ignored if --transactions is given)')
+    parser.add_argument('--transactions', type=int, help='exact number of transactions')
+    parser.add_argument('--output', help='file to write (default: data/bench_<size>.json)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    transactions = args.transactions or SIZES[args.size]
+    output = args.output or os.path.join('data', f'bench_{args.size}.json')
+    counts = generate(output, transactions, seed=args.seed)
+    print(f"Wrote {output}: " + ", ".join(f"{count} {key}" for key, count in counts.items()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""Drive every route and report latency percentiles, throughput and memory.
+
+By default requests go through Flask's test client against a temporary copy
+of the dataset, so writes made by the benchmark never touch the original.
+With --url the same requests are sent to a running server instead (e.g. a
+local `gunicorn app:app`).
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+# Latency growth over the baseline that counts as a regression
+REGRESSION_THRESHOLD = 1.25
+# Differences below this are noise regardless of the ratio
+REGRESSION_MIN_MS = 1.0
+
+def scenarios():
+    """Return (name, method, path, json body or None) for every route"""
+    counter = iter(range(10 ** 9))
+    return [
+        ('health', 'GET', '/api/health', None),
+        ('products', 'GET', '/api/products', None),
+        ('products_page', 'GET', '/api/products?limit=50&sort=-price', None),
+        ('customers', 'GET', '/api/customers', None),
+        ('customers_page', 'GET', '/api/customers?limit=50&status=active', None),
+        ('transactions', 'GET', '/api/transactions', None),
+        ('transactions_page', 'GET', '/api/transactions?limit=50&type=sale&sort=-date', None),
+        ('suppliers', 'GET', '/api/suppliers', None),
+        ('notes', 'GET', '/api/notes', None),
+        ('dashboard', 'GET', '/api/dashboard', None),
+        ('analytics_sales_30d', 'GET', '/api/analytics/sales?days=30', None),
+        ('analytics_sales_365d', 'GET', '/api/analytics/sales?days=365', None),
+        ('analytics_balance', 'GET', '/api/analytics/balance', None),
+        ('analytics_customers', 'GET', '/api/analytics/customers', None),
+        ('search', 'GET', '/api/search?q=drum', None),
+        ('export_transactions', 'GET', '/api/export/csv/transactions', None),
+        ('backup', 'GET', '/api/backup', None),
+        ('add_product', 'POST', '/api/products',
+         lambda: {"name": f"Bench product {next(counter)}", "price": "100", "stock": "5"}),
+        ('add_customer', 'POST', '/api/customers',
+         lambda: {"name": f"Bench customer {next(counter)}", "email": "bench@example.com"}),
+        ('add_transaction', 'POST', '/api/transactions',
+         lambda: {"type": "sale", "amount": "250", "customer": "Bench customer",
+                  "items": [{"name": "Bench product", "quantity": 1, "price": 250}]}),
+        ('add_note', 'POST', '/api/notes', lambda: {"title": f"Bench note {next(counter)}"}),
+    ]
+
+class TestClientDriver:
+    """Send requests through Flask's test client in this process"""
+
+    def __init__(self, data_file, backend, response_cache=True):
+        self.workdir = tempfile.mkdtemp(prefix='bizsuite-bench-')
+        if not response_cache:
+            os.environ['RESPONSE_CACHE_SIZE'] = '0'
+        os.environ['DATA_FILE'] = os.path.join(self.workdir, 'business_data.json')
+        os.environ['SQLITE_FILE'] = os.path.join(self.workdir, 'business_data.db')
+        os.environ['STORAGE_BACKEND'] = backend
+        shutil.copyfile(data_file, os.environ['DATA_FILE'])
+
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import app as app_module
+        if backend == 'sqlite':
+            from storage import migrate_json_to_sqlite
+            migrate_json_to_sqlite(os.environ['DATA_FILE'], os.environ['SQLITE_FILE'],
+                                   app_module.validate_data, app_module.get_default_data)
+        self.client = app_module.app.test_client()
+
+    def request(self, method, path, body):
+        response = self.client.open(path, method=method, json=body)
+        data = response.get_data()
+        return response.status_code, len(data)
+
+    def close(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+class HttpDriver:
+    """Send requests to a running server"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'} if data else {})
+        try:
+            with urllib.request.urlopen(req) as response:
+                return response.status, len(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, len(e.read())
+
+    def close(self):
+        pass
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def run_scenario(driver, method, path, body_factory, requests, trace_memory):
+    """Time one cold request and then `requests` warm ones"""
+    if trace_memory:
+        tracemalloc.start()
+
+    started = time.perf_counter()
+    status, size = driver.request(method, path, body_factory() if body_factory else None)
+    cold_ms = (time.perf_counter() - started) * 1000
+
+    latencies = []
+    wall_start = time.perf_counter()
+    for _ in range(requests):
+        started = time.perf_counter()
+        status, size = driver.request(method, path, body_factory() if body_factory else None)
+        latencies.append((time.perf_counter() - started) * 1000)
+    wall = time.perf_counter() - wall_start
+
+    result = {
+        'status': status,
+        'bytes': size,
+        'requests': requests,
+        'cold_ms': round(cold_ms, 3),
+        'mean_ms': round(statistics.mean(latencies), 3),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'rps': round(requests / wall, 1) if wall else None,
+    }
+    if trace_memory:
+        result['peak_alloc_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+        tracemalloc.stop()
+    return result
+
+def compare(results, baseline):
+    """Return [(endpoint, baseline p50, current p50)] for endpoints that got slower"""
+    regressions = []
+    for name, current in results['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if not previous:
+            continue
+        before, after = previous['p50_ms'], current['p50_ms']
+        if after > before * REGRESSION_THRESHOLD and after - before > REGRESSION_MIN_MS:
+            regressions.append((name, before, after))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data', required=True, help='dataset from benchmarks.generate')
+    parser.add_argument('--backend', default='json', choices=['json', 'journal', 'sqlite'])
+    parser.add_argument('--url', help='benchmark a running server instead of the test client')
+    parser.add_argument('--requests', type=int, default=20, help='warm requests per endpoint')
+    parser.add_argument('--only', help='comma-separated endpoint names to run')
+    parser.add_argument('--no-response-cache', action='store_true',
+                        help='disable the server-side response cache so every request recomputes')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='record peak Python allocations per endpoint (slower)')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against results saved earlier')
+    args = parser.parse_args()
+
+    if args.url:
+        driver = HttpDriver(args.url)
+    else:
+        driver = TestClientDriver(args.data, args.backend, response_cache=not args.no_response_cache)
+    only = set(args.only.split(',')) if args.only else None
+
+    results = {
+        'meta': {
+            'data': os.path.basename(args.data),
+            'data_bytes': os.path.getsize(args.data),
+            'backend': args.backend,
+            'target': args.url or 'test-client',
+            'response_cache': not args.no_response_cache,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+        },
+        'endpoints': {},
+    }
+    try:
+        print(f"{'endpoint':<24}{'status':>7}{'cold ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+        for name, method, path, body_factory in scenarios():
+            if only and name not in only:
+                continue
+            result = run_scenario(driver, method, path, body_factory, args.requests, args.trace_memory)
+            results['endpoints'][name] = result
+            print(f"{name:<24}{result['status']:>7}{result['cold_ms']:>10.2f}{result['p50_ms']:>10.2f}"
+                  f"{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}{result['rps'] or 0:>10.1f}")
+    finally:
+        driver.close()
+
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results['meta']['peak_rss_mb'] = round(peak_rss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+    print(f"peak RSS: {results['meta']['peak_rss_mb']} MB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f))
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: p50 {before:.2f} ms -> {after:.2f} ms")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against baseline")
+
+if __name__ == '__main__':
+    main()
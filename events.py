@@ -0,0 +1,198 @@
+"""Change events shared between gunicorn workers through an append-only file.
+
+The worker that makes a write appends one numbered JSON line describing it
+to the events file; every worker's /api/events stream tails that file, so all
+connected clients hear about every write without a message broker. The
+sequence number doubles as the SSE event id, which lets a reconnecting
+EventSource resume where it left off via Last-Event-ID.
+"""
+import json
+import os
+import time
+from datetime import datetime
+
+from storage import EXPENSE_TYPES, file_lock
+
+# The file is started afresh once it grows past this
+MAX_BYTES = 1024 * 1024
+
+def contribution(collection, record):
+    """Return the dashboard figures a single record adds to"""
+    if record is None:
+        return {}
+    if collection == 'transactions':
+        amount = record.get('amount', 0)
+        if record.get('type') == 'sale':
+            return {'income': amount}
+        if record.get('type') in EXPENSE_TYPES:
+            return {'expenses': amount}
+        return {}
+    if collection == 'products':
+        return {'total_products': 1, 'stock_value': record.get('price', 0) * record.get('stock', 0)}
+    if collection == 'customers':
+        return {'total_customers': 1, 'total_active_customers': 1 if record.get('status') == 'active' else 0}
+    return {}
+
+def stats_delta(collection, changes):
+    """Sum how a list of (old, new) record changes moves the dashboard figures"""
+    delta = {}
+    for old, new in changes:
+        for key, value in contribution(collection, new).items():
+            delta[key] = delta.get(key, 0) + value
+        for key, value in contribution(collection, old).items():
+            delta[key] = delta.get(key, 0) - value
+    return {key: value for key, value in delta.items() if value}
+
+def change_event(collection, changes):
+    """Describe a write as an event: one record in full, or a count for bulk writes"""
+    if collection is None:
+        return {'type': 'reset'}
+    event = {'collection': collection, 'delta': stats_delta(collection, changes)}
+    if len(changes) != 1:
+        event.update(type=f'{collection}.changed', count=len(changes))
+        return event
+
+    old, new = changes[0]
+    name = collection[:-1]
+    if new is None:
+        event.update(type=f'{name}.deleted', id=old.get('id'))
+    elif old is None:
+        event.update(type=f'{name}.created', record=new)
+    elif collection == 'products' and old.get('stock') != new.get('stock'):
+        event.update(type='product.stock_changed', record=new, previous_stock=old.get('stock'))
+    else:
+        event.update(type=f'{name}.updated', record=new)
+    return event
+
+class EventLog:
+    """Append numbered events to a shared file and follow it"""
+
+    def __init__(self, path, max_bytes=MAX_BYTES):
+        self.path = path
+        self.lock_file = f"{path}.lock"
+        self.max_bytes = max_bytes
+
+    def publish(self, event):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with file_lock(self.lock_file):
+            last_seq, last_line = _last_event(self.path)
+            event['seq'] = last_seq + 1
+            event['time'] = datetime.now().isoformat(timespec='seconds')
+            line = (json.dumps(event, separators=(',', ':')) + '\n').encode('utf-8')
+            if last_line and os.path.getsize(self.path) > self.max_bytes:
+                # The new file starts with the last event again so the
+                # numbering carries over; followers skip what they've seen
+                tmp_file = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_file, 'wb') as f:
+                    f.write(last_line + b'\n')
+                os.replace(tmp_file, self.path)
+            with open(self.path, 'ab+') as f:
+                size = f.seek(0, os.SEEK_END)
+                if size:
+                    f.seek(size - 1)
+                    if f.read(1) != b'\n':
+                        # Terminate a torn line left by a crash so it stays isolated
+                        line = b'\n' + line
+                f.write(line)
+
+    def listener(self, collection, changes):
+        """Store listener that publishes every write"""
+        self.publish(change_event(collection, changes))
+
+    def last_seq(self):
+        """Return the number of the newest event, or 0 if there is none"""
+        return _last_event(self.path)[0]
+
+    def follow(self, last_event_id=None, duration=300, poll_interval=0.5, heartbeat=15):
+        """Yield (seq, event) as events are published, and (None, None) as a keep-alive.
+
+        Resumes after `last_event_id` (an earlier seq) if given, otherwise
+        starts with the next event. When events were missed, because the
+        file moved on while this follower lagged or the client resumed too
+        late, a (None, reset event) tells the client to reload.
+        """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        open(self.path, 'ab').close()
+        f = open(self.path, 'rb')
+        try:
+            last_seq, last_line = _last_event(self.path)
+            try:
+                expected = int(last_event_id) + 1
+            except (TypeError, ValueError):
+                expected = last_seq + 1 if last_line else None
+                f.seek(0, os.SEEK_END)
+            else:
+                if expected > last_seq + 1:
+                    # The client saw events this file never had: it was replaced
+                    yield None, {'type': 'reset'}
+                    expected = last_seq + 1
+                    f.seek(0, os.SEEK_END)
+            inode = os.fstat(f.fileno()).st_ino
+
+            deadline = time.monotonic() + duration
+            last_sent = time.monotonic()
+            pending = b''
+            while time.monotonic() < deadline:
+                chunk = f.read()
+                if not chunk and self._rotated(inode):
+                    # Nothing reaches the old file once it is replaced, so
+                    # one more read is all that is left of it
+                    chunk = f.read()
+                    if not chunk:
+                        f.close()
+                        f = open(self.path, 'rb')
+                        inode, pending = os.fstat(f.fileno()).st_ino, b''
+                        continue
+                if not chunk:
+                    if time.monotonic() - last_sent >= heartbeat:
+                        yield None, None
+                        last_sent = time.monotonic()
+                    time.sleep(poll_interval)
+                    continue
+
+                pending += chunk
+                *lines, pending = pending.split(b'\n')
+                for line in lines:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    seq = event.get('seq', 0)
+                    if expected is not None and seq < expected:
+                        continue
+                    if expected is not None and seq > expected:
+                        yield None, {'type': 'reset'}
+                    expected = seq + 1
+                    yield seq, event
+                    last_sent = time.monotonic()
+        finally:
+            f.close()
+
+    def _rotated(self, inode):
+        try:
+            return os.stat(self.path).st_ino != inode
+        except FileNotFoundError:
+            return False
+
+def _last_event(path):
+    """Return (seq, line) for the last readable event in `path`, or (0, None)"""
+    try:
+        with open(path, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            block = 4096
+            while True:
+                start = max(0, size - block)
+                f.seek(start)
+                lines = f.read(size - start).split(b'\n')
+                # The first piece may be cut by the block boundary and the last
+                # is whatever follows the final newline (b'' or a torn write)
+                for line in reversed(lines[1 if start else 0:-1]):
+                    try:
+                        return json.loads(line)['seq'], line
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                if not start:
+                    return 0, None
+                block *= 4
+    except FileNotFoundError:
+        return 0, None
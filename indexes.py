@@ -0,0 +1,761 @@
+"""Derived in-memory indexes maintained alongside the JSON stores.
+
+An index is built once from the full dataset and then kept current by the
+store, which reports every record it adds or removes. Updates are reported
+as a removal of the old record followed by an addition of the new one.
+"""
+import bisect
+import heapq
+import re
+from array import array
+from collections import defaultdict
+from datetime import datetime, time
+
+try:
+    import numpy
+except ImportError:  # optional: aggregates fall back to plain loops
+    numpy = None
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Transaction dates have whole-second precision, so this ends a day
+LAST_SECOND = time(23, 59, 59)
+EPOCH = datetime(1970, 1, 1)
+# How many of the latest transactions and the biggest spenders are kept
+# ranked between writes; larger requests are computed from scratch
+RECENT_CAPACITY = 50
+TOP_CAPACITY = 50
+
+def parse_date(value):
+    """Parse a transaction date, returning None for anything malformed"""
+    try:
+        return datetime.strptime(value, DATE_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+def item_revenue(transaction):
+    """Yield (product name, revenue) for each line item of a transaction"""
+    try:
+        for item in transaction.get('items') or []:
+            yield item.get('name', 'Unknown'), item.get('quantity', 1) * item.get('price', 0)
+    except Exception:
+        # Same as the original scan: a malformed item ends the transaction's items
+        return
+
+class DerivedIndex:
+    """Base class for indexes kept in step with store mutations"""
+
+    # Collections whose changes this index needs to hear about
+    collections = ()
+
+    def rebuild(self, data):
+        raise NotImplementedError
+
+    def added(self, collection, record):
+        raise NotImplementedError
+
+    def removed(self, collection, record):
+        raise NotImplementedError
+
+class SalesRollup(DerivedIndex):
+    """Per-day sales totals and per-day, per-product revenue.
+
+    `days` lists the days that have sales in order, so a date range is a
+    binary search plus a slice however long the history is. Whole days in a
+    range are answered from the rollups; the first and last day of a range
+    are partial, so they are summed from that day's sales.
+    """
+
+    collections = ('transactions',)
+
+    def rebuild(self, data):
+        self.days = []
+        self.daily = {}
+        self.products = defaultdict(lambda: defaultdict(float))
+        self.product_items = defaultdict(lambda: defaultdict(int))
+        self.sales = defaultdict(list)
+        for transaction in data['transactions']:
+            self.added('transactions', transaction)
+        return self
+
+    def added(self, collection, transaction):
+        if transaction.get('type') != 'sale':
+            return
+        trans_date = parse_date(transaction.get('date'))
+        if trans_date is None:
+            return
+        day = transaction['date'][:10]
+        if day not in self.daily:
+            bisect.insort(self.days, day)
+        self.daily[day] = self.daily.get(day, 0) + transaction.get('amount', 0)
+        for name, revenue in item_revenue(transaction):
+            self.products[day][name] += revenue
+            self.product_items[day][name] += 1
+        self.sales[day].append((trans_date, transaction))
+
+    def removed(self, collection, transaction):
+        if transaction.get('type') != 'sale' or parse_date(transaction.get('date')) is None:
+            return
+        day = transaction['date'][:10]
+        sales = self.sales.get(day, [])
+        for i, (_, sale) in enumerate(sales):
+            if sale is transaction or sale.get('id') == transaction.get('id'):
+                del sales[i]
+                break
+        else:
+            return
+
+        if not sales:
+            # Drop the day outright so float residue can't accumulate
+            del self.sales[day]
+            del self.days[bisect.bisect_left(self.days, day)]
+            self.daily.pop(day, None)
+            self.products.pop(day, None)
+            self.product_items.pop(day, None)
+            return
+        self.daily[day] -= transaction.get('amount', 0)
+        products, product_items = self.products[day], self.product_items[day]
+        for name, revenue in item_revenue(transaction):
+            products[name] -= revenue
+            product_items[name] -= 1
+            if not product_items[name]:
+                del products[name], product_items[name]
+
+    def sales_by_day(self, start, end):
+        daily_sales = {}
+        for day, whole in self._days(start, end):
+            if whole:
+                daily_sales[day] = self.daily[day]
+                continue
+            in_range = [sale for trans_date, sale in self.sales[day] if start <= trans_date <= end]
+            if in_range:
+                daily_sales[day] = sum(sale.get('amount', 0) for sale in in_range)
+        return daily_sales
+
+    def sales_by_product(self, start, end, limit=10):
+        product_sales = defaultdict(float)
+        for day, whole in self._days(start, end):
+            if whole:
+                for name, revenue in self.products[day].items():
+                    product_sales[name] += revenue
+            else:
+                for trans_date, sale in self.sales[day]:
+                    if start <= trans_date <= end:
+                        for name, revenue in item_revenue(sale):
+                            product_sales[name] += revenue
+        return heapq.nlargest(limit, product_sales.items(), key=lambda x: x[1])
+
+    def _days(self, start, end):
+        """Yield ('YYYY-MM-DD', covers_whole_day) for each day with sales in [start, end]"""
+        start_day, end_day = start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+        first = bisect.bisect_left(self.days, start_day)
+        last = bisect.bisect_right(self.days, end_day)
+        for day in self.days[first:last]:
+            whole = ((day > start_day or start.time() == time.min)
+                     and (day < end_day or end.time() >= LAST_SECOND))
+            yield day, whole
+
+def timestamp(value):
+    """Return seconds since the epoch for a transaction date, or None if malformed"""
+    # fromisoformat is much faster than strptime but also accepts other
+    # layouts, so insist on DATE_FORMAT's exact shape first
+    if not isinstance(value, str) or len(value) != 19 or value[10] != ' ':
+        return None
+    try:
+        return (datetime.fromisoformat(value) - EPOCH).total_seconds()
+    except ValueError:
+        return None
+
+class TransactionColumns(DerivedIndex):
+    """Columnar copy of the ledger for whole-table aggregates.
+
+    Each transaction is one row across typed arrays: epoch seconds, a type
+    code, the amount and a dictionary-encoded customer. The dicts stay, as
+    the API returns them, so this is extra memory bought for speed: the
+    arrays take 32 bytes a row, and the row map and record list bring it to
+    about 150, next to the kilobyte or so of each dict. Rows are keyed by
+    record identity, and a removal moves the last row into the freed slot,
+    so every change is O(1). With NumPy installed the reductions run over
+    zero-copy views of the arrays; callers must hold the store lock.
+
+    The latest RECENT_CAPACITY rows are also kept ranked. Dates can arrive
+    out of order (imports, backdated sales), so this is a bounded sorted
+    list rather than a ring buffer; deletes shrink it, and it is rebuilt
+    only once it holds fewer rows than a request asks for.
+    """
+
+    collections = ('transactions',)
+
+    def rebuild(self, data):
+        self.timestamps = array('d')
+        self.types = array('i')
+        self.amounts = array('d')
+        self.customers = array('i')
+        # Insertion order, so equal dates keep the ledger's order
+        self.sequence = array('q')
+        self.records = []
+        self.rows = {}
+        self.type_names, self.type_codes = [], {}
+        self.customer_names, self.customer_codes = [], {}
+        # Per type code: rows, and rows whose amount is not an int
+        self.type_rows = []
+        self.float_rows = []
+        # Rows whose date doesn't parse; date ordering can't use the columns then
+        self.undated = 0
+        self._next_sequence = 0
+        self._removed = None
+        # (-timestamp, sequence) and record of the latest rows, best first;
+        # built on the first recent() call
+        self._recent_keys = None
+        self._recent = None
+        for transaction in data['transactions']:
+            self.added('transactions', transaction)
+        return self
+
+    def added(self, collection, transaction):
+        type_code = self._code(self.type_names, self.type_codes, transaction.get('type'))
+        if type_code == len(self.type_rows):
+            self.type_rows.append(0)
+            self.float_rows.append(0)
+        amount = self._amount(transaction)
+        ts = timestamp(transaction.get('date'))
+        if ts is None:
+            self.undated += 1
+            ts = float('-inf')
+
+        # An update arrives as removed() then added(); keep the row's place
+        if self._removed is not None and self._removed[0] == transaction.get('id'):
+            sequence = self._removed[1]
+        else:
+            sequence = self._next_sequence
+            self._next_sequence += 1
+        self._removed = None
+
+        self.rows[id(transaction)] = len(self.records)
+        self.records.append(transaction)
+        self.timestamps.append(ts)
+        self.types.append(type_code)
+        self.amounts.append(amount)
+        self.customers.append(self._code(self.customer_names, self.customer_codes,
+                                         transaction.get('customer') or ''))
+        self.sequence.append(sequence)
+        self.type_rows[type_code] += 1
+        if not isinstance(amount, int):
+            self.float_rows[type_code] += 1
+
+        keys = self._recent_keys
+        if keys is not None:
+            key = (-ts, sequence)
+            # Past the last kept row it only belongs if every row was kept
+            if (keys and key < keys[-1]) or len(keys) == len(self.records) - 1:
+                i = bisect.bisect(keys, key)
+                keys.insert(i, key)
+                self._recent.insert(i, transaction)
+                if len(keys) > RECENT_CAPACITY:
+                    keys.pop()
+                    self._recent.pop()
+
+    def removed(self, collection, transaction):
+        row = self.rows.pop(id(transaction), None)
+        if row is None:
+            return
+        type_code = self.types[row]
+        self.type_rows[type_code] -= 1
+        if not isinstance(self._amount(transaction), int):
+            self.float_rows[type_code] -= 1
+        if self.timestamps[row] == float('-inf'):
+            self.undated -= 1
+        self._removed = (transaction.get('id'), self.sequence[row])
+        if self._recent_keys is not None:
+            key = (-self.timestamps[row], self.sequence[row])
+            i = bisect.bisect_left(self._recent_keys, key)
+            if i < len(self._recent_keys) and self._recent_keys[i] == key:
+                del self._recent_keys[i], self._recent[i]
+
+        last = len(self.records) - 1
+        if row != last:
+            moved = self.records[last]
+            self.records[row] = moved
+            self.rows[id(moved)] = row
+            for column in (self.timestamps, self.types, self.amounts, self.customers, self.sequence):
+                column[row] = column[last]
+        self.records.pop()
+        for column in (self.timestamps, self.types, self.amounts, self.customers, self.sequence):
+            column.pop()
+
+    @staticmethod
+    def _amount(transaction):
+        amount = transaction.get('amount', 0)
+        return amount if isinstance(amount, (int, float)) else 0
+
+    @staticmethod
+    def _code(names, codes, value):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(names)
+            names.append(value)
+        return code
+
+    def totals_by_type(self):
+        """Return {type: summed amount}; ints stay ints when every amount was one"""
+        if numpy is not None and self.records:
+            sums = numpy.bincount(numpy.frombuffer(self.types, dtype=numpy.int32),
+                                  weights=numpy.frombuffer(self.amounts, dtype=numpy.float64),
+                                  minlength=len(self.type_names)).tolist()
+        else:
+            sums = [0.0] * len(self.type_names)
+            for type_code, amount in zip(self.types, self.amounts):
+                sums[type_code] += amount
+        return {name: sums[code] if self.float_rows[code] else int(sums[code])
+                for code, name in enumerate(self.type_names) if self.type_rows[code]}
+
+    def totals_by_customer(self, transaction_type):
+        """Return {customer: (summed amount, transactions)} for one transaction type"""
+        type_code = self.type_codes.get(transaction_type)
+        if type_code is None or not self.type_rows[type_code]:
+            return {}
+        if numpy is not None:
+            customers = numpy.frombuffer(self.customers, dtype=numpy.int32)
+            selected = numpy.frombuffer(self.types, dtype=numpy.int32) == type_code
+            size = len(self.customer_names)
+            sums = numpy.bincount(customers[selected], minlength=size,
+                                  weights=numpy.frombuffer(self.amounts, dtype=numpy.float64)[selected]).tolist()
+            counts = numpy.bincount(customers[selected], minlength=size).tolist()
+        else:
+            sums = [0.0] * len(self.customer_names)
+            counts = [0] * len(self.customer_names)
+            for code, customer, amount in zip(self.types, self.customers, self.amounts):
+                if code == type_code:
+                    sums[customer] += amount
+                    counts[customer] += 1
+        as_int = not self.float_rows[type_code]
+        return {name: (int(sums[code]) if as_int else sums[code], counts[code])
+                for code, name in enumerate(self.customer_names) if counts[code]}
+
+    def recent(self, limit):
+        """Return the `limit` latest transactions, newest first"""
+        if limit <= 0:
+            return []
+        if limit > RECENT_CAPACITY:
+            return [self.records[row] for row in self._latest_rows(limit)]
+        if self._recent is None or (len(self._recent) < limit and len(self._recent) < len(self.records)):
+            rows = self._latest_rows(RECENT_CAPACITY)
+            self._recent_keys = [(-self.timestamps[row], self.sequence[row]) for row in rows]
+            self._recent = [self.records[row] for row in rows]
+        return self._recent[:limit]
+
+    def _latest_rows(self, limit):
+        """Return the rows of the `limit` latest transactions, newest first"""
+        if len(self.records) <= limit:
+            rows = range(len(self.records))
+        elif numpy is not None:
+            timestamps = numpy.frombuffer(self.timestamps, dtype=numpy.float64)
+            # Every row dated at or after the limit-th latest date, ties included
+            cutoff = numpy.partition(timestamps, len(timestamps) - limit)[len(timestamps) - limit]
+            rows = numpy.flatnonzero(timestamps >= cutoff).tolist()
+        else:
+            cutoff = heapq.nlargest(limit, self.timestamps)[-1]
+            rows = [row for row, ts in enumerate(self.timestamps) if ts >= cutoff]
+        return heapq.nsmallest(limit, rows, key=lambda row: (-self.timestamps[row], self.sequence[row]))
+
+def customer_spend(transaction):
+    """Return (customer, spent, orders) that a transaction adds to its customer's totals, or None.
+
+    A sale adds its amount and one order; a refund takes its amount back off.
+    """
+    customer = transaction.get('customer')
+    if not customer or transaction.get('type') not in ('sale', 'refund'):
+        return None
+    amount = transaction.get('amount', 0)
+    if not isinstance(amount, (int, float)):
+        amount = 0
+    if transaction['type'] == 'sale':
+        return customer, amount, 1
+    return customer, -amount, 0
+
+class CustomerTotals(DerivedIndex):
+    """Each customer's spend, order count and last order, derived from the ledger.
+
+    Totals are keyed by the customer name transactions carry, and customer
+    records map ids onto names; several records sharing a name share its
+    totals. Every sale or refund changes one customer's totals, and the sums
+    over all customer records that the analytics need move with it, so no
+    request has to scan either collection.
+
+    The TOP_CAPACITY biggest spenders are kept ranked by (-spent, order the
+    name first got a record). `_top_bound` is the best rank any name left out
+    of that list can have. A name whose spend drops stays in the list at its
+    new rank, so the list is trusted only down to that bound and is rebuilt
+    when a request needs to look past it.
+    """
+
+    collections = ('customers', 'transactions')
+
+    def rebuild(self, data):
+        # name -> [spent, orders, sorted sale dates]
+        self.totals = {}
+        self.records = defaultdict(list)
+        self.names = {}
+        self.types = defaultdict(int)
+        self.total_customers = 0
+        self.total_spent = 0
+        self.total_orders = 0
+        self.repeat_customers = 0
+        self.active_customers = 0
+        # Ranking of names with customer records, built on the first top() call
+        self._order = {}
+        self._next_order = 0
+        self._top = None
+        self._top_ranks = {}
+        self._top_bound = None
+        for customer in data['customers']:
+            self.added('customers', customer)
+        for transaction in data['transactions']:
+            self.added('transactions', transaction)
+        return self
+
+    def added(self, collection, record):
+        if collection == 'customers':
+            self._customer(record, 1)
+        else:
+            self._transaction(record, 1)
+
+    def removed(self, collection, record):
+        if collection == 'customers':
+            self._customer(record, -1)
+        else:
+            self._transaction(record, -1)
+
+    def _customer(self, customer, sign):
+        name = customer.get('name') or ''
+        if sign > 0:
+            records = self.records[name]
+            if not records:
+                self._order[name] = self._next_order
+                self._next_order += 1
+            records.append(customer)
+            self.names[customer.get('id')] = name
+        else:
+            records = self.records.get(name, [])
+            for i, record in enumerate(records):
+                if record is customer or record.get('id') == customer.get('id'):
+                    del records[i]
+                    break
+            else:
+                return
+            if self.names.get(customer.get('id')) == name:
+                del self.names[customer.get('id')]
+            if not records:
+                del self.records[name], self._order[name]
+        self._rank(name)
+        self.total_customers += sign
+        self.active_customers += sign * (customer.get('status') == 'active')
+        customer_type = customer.get('type', 'Regular')
+        self.types[customer_type] += sign
+        if not self.types[customer_type]:
+            del self.types[customer_type]
+
+        spent, orders, _ = self.totals.get(name, (0, 0, None))
+        self.total_spent += sign * spent
+        self.total_orders += sign * orders
+        self.repeat_customers += sign * (orders > 1)
+
+    def _transaction(self, transaction, sign):
+        spend = customer_spend(transaction)
+        if spend is None:
+            return
+        name, spent, orders = spend
+        totals = self.totals.setdefault(name, [0, 0, []])
+        was_repeat = totals[1] > 1
+        totals[0] += sign * spent
+        totals[1] += sign * orders
+        if orders:
+            date = transaction.get('date') or ''
+            if sign > 0:
+                bisect.insort(totals[2], date)
+            else:
+                i = bisect.bisect_left(totals[2], date)
+                if i < len(totals[2]) and totals[2][i] == date:
+                    del totals[2][i]
+
+        count = len(self.records.get(name, ()))
+        self.total_spent += count * sign * spent
+        self.total_orders += count * sign * orders
+        self.repeat_customers += count * ((totals[1] > 1) - was_repeat)
+        if not totals[1] and not totals[2] and not totals[0]:
+            del self.totals[name]
+        if spent and count:
+            self._rank(name)
+
+    def _rank_key(self, name):
+        return -self.totals.get(name, (0,))[0], self._order[name]
+
+    def _rank(self, name):
+        """Move `name` within the kept ranking after its spend or records changed"""
+        if self._top is None:
+            return
+        old = self._top_ranks.pop(name, None)
+        if old is not None:
+            del self._top[bisect.bisect_left(self._top, (old, name))]
+        if not self.records.get(name):
+            return
+        rank = self._rank_key(name)
+        if old is None and len(self._top) >= TOP_CAPACITY and rank > self._top[-1][0]:
+            self._top_bound = min(self._top_bound, rank)
+            return
+        bisect.insort(self._top, (rank, name))
+        self._top_ranks[name] = rank
+        if len(self._top) > TOP_CAPACITY:
+            rank, name = self._top.pop()
+            del self._top_ranks[name]
+            self._top_bound = min(self._top_bound, rank)
+
+    def _rank_all(self):
+        ranked = heapq.nsmallest(TOP_CAPACITY + 1, ((self._rank_key(name), name) for name in self._order))
+        self._top = ranked[:TOP_CAPACITY]
+        self._top_ranks = {name: rank for rank, name in self._top}
+        self._top_bound = ranked[TOP_CAPACITY][0] if len(ranked) > TOP_CAPACITY else (float('inf'),)
+
+    def _top_names(self, limit):
+        """Return the names holding the `limit` biggest spenders' records, or None if the ranking can't tell"""
+        names = []
+        count = 0
+        for rank, name in self._top:
+            if count >= limit:
+                return names
+            if rank >= self._top_bound:
+                return None
+            names.append(name)
+            count += len(self.records[name])
+        return names if count >= limit or len(self._top) == len(self._order) else None
+
+    def get(self, name):
+        """Return (spent, orders, last order day or '') for a customer name"""
+        spent, orders, dates = self.totals.get(name, (0, 0, None))
+        return spent, orders, dates[-1][:10] if dates else ''
+
+    def by_id(self, customer_id):
+        """Return the totals of the customer record with this id, or None"""
+        name = self.names.get(customer_id)
+        return None if name is None else self.get(name)
+
+    def with_totals(self, customer):
+        """Return a copy of a customer record carrying its ledger totals"""
+        spent, orders, last_order = self.get(customer.get('name') or '')
+        return {**customer, 'total_spent': spent, 'total_orders': orders, 'last_order': last_order}
+
+    def top(self, limit):
+        """Return the `limit` customer records with the highest spend, with their totals"""
+        names = None if self._top is None else self._top_names(limit)
+        if names is None:
+            self._rank_all()
+            names = self._top_names(limit)
+        if names is None:
+            # Deeper than the kept ranking
+            records = (record for records in self.records.values() for record in records)
+            top = heapq.nlargest(limit, records, key=lambda c: self.get(c.get('name') or '')[0])
+        else:
+            top = [record for name in names for record in self.records[name]][:limit]
+        return [self.with_totals(customer) for customer in top]
+
+    def stats(self):
+        return {
+            'customer_types': dict(self.types),
+            'total_customers': self.total_customers,
+            'repeat_customers': self.repeat_customers,
+            'total_spent': self.total_spent,
+            'total_orders': self.total_orders
+        }
+
+# How each transaction type moves the stock of its items
+STOCK_DIRECTIONS = {'sale': -1, 'purchase': 1}
+
+def stock_moves(transaction, find_product):
+    """Return {product id: stock change} for the items of a sale or purchase.
+
+    Items name their product by `product_id` or else by `name`, looked up
+    with find_product(product_id, name). Items of unknown products, and
+    transactions of other types, move nothing.
+    """
+    direction = STOCK_DIRECTIONS.get(transaction.get('type'))
+    moves = {}
+    if direction is None:
+        return moves
+    for item in transaction.get('items') or []:
+        if not isinstance(item, dict):
+            continue
+        product = find_product(item.get('product_id'), item.get('name'))
+        if product is None:
+            continue
+        try:
+            quantity = float(item.get('quantity', 1))
+        except (TypeError, ValueError):
+            continue
+        if quantity.is_integer():
+            quantity = int(quantity)
+        moves[product['id']] = moves.get(product['id'], 0) + direction * quantity
+    return moves
+
+def stock_value(product):
+    """Return what a product's stock is worth at its price"""
+    try:
+        return product.get('price', 0) * product.get('stock', 0)
+    except TypeError:
+        return 0
+
+def low_on_stock(product):
+    try:
+        return product.get('stock', 0) <= product.get('min_stock', 5)
+    except TypeError:
+        return False
+
+def stock_alert(product):
+    stock = product.get('stock', 0)
+    return {
+        'name': product.get('name', ''),
+        'stock': stock,
+        'min_stock': product.get('min_stock', 5),
+        'status': 'Out of Stock' if stock == 0 else 'Low Stock'
+    }
+
+class StockLevels(DerivedIndex):
+    """Products by id and name, the ones at or below their minimum stock, and the stock value.
+
+    Stock changes arrive as product updates, so the alert set and the
+    running value move with each one and the dashboard never walks the
+    whole catalogue.
+    """
+
+    collections = ('products',)
+
+    def rebuild(self, data):
+        self.products = {}
+        self.by_name = defaultdict(list)
+        self.low = {}
+        self.value = 0
+        for product in data['products']:
+            self.added('products', product)
+        return self
+
+    def added(self, collection, record):
+        product_id = record.get('id')
+        self.products[product_id] = record
+        self.by_name[record.get('name')].append(product_id)
+        if low_on_stock(record):
+            self.low[product_id] = record
+        self.value += stock_value(record)
+
+    def removed(self, collection, record):
+        product_id = record.get('id')
+        if self.products.pop(product_id, None) is None:
+            return
+        ids = self.by_name[record.get('name')]
+        ids.remove(product_id)
+        if not ids:
+            del self.by_name[record.get('name')]
+        self.low.pop(product_id, None)
+        self.value -= stock_value(record)
+
+    def find(self, product_id=None, name=None):
+        """Return the product with this id, or else the first one with this name, or None"""
+        if product_id is not None:
+            return self.products.get(product_id)
+        ids = self.by_name.get(name)
+        return self.products[ids[0]] if ids else None
+
+    def alerts(self):
+        """Return the stock alerts of low and out of stock products, by product id"""
+        products = sorted(self.low.values(), key=lambda p: (not isinstance(p.get('id'), int), p.get('id') or 0))
+        return [stock_alert(product) for product in products]
+
+# Searchable fields per collection and how much a hit in each one counts
+SEARCH_FIELDS = {
+    'products': {'name': 3, 'sku': 3, 'category': 2, 'description': 1},
+    'customers': {'name': 3, 'email': 2, 'contact': 2, 'phone': 2, 'type': 1, 'city': 1},
+    'transactions': {'customer': 2, 'supplier': 2, 'description': 1, 'type': 1},
+    'notes': {'title': 3, 'category': 2, 'content': 1},
+}
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+class SearchIndex(DerivedIndex):
+    """Inverted index over the searchable text fields.
+
+    `postings` maps each token to the documents containing it with a field
+    weighted score, and `tokens` keeps the vocabulary sorted so a prefix
+    lookup is a binary search plus a walk over the matching tokens only.
+    """
+
+    collections = tuple(SEARCH_FIELDS)
+
+    def rebuild(self, data):
+        self.postings = defaultdict(dict)
+        self.tokens = []
+        self.documents = {}
+        self.document_tokens = {}
+        for collection in self.collections:
+            for record in data.get(collection, []):
+                self.added(collection, record)
+        return self
+
+    def added(self, collection, record):
+        key = (collection, record.get('id'))
+        if key in self.documents:
+            self.removed(collection, self.documents[key])
+        scores = defaultdict(int)
+        for field, weight in SEARCH_FIELDS[collection].items():
+            if record.get(field):
+                for token in tokenize(record[field]):
+                    scores[token] += weight
+        for token, score in scores.items():
+            postings = self.postings[token]
+            if not postings:
+                bisect.insort(self.tokens, token)
+            postings[key] = score
+        self.documents[key] = record
+        self.document_tokens[key] = list(scores)
+
+    def removed(self, collection, record):
+        key = (collection, record.get('id'))
+        for token in self.document_tokens.pop(key, []):
+            postings = self.postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(key, None)
+            if not postings:
+                del self.postings[token]
+                del self.tokens[bisect.bisect_left(self.tokens, token)]
+        self.documents.pop(key, None)
+
+    def search(self, query, collections=None, limit=20):
+        """Return (total, [(score, collection, record)]) for records matching every query term.
+
+        Each term matches whole tokens and token prefixes; whole-token hits
+        score double so "drum" ranks "Drum" above "Drums".
+        """
+        terms = tokenize(query)
+        if not terms:
+            return 0, []
+
+        matches = None
+        for term in terms:
+            term_scores = defaultdict(int)
+            i = bisect.bisect_left(self.tokens, term)
+            while i < len(self.tokens) and self.tokens[i].startswith(term):
+                token = self.tokens[i]
+                i += 1
+                bonus = 2 if token == term else 1
+                for key, score in self.postings[token].items():
+                    if collections is None or key[0] in collections:
+                        term_scores[key] += score * bonus
+            if matches is None:
+                matches = term_scores
+            else:
+                matches = {key: score + term_scores[key] for key, score in matches.items() if key in term_scores}
+            if not matches:
+                return 0, []
+
+        top = heapq.nlargest(limit, matches.items(), key=lambda item: item[1])
+        return len(matches), [(score, key[0], self.documents[key]) for key, score in top]
@@ -0,0 +1,189 @@
+"""Background jobs for work too slow to run inside a request.
+
+A job runs on a small thread pool in the worker that accepted it and writes
+its result to a file in the jobs directory. Its state lives next to the
+result as <id>.json, so a status or download request can be answered by any
+gunicorn worker. While a job is queued or running, submitting the same kind
+with the same parameters returns it instead of starting another. Finished
+jobs and their results are deleted once their TTL has passed: a status or
+download request for one finds it gone, and the rest are swept at most once
+a minute whenever jobs are submitted or looked up.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+
+from storage import file_lock, write_json_atomic
+
+PENDING = ('queued', 'running')
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+# Minimum seconds between progress writes to the job file
+PROGRESS_INTERVAL = 0.5
+PURGE_INTERVAL = 60
+
+class JobRunner:
+    """Run registered job kinds on a thread pool, sharing their state through files.
+
+    If given, `context(params)` returns a context manager each job runs in,
+    e.g. to select the data it works on.
+    """
+
+    def __init__(self, directory, workers=2, ttl=3600, context=None):
+        self.directory = directory
+        self.lock_file = os.path.join(directory, 'jobs.lock')
+        self.ttl = ttl
+        self.context = context
+        self.kinds = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._last_purge = 0
+        self._purge_lock = threading.Lock()
+
+    def register(self, kind):
+        """Decorator for `func(params, output_file, progress)` returning (filename, mimetype).
+
+        The function writes its result to output_file and may call
+        progress(done, total=None) as it goes.
+        """
+        def decorator(func):
+            self.kinds[kind] = func
+            return func
+        return decorator
+
+    def submit(self, kind, params):
+        """Queue a job, or return the identical one already pending; returns (job, created)"""
+        self.purge_expired()
+        os.makedirs(self.directory, exist_ok=True)
+        key = hashlib.sha1(json.dumps([kind, params], sort_keys=True).encode()).hexdigest()
+        marker = os.path.join(self.directory, f'{key}.pending')
+
+        with file_lock(self.lock_file):
+            try:
+                with open(marker) as f:
+                    existing = self._read(f.read().strip())
+                if existing is not None and existing['status'] in PENDING and _alive(existing['pid']):
+                    return existing, False
+            except FileNotFoundError:
+                pass
+
+            job = {
+                'id': uuid.uuid4().hex, 'kind': kind, 'params': params, 'key': key,
+                'status': 'queued', 'progress': None, 'error': None, 'pid': os.getpid(),
+                'created_at': _now(), 'started_at': None, 'finished_at': None, 'expires_at': None,
+                'filename': None, 'mimetype': None, 'size': None,
+            }
+            self._write(job)
+            with open(marker, 'w') as f:
+                f.write(job['id'])
+        self._executor.submit(self._run, job)
+        return job, True
+
+    def get(self, job_id):
+        """Return the job's state, or None if it is unknown or expired"""
+        self.purge_expired()
+        return self._check(self._read(job_id))
+
+    def _check(self, job):
+        """Fail a pending job whose worker is gone and delete an expired one; returns the job or None"""
+        if job is not None and job['status'] in PENDING and not _alive(job['pid']):
+            # The worker running it exited (restart, crash); it will never finish
+            self._finish(job, 'failed', error='The worker running this job exited')
+        if job is not None and job['expires_at'] and job['expires_at'] <= _now():
+            for path in (self._path(job['id'], 'out'), self._path(job['id'], 'json')):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            return None
+        return job
+
+    def _read(self, job_id):
+        if not JOB_ID_PATTERN.fullmatch(job_id or ''):
+            return None
+        try:
+            with open(self._path(job_id, 'json')) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def artifact_path(self, job_id):
+        return self._path(job_id, 'out')
+
+    def purge_expired(self):
+        """Delete finished jobs past their TTL; runs at most once a minute per worker"""
+        with self._purge_lock:
+            if time.monotonic() - self._last_purge < PURGE_INTERVAL:
+                return
+            self._last_purge = time.monotonic()
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            job_id, ext = os.path.splitext(name)
+            if ext == '.json' and JOB_ID_PATTERN.fullmatch(job_id):
+                self._check(self._read(job_id))
+
+    def _run(self, job):
+        func = self.kinds[job['kind']]
+        job.update(status='running', started_at=_now())
+        self._write(job)
+        last_write = [time.monotonic()]
+
+        def progress(done, total=None):
+            job['progress'] = {'done': done, 'total': total}
+            if time.monotonic() - last_write[0] >= PROGRESS_INTERVAL:
+                self._write(job)
+                last_write[0] = time.monotonic()
+
+        tmp_file = self._path(job['id'], 'tmp')
+        try:
+            with self.context(job['params']) if self.context else nullcontext():
+                filename, mimetype = func(job['params'], tmp_file, progress)
+            os.replace(tmp_file, self._path(job['id'], 'out'))
+            job.update(filename=filename, mimetype=mimetype, size=os.path.getsize(self._path(job['id'], 'out')))
+            self._finish(job, 'done')
+        except Exception as e:
+            print(f"Error running {job['kind']} job {job['id']}: {e}")
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            self._finish(job, 'failed', error=str(e))
+
+    def _finish(self, job, status, error=None):
+        finished = datetime.now()
+        job.update(status=status, error=error, finished_at=finished.isoformat(timespec='seconds'),
+                   expires_at=(finished + timedelta(seconds=self.ttl)).isoformat(timespec='seconds'))
+        self._write(job)
+        marker = os.path.join(self.directory, f"{job['key']}.pending")
+        with file_lock(self.lock_file):
+            try:
+                with open(marker) as f:
+                    if f.read().strip() == job['id']:
+                        os.remove(marker)
+            except FileNotFoundError:
+                pass
+
+    def _write(self, job):
+        write_json_atomic(self._path(job['id'], 'json'), job, indent=None)
+
+    def _path(self, job_id, ext):
+        return os.path.join(self.directory, f'{job_id}.{ext}')
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+def _alive(pid):
+    if os.name == 'nt':
+        # Signal 0 is CTRL_C_EVENT on Windows, so there is no cheap probe
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
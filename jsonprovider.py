@@ -0,0 +1,34 @@
+"""Flask JSON provider that encodes responses with orjson when it is installed.
+
+jsonify() responses are encoded by orjson straight to bytes, keys sorted as
+Flask sorts them. Values it can't encode fall back to the stdlib encoder,
+which does all the encoding when orjson is missing.
+"""
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # jsonify() falls back to the stdlib encoder
+    orjson = None
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask's JSON provider with jsonify() responses encoded by orjson"""
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        try:
+            body = self.encode(obj, option)
+        except orjson.JSONEncodeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
+    def encode(self, obj, option):
+        """Encode a response body with orjson"""
+        return orjson.dumps(obj, default=self.default, option=option)
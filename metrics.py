@@ -0,0 +1,231 @@
+"""Request and storage metrics in Prometheus text format.
+
+install(app, store) times every Flask route and every store operation,
+counts response sizes and serves it all at /api/metrics. In multi-tenant
+mode the app passes no store and instruments each tenant's as it opens it. Metrics are kept
+per gunicorn worker (each series carries a `worker` label), so a scrape
+reflects the worker that answered it.
+
+With PROFILE_SLOW_REQUESTS=<ms> a sampling profiler watches in-flight
+requests and writes the hottest stacks of any request slower than that to
+PROFILE_DIR as collapsed stacks (flamegraph.pl / speedscope input).
+"""
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from functools import wraps
+
+from flask import Response, g, request
+
+from jsonprovider import OrjsonProvider
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values"""
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counts = defaultdict(lambda: [0] * (len(buckets) + 1))
+        self._sums = defaultdict(float)
+
+    def observe(self, labels, value):
+        with self._lock:
+            self._counts[labels][bisect.bisect_left(self.buckets, value)] += 1
+            self._sums[labels] += value
+
+    def render(self, worker):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, counts in sorted(self._counts.items()):
+                label_text = _labels(self.label_names, labels, worker)
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+                cumulative += counts[-1]
+                lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {cumulative}')
+                lines.append(f'{self.name}_sum{{{label_text}}} {self._sums[labels]}')
+                lines.append(f'{self.name}_count{{{label_text}}} {cumulative}')
+        return lines
+
+def _labels(names, values, worker):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.append(f'worker="{worker}"')
+    return ','.join(pairs)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+request_latency = Histogram('bizsuite_request_duration_seconds', 'Time to build the response',
+                            ('route', 'method', 'status'), LATENCY_BUCKETS)
+response_size = Histogram('bizsuite_response_size_bytes', 'Response body size',
+                          ('route', 'method'), SIZE_BUCKETS)
+storage_latency = Histogram('bizsuite_storage_duration_seconds', 'Time spent in storage operations',
+                            ('operation',), LATENCY_BUCKETS)
+
+def observe_storage(operation, seconds):
+    storage_latency.observe((operation,), seconds)
+
+def timed(operation, func):
+    """Wrap `func` so each call is recorded as a storage operation"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            observe_storage(operation, time.perf_counter() - started)
+    return wrapper
+
+# Every store method the routes call; iter_records() is left out as it
+# returns a generator before doing any work
+STORE_OPERATIONS = ('load', 'save', 'restore', 'insert', 'insert_many', 'insert_transaction', 'delete',
+                    'apply', 'rebuild_sales_rollups', 'rebuild_customer_totals', 'list_records',
+                    'search', 'sales_by_day', 'sales_by_product', 'balance_totals', 'recent_transactions',
+                    'top_customers', 'customer_totals', 'stock_alerts', 'customer_stats')
+
+def instrument_store(store):
+    """Time the store's read/write methods and its validate hook"""
+    for operation in STORE_OPERATIONS:
+        if hasattr(store, operation):
+            setattr(store, operation, timed(operation, getattr(store, operation)))
+    store.validate = timed('validate', store.validate)
+    return store
+
+class TimedJSONProvider(OrjsonProvider):
+    """The app's JSON provider with serialization time recorded"""
+
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            observe_storage('json_serialize', time.perf_counter() - started)
+
+    def encode(self, obj, option):
+        started = time.perf_counter()
+        try:
+            return super().encode(obj, option)
+        finally:
+            observe_storage('json_serialize', time.perf_counter() - started)
+
+class SlowRequestProfiler:
+    """Sample the stacks of in-flight requests and keep the slow ones"""
+
+    def __init__(self, threshold_ms, output_dir, interval=0.005):
+        self.threshold = threshold_ms / 1000
+        self.output_dir = output_dir
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        threading.Thread(target=self._sample_loop, daemon=True).start()
+
+    def start(self):
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+
+    def stop(self, label, elapsed):
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if samples and elapsed >= self.threshold:
+            self._dump(label, elapsed, samples)
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, samples in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[_collapse(frame)] += 1
+
+    def _dump(self, label, elapsed, samples):
+        os.makedirs(self.output_dir, exist_ok=True)
+        safe_label = ''.join(c if c.isalnum() else '_' for c in label).strip('_')
+        path = os.path.join(
+            self.output_dir,
+            f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{safe_label}_{int(elapsed * 1000)}ms.txt")
+        with open(path, 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Slow request {label} took {elapsed * 1000:.0f} ms; stacks written to {path}")
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+def render(store, collections):
+    """Return every metric as Prometheus exposition text"""
+    worker = os.getpid()
+    lines = []
+    for histogram in (request_latency, response_size, storage_latency):
+        lines.extend(histogram.render(worker))
+
+    if store is None:
+        return '\n'.join(lines) + '\n'
+
+    data_file = getattr(store, 'data_file', None) or getattr(store, 'db_file', None)
+    if data_file:
+        lines.append("# HELP bizsuite_data_file_bytes Size of the data file(s) on disk")
+        lines.append("# TYPE bizsuite_data_file_bytes gauge")
+        for path in (data_file, f"{data_file}.log", f"{data_file}-wal"):
+            if os.path.exists(path):
+                lines.append(f'bizsuite_data_file_bytes{{file="{_escape(os.path.basename(path))}",'
+                             f'worker="{worker}"}} {os.path.getsize(path)}')
+
+    data = store.load()
+    lines.append("# HELP bizsuite_records Records per collection")
+    lines.append("# TYPE bizsuite_records gauge")
+    for collection in collections:
+        lines.append(f'bizsuite_records{{collection="{collection}",worker="{worker}"}} '
+                     f'{len(data.get(collection, []))}')
+    return '\n'.join(lines) + '\n'
+
+def install(app, store, collections, profile_threshold_ms=None, profile_dir='profiles'):
+    """Hook request timing into `app`, instrument `store` and add /api/metrics"""
+    app.json_provider_class = TimedJSONProvider
+    app.json = TimedJSONProvider(app)
+    if store is not None:
+        instrument_store(store)
+    profiler = SlowRequestProfiler(profile_threshold_ms, profile_dir) if profile_threshold_ms else None
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        if profiler:
+            profiler.start()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_latency.observe((route, request.method, response.status_code), elapsed)
+        if not response.is_streamed:
+            response_size.observe((route, request.method), response.calculate_content_length() or 0)
+        if profiler:
+            profiler.stop(f"{request.method} {route}", elapsed)
+        return response
+
+    @app.route('/api/metrics')
+    def metrics():
+        return Response(render(store, collections), mimetype='text/plain; version=0.0.4')
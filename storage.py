@@ -0,0 +1,1687 @@
+"""Storage backends for Business Suite Pro.
+
+The app talks to a store object rather than to the data file directly:
+
+- JsonStore keeps the whole dataset in one JSON document (the default).
+- JournalStore keeps a JSON snapshot plus an append-only mutation log that
+  is folded back into the snapshot by a background compaction.
+- SqliteStore keeps each collection in an indexed SQLite table and answers
+  the analytics queries with SQL aggregates.
+
+All of them keep the materialized dataset cached in-process and notice writes
+made by other gunicorn workers (file signatures for the JSON stores,
+PRAGMA data_version for SQLite). Every load passes the data through the
+`validate` hook, which returns current data untouched and brings data with an
+older "schema_version" up to date; the stores then write the migrated data
+back so that happens once. Data that can't be read, or that is newer than the
+app, makes load() raise LoadError, so writes are refused rather than seed
+data saved over it. The query methods (sales_by_day, balance_totals, ...) are
+what the analytics routes use, so each backend can answer them in the
+cheapest way it has.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+from indexes import (DATE_FORMAT, CustomerTotals, SalesRollup, SearchIndex, StockLevels, TransactionColumns,
+                     customer_spend, item_revenue, parse_date, stock_alert, stock_moves, stock_value)
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+EXPENSE_TYPES = ('purchase', 'expense')
+
+# Fields each collection can be filtered, sorted or aggregated on, with the
+# defaults the queries assume when a record lacks them. SqliteStore keeps
+# these as indexed columns next to the JSON body of each record.
+INDEXED_FIELDS = {
+    'products': [('name', ''), ('category', ''), ('status', 'active'),
+                 ('price', 0), ('stock', 0), ('min_stock', 5)],
+    'customers': [('name', ''), ('type', 'Regular'), ('status', 'active'),
+                  ('total_spent', 0), ('total_orders', 0)],
+    'transactions': [('date', ''), ('type', ''), ('amount', 0),
+                     ('customer', ''), ('status', 'completed')],
+    'suppliers': [('name', ''), ('status', 'active')],
+    'notes': [('category', 'General'), ('priority', 'medium'), ('created_at', '')],
+}
+# Top-level keys of a complete dataset
+DATASET_KEYS = list(INDEXED_FIELDS) + ['settings']
+
+def check_list_query(collection, filters, sort, after=None):
+    """Reject filter/sort fields that are not indexed for `collection`, and cursors that don't fit the sort"""
+    fields = dict(INDEXED_FIELDS[collection])
+    for field in filters:
+        if not isinstance(fields.get(field), str):
+            raise ValueError(f"Cannot filter {collection} by '{field}'")
+    if sort != 'id' and sort not in fields:
+        raise ValueError(f"Cannot sort {collection} by '{sort}'")
+    if after is not None and sort in fields and after[0] is not None \
+            and isinstance(after[0], str) != isinstance(fields[sort], str):
+        raise ValueError(f"Invalid cursor for sort={sort}")
+    return fields
+
+def _file_signature(path):
+    """Return a cheap identity for the file contents, or None if it is missing"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive advisory lock on `path` across processes"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def highest_ids(data):
+    """Return {collection: largest integer id} for the collections that have one"""
+    highest = {}
+    for collection in INDEXED_FIELDS:
+        for record in data.get(collection, []):
+            _track_id(highest, collection, record)
+    return highest
+
+def _track_id(highest, collection, record):
+    record_id = record.get('id')
+    if isinstance(record_id, int) and not isinstance(record_id, bool) and record_id > highest.get(collection, 0):
+        highest[collection] = record_id
+
+def restock(product, change):
+    """Return a copy of `product` with `change` added to its stock; raises ValueError below zero"""
+    stock = product.get('stock', 0) + change
+    if stock < 0:
+        raise ValueError(f"Not enough stock of {product.get('name')}: {product.get('stock', 0)} left")
+    return {**product, 'stock': stock, 'last_updated': datetime.now().isoformat()}
+
+def unapplied_moves(transactions):
+    """Return {product id: stock change} that undoes the stock moves recorded on `transactions`"""
+    moves = {}
+    for transaction in transactions:
+        for move in transaction.get('stock_moves') or []:
+            moves[move['product_id']] = moves.get(move['product_id'], 0) - move['quantity']
+    return moves
+
+class LoadError(Exception):
+    """The stored data could not be read or is newer than this app; nothing can be served or written"""
+
+class BatchError(ValueError):
+    """An operation of a batch failed; none of the batch was written"""
+
+    def __init__(self, index, message):
+        super().__init__(message)
+        self.index = index
+
+def _creations(operations):
+    """Group the records of a batch's create operations by collection, so ids are allocated once per collection"""
+    creations = defaultdict(list)
+    for op, collection, value in operations:
+        if op == 'create':
+            creations[collection].append(value)
+    return creations
+
+def _notify_batch(store, changes):
+    """Notify listeners of a batch's (collection, old, new) changes, one call per collection"""
+    grouped = {}
+    for collection, old, new in changes:
+        grouped.setdefault(collection, []).append((old, new))
+    for collection, pairs in grouped.items():
+        store._notify(collection, pairs)
+
+def write_json_atomic(path, data, indent=2):
+    """Write `data` to a temp file and rename it over `path`"""
+    tmp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(data, f, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+class IndexedStore:
+    """Derived in-memory indexes for stores that keep the dataset cached.
+
+    Subclasses provide load(), `_lock`, `_indexes` and `_listeners`, drop
+    `_indexes` whenever the cached dataset is replaced, call _changed() for
+    every record they write or delete (their own or another worker's) and
+    _notify() once per write of their own.
+    """
+
+    INDEXES = {'search': SearchIndex}
+
+    def index(self, name):
+        """Return the named derived index, building it if the data was reloaded"""
+        with self._lock:
+            data = self.load()
+            index = self._indexes.get(name)
+            if index is None:
+                index = self.INDEXES[name]().rebuild(data)
+                self._indexes[name] = index
+            return index
+
+    def _changed(self, collection, old, new):
+        """Feed a record change to every index that is currently built"""
+        for index in self._indexes.values():
+            if collection in index.collections:
+                if old is not None:
+                    index.removed(collection, old)
+                if new is not None:
+                    index.added(collection, new)
+
+    def search(self, query, collections=None, limit=20):
+        """Return (total, [(score, collection, record)]) ranked by relevance"""
+        return self.index('search').search(query, collections, limit)
+
+    def add_listener(self, listener):
+        """Call `listener(collection, changes)` after each write made through this store.
+
+        `changes` lists (old, new) record pairs, with old None for inserts and
+        new None for deletes. A save() of the whole dataset reports collection
+        None and no changes.
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, collection, changes):
+        for listener in self._listeners:
+            try:
+                listener(collection, changes)
+            except Exception as e:
+                print(f"Error notifying listener: {e}")
+
+    def _with_defaults(self, members):
+        """Yield (key, value) `members`, then the default value of every dataset key they lacked"""
+        seen = set()
+        for key, value in members:
+            if key in seen:
+                raise ValueError(f"'{key}' appears more than once")
+            seen.add(key)
+            yield key, value
+        missing = [key for key in DATASET_KEYS if key not in seen]
+        if missing:
+            defaults = self.validate(self.default_factory())
+            for key in missing:
+                yield key, defaults[key]
+
+class JsonStore(IndexedStore):
+    """Whole-document store: every write rewrites the data file"""
+
+    INDEXES = {'sales': SalesRollup, 'search': SearchIndex, 'columns': TransactionColumns,
+               'customers': CustomerTotals, 'stock': StockLevels}
+
+    def __init__(self, data_file, validate, default_factory):
+        self.data_file = data_file
+        self.lock_file = f"{data_file}.lock"
+        self.ids_file = f"{data_file}.ids"
+        self.validate = validate
+        self.default_factory = default_factory
+        self._lock = threading.RLock()
+        self._signature = None
+        self._data = None
+        self._indexes = {}
+        self._listeners = []
+        # Nesting depth of _write_lock(); only the thread holding `_lock` sees it non-zero
+        self._write_depth = 0
+
+    def invalidate(self):
+        """Drop the cached dataset so the next load() re-reads the file"""
+        with self._lock:
+            self._signature = None
+            self._data = None
+            self._indexes = {}
+
+    def version(self):
+        """Return a token that changes whenever the stored data changes"""
+        with self._lock:
+            self.load()
+            return '-'.join(str(part) for part in self._signature or ())
+
+    def load(self):
+        """Return the dataset, reading the file only if it changed"""
+        try:
+            os.makedirs(os.path.dirname(self.data_file), exist_ok=True)
+
+            with self._lock:
+                signature = _file_signature(self.data_file)
+                if signature is not None and signature == self._signature:
+                    return self._data
+
+                if signature is not None:
+                    data, signature = self._read_snapshot(signature)
+                    self._signature = signature
+                    self._data = data
+                    self._indexes = {}
+                    return data
+
+                # Create default data file
+                default_data = self.validate(self.default_factory())
+                self._persist(default_data)
+                return default_data
+        except Exception as e:
+            # Serving the seed data instead would let the next write save it over the real data
+            raise LoadError(f"Could not load data: {e}") from e
+
+    def save(self, data):
+        """Replace the whole dataset"""
+        os.makedirs(os.path.dirname(self.data_file), exist_ok=True)
+        with self._write_lock():
+            self._sync_ids(highest_ids(data))
+            self._persist(data)
+            self._indexes = {}
+            self._notify(None, [])
+
+    def restore(self, members):
+        """Replace the whole dataset from (key, value) members without holding it in memory.
+
+        Collection values may be any iterable of records, e.g. a generator
+        reading an upload; missing keys get their defaults. Everything is
+        written to a staging file that is renamed over the data file only
+        once `members` is exhausted, so if iterating raises, the current data
+        is untouched.
+        """
+        os.makedirs(os.path.dirname(self.data_file), exist_ok=True)
+        staging_file = f"{self.data_file}.{os.getpid()}.{threading.get_ident()}.restore"
+        try:
+            # Staging happens outside the write lock; the dataset is being
+            # replaced, so writes that land meanwhile would be lost anyway
+            highest = {}
+            with open(staging_file, 'w') as f:
+                f.write('{')
+                for n, (key, value) in enumerate(self._with_defaults(members)):
+                    f.write(f"{',' if n else ''}\n{json.dumps(key)}: ")
+                    if key not in INDEXED_FIELDS:
+                        json.dump(value, f)
+                        continue
+                    f.write('[')
+                    for i, record in enumerate(value):
+                        f.write(f"{',' if i else ''}\n{json.dumps(record)}")
+                        _track_id(highest, key, record)
+                    f.write('\n]')
+                f.write('\n}\n')
+                f.flush()
+                os.fsync(f.fileno())
+            with self._write_lock():
+                self._sync_ids(highest)
+                self._install(staging_file)
+                self._notify(None, [])
+        finally:
+            if os.path.exists(staging_file):
+                os.remove(staging_file)
+
+    def insert(self, collection, record):
+        """Append `record` to `collection` and persist it, allocating its id if it has none"""
+        with self._write_lock():
+            data = self.load()
+            self._assign_ids(data, collection, [record])
+            data[collection].append(record)
+            self._commit(data, [{"op": "put", "collection": collection, "record": record}])
+            self._changed(collection, None, record)
+            self._notify(collection, [(None, record)])
+        self._after_write()
+        return record
+
+    def insert_many(self, collection, records):
+        """Append several records with a single commit"""
+        with self._write_lock():
+            data = self.load()
+            self._assign_ids(data, collection, records)
+            data[collection].extend(records)
+            self._commit(data, [{"op": "put", "collection": collection, "record": r} for r in records])
+            for record in records:
+                self._changed(collection, None, record)
+            self._notify(collection, [(None, record) for record in records])
+        self._after_write()
+        return records
+
+    def insert_transaction(self, transaction):
+        """Insert a transaction and move the stock of the products its items name, in one commit.
+
+        The moves made are kept on the transaction as `stock_moves`, so
+        deleting it puts them back. Raises ValueError, writing nothing, if a
+        product would be left with less than no stock.
+        """
+        with self._write_lock():
+            data = self.load()
+            stock = self.index('stock')
+            moves = stock_moves(transaction, stock.find)
+            products = self._move_stock(data, moves)
+            if moves:
+                transaction['stock_moves'] = [{'product_id': product_id, 'quantity': change}
+                                              for product_id, change in moves.items()]
+            self._assign_ids(data, 'transactions', [transaction])
+            data['transactions'].append(transaction)
+            self._commit(data, [{"op": "put", "collection": "transactions", "record": transaction}]
+                         + [{"op": "put", "collection": "products", "record": new} for _, new in products])
+            self._changed('transactions', None, transaction)
+            for old, new in products:
+                self._changed('products', old, new)
+            self._notify('transactions', [(None, transaction)])
+            if products:
+                self._notify('products', products)
+        self._after_write()
+        return transaction
+
+    def apply(self, operations):
+        """Apply ('create', collection, record) and ('delete', collection, id) operations with one commit.
+
+        Operations run in order, so a sale can take stock from a product
+        created earlier in the batch; transactions move stock as in
+        insert_transaction(). Returns each operation's result: the created
+        record, or whether a record was deleted. Raises BatchError, writing
+        nothing, if an operation fails.
+        """
+        with self._write_lock():
+            data = self.load()
+            for collection, records in _creations(operations).items():
+                self._assign_ids(data, collection, records)
+            stock = self.index('stock')
+            # Each touched collection as it stands after the operations so far
+            current = {}
+            changes = []
+
+            def patch(collection):
+                if collection not in current:
+                    current[collection] = RecordPatch(data[collection])
+                return current[collection]
+
+            def change(collection, old, new):
+                if new is None:
+                    patch(collection).delete(old.get('id'))
+                else:
+                    patch(collection).put(new)
+                changes.append((collection, old, new))
+                self._changed(collection, old, new)
+
+            results = []
+            try:
+                for i, (op, collection, value) in enumerate(operations):
+                    if op == 'create':
+                        products = []
+                        if collection == 'transactions':
+                            moves = stock_moves(value, stock.find)
+                            try:
+                                products = self._restocked(moves)
+                            except ValueError as e:
+                                raise BatchError(i, str(e)) from None
+                            if moves:
+                                value['stock_moves'] = [{'product_id': product_id, 'quantity': quantity}
+                                                        for product_id, quantity in moves.items()]
+                        change(collection, None, value)
+                        for old, new in products:
+                            change('products', old, new)
+                        results.append(value)
+                        continue
+                    removed = patch(collection).matching(value)
+                    products = self._restocked(unapplied_moves(removed)) if collection == 'transactions' else []
+                    for old in removed:
+                        change(collection, old, None)
+                    for product_old, product_new in products:
+                        change('products', product_old, product_new)
+                    results.append(bool(removed))
+            except Exception:
+                # Only the indexes saw the failed batch; the dataset is untouched
+                self._indexes = {}
+                raise
+
+            for collection, records in current.items():
+                data[collection] = records.result()
+            self._commit(data, [{"op": "put", "collection": collection, "record": new} if new is not None
+                                else {"op": "delete", "collection": collection, "id": old.get('id')}
+                                for collection, old, new in changes])
+            _notify_batch(self, changes)
+        self._after_write()
+        return results
+
+    def delete(self, collection, record_id):
+        """Remove the record with `record_id` from `collection`"""
+        with self._write_lock():
+            data = self.load()
+            removed = [r for r in data[collection] if r.get('id') == record_id]
+            products = self._move_stock(data, unapplied_moves(removed)) if collection == 'transactions' else []
+            if removed:
+                data[collection] = [r for r in data[collection] if r.get('id') != record_id]
+            self._commit(data, [{"op": "delete", "collection": collection, "id": record_id}]
+                         + [{"op": "put", "collection": "products", "record": new} for _, new in products])
+            for record in removed:
+                self._changed(collection, record, None)
+            for old, new in products:
+                self._changed('products', old, new)
+            if removed:
+                self._notify(collection, [(record, None) for record in removed])
+            if products:
+                self._notify('products', products)
+        self._after_write()
+
+    def _move_stock(self, data, moves):
+        """Apply {product id: stock change} to the products in `data`; returns the (old, new) pairs.
+
+        Every change is checked before any is made, so a ValueError leaves
+        `data` as it was.
+        """
+        products = self._restocked(moves)
+        if products:
+            replaced = {new['id']: new for _, new in products}
+            data['products'] = [replaced.get(p.get('id'), p) for p in data['products']]
+        return products
+
+    def _restocked(self, moves):
+        """Return the (old, new) pairs of the indexed products that {product id: stock change} rewrites"""
+        stock = self.index('stock')
+        return [(stock.products[product_id], restock(stock.products[product_id], change))
+                for product_id, change in moves.items() if product_id in stock.products]
+
+    @contextmanager
+    def _write_lock(self):
+        # The file lock serializes writers across gunicorn workers; load()
+        # inside it then sees every write that committed before ours.
+        with self._lock, file_lock(self.lock_file):
+            self._write_depth += 1
+            try:
+                yield
+            finally:
+                self._write_depth -= 1
+
+    @contextmanager
+    def _migration_lock(self):
+        """Hold the file lock for writing back migrated data, unless this thread's write already holds it"""
+        # flock is per open file, so taking it again through a new fd would wait on ourselves
+        if self._write_depth:
+            yield
+        else:
+            with file_lock(self.lock_file):
+                yield
+
+    def _commit(self, data, entries):
+        """Make a mutation of `data` (described by journal `entries`) durable"""
+        self._persist(data)
+
+    def _assign_ids(self, data, collection, records):
+        """Give records without an id the next ids of `collection`; call with the write lock held"""
+        missing = [r for r in records if 'id' not in r]
+        if not missing:
+            return
+        counters = self._read_ids()
+        last = counters.get(collection)
+        if last is None:
+            # First allocation for this collection: seed from the data once
+            last = highest_ids(data).get(collection, 0)
+        # The counter is persisted before the records, so a crash in between
+        # can only skip ids, never hand one out twice.
+        counters[collection] = last + len(missing)
+        write_json_atomic(self.ids_file, counters, indent=None)
+        for offset, record in enumerate(missing, 1):
+            record['id'] = last + offset
+
+    def _sync_ids(self, highest_ids):
+        """Raise the id counters past the {collection: highest id} of a dataset about to replace the current one"""
+        counters = self._read_ids()
+        for collection, highest in highest_ids.items():
+            counters[collection] = max(counters.get(collection, 0), highest)
+        write_json_atomic(self.ids_file, counters, indent=None)
+
+    def _read_ids(self):
+        try:
+            with open(self.ids_file, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _after_write(self):
+        pass
+
+    def _persist(self, data):
+        write_json_atomic(self.data_file, data)
+        self._signature = _file_signature(self.data_file)
+        self._data = data
+
+    def _install(self, staging_file):
+        """Rename a restored data file into place; the next load() reads and validates it"""
+        os.replace(staging_file, self.data_file)
+        self.invalidate()
+
+    def rebuild_sales_rollups(self):
+        """Recompute the sales rollups from the ledger and report drifted days"""
+        with self._lock:
+            data = self.load()
+            fresh = SalesRollup().rebuild(data)
+            current = self._indexes.get('sales')
+            mismatched = []
+            if current is not None:
+                for day in sorted(set(fresh.daily) | set(current.daily)):
+                    if abs(fresh.daily.get(day, 0) - current.daily.get(day, 0)) > 1e-6:
+                        mismatched.append(day)
+            self._indexes['sales'] = fresh
+            return {'days': len(fresh.daily), 'mismatched_days': mismatched}
+
+    def rebuild_customer_totals(self):
+        """Recompute the customer totals from the ledger and report customers that had drifted"""
+        with self._lock:
+            data = self.load()
+            fresh = CustomerTotals().rebuild(data)
+            current = self._indexes.get('customers')
+            mismatched = []
+            if current is not None:
+                for name in sorted(set(fresh.totals) | set(current.totals)):
+                    old, new = current.get(name), fresh.get(name)
+                    if abs(old[0] - new[0]) > 1e-6 or old[1:] != new[1:]:
+                        mismatched.append(name)
+            self._indexes['customers'] = fresh
+            return {'customers': len(fresh.totals), 'mismatched_customers': mismatched}
+
+    # Queries
+
+    def list_records(self, collection, filters=None, date_from=None, date_to=None,
+                     sort='id', descending=False, limit=None, after=None):
+        """Return (page, total) for a filtered, sorted slice of `collection`.
+
+        `filters` maps indexed text fields to required values, `date_from` and
+        `date_to` bound the transaction date, and `after` is the (sort value,
+        id) of the last record on the previous page.
+        """
+        fields = check_list_query(collection, filters or {}, sort, after)
+        records = list(self.iter_records(collection, filters, date_from, date_to))
+        total = len(records)
+
+        default = fields.get(sort)
+        key = lambda r: (r.get(sort, default), r.get('id'))
+        records.sort(key=key, reverse=descending)
+        if after is not None:
+            after = tuple(after)
+            try:
+                records = [r for r in records if (key(r) < after if descending else key(r) > after)]
+            except TypeError:
+                raise ValueError(f"Invalid cursor for sort={sort}") from None
+        if limit is not None:
+            records = records[:limit]
+        return records, total
+
+    def iter_records(self, collection, filters=None, date_from=None, date_to=None):
+        """Yield the records of `collection` matching the filters, in stored order.
+
+        Customers come with their totals from the ledger, so listing, sorting
+        and exporting them never show the counters stored on the record.
+        """
+        filters = filters or {}
+        fields = check_list_query(collection, filters, 'id')
+        with self._lock:
+            records = self.load()[collection]
+            totals = self.index('customers') if collection == 'customers' else None
+        for r in records:
+            if (all(r.get(field, fields[field]) == value for field, value in filters.items())
+                    and (date_from is None or r.get('date', '') >= date_from)
+                    and (date_to is None or r.get('date', '') <= date_to)):
+                yield totals.with_totals(r) if totals else r
+
+    def sales_by_day(self, start, end):
+        """Return {'YYYY-MM-DD': total} for sales dated within [start, end]"""
+        return self.index('sales').sales_by_day(start, end)
+
+    def sales_by_product(self, start, end, limit=10):
+        """Return the top [name, revenue] pairs for sale items within [start, end]"""
+        return self.index('sales').sales_by_product(start, end, limit)
+
+    def balance_totals(self):
+        """Return ledger and inventory totals used by the dashboard and balance views"""
+        with self._lock:
+            data = self.load()
+            by_type = self.index('columns').totals_by_type()
+            value = self.index('stock').value
+            active_customers = self.index('customers').active_customers
+        return {
+            'income': by_type.get('sale', 0),
+            'expenses': sum(by_type.get(t, 0) for t in EXPENSE_TYPES),
+            'stock_value': value,
+            'total_customers': len(data['customers']),
+            'total_active_customers': active_customers,
+            'total_products': len(data['products'])
+        }
+
+    def recent_transactions(self, limit=5):
+        """Return the latest transactions by date"""
+        with self._lock:
+            columns = self.index('columns')
+            if not columns.undated:
+                return columns.recent(limit)
+            transactions = self.load()['transactions']
+        return sorted(transactions, key=lambda x: x.get('date', ''), reverse=True)[:limit]
+
+    def top_customers(self, limit=5):
+        """Return the customers who spent most, with their totals from the ledger"""
+        with self._lock:
+            return self.index('customers').top(limit)
+
+    def customer_totals(self, customer_id):
+        """Return (spent, orders, last order day) from the ledger for a customer id, or None"""
+        with self._lock:
+            return self.index('customers').by_id(customer_id)
+
+    def stock_alerts(self):
+        """Return products at or below their minimum stock level"""
+        with self._lock:
+            return self.index('stock').alerts()
+
+    def customer_stats(self):
+        """Return customer type counts and order totals from the ledger"""
+        with self._lock:
+            return self.index('customers').stats()
+
+    def _read_snapshot(self, signature):
+        """Return the validated data file and its signature, which changes if it had to be migrated"""
+        with open(self.data_file, 'r') as f:
+            data = json.load(f)
+        version = data.get('schema_version')
+        data = self.validate(data)
+        if data.get('schema_version') != version:
+            with self._migration_lock():
+                # Leave it to the next load if a write landed meanwhile
+                if _file_signature(self.data_file) == signature:
+                    write_json_atomic(self.data_file, data)
+                    signature = _file_signature(self.data_file)
+        return data, signature
+
+class RecordPatch:
+    """Puts and deletes by id, applied in place to one collection's records.
+
+    Only the records an operation names are touched, so records that lack
+    an id or share one (which a restore can admit) keep their place rather
+    than being collapsed by an {id: record} round trip. A put replaces the
+    first record with its id; a delete removes every one, as
+    JsonStore.delete() does.
+    """
+
+    def __init__(self, records):
+        self.records = list(records)
+        self.positions = defaultdict(list)
+        for i, record in enumerate(self.records):
+            if record.get('id') is not None:
+                self.positions[record.get('id')].append(i)
+
+    def matching(self, record_id):
+        return [self.records[i] for i in self.positions.get(record_id, [])]
+
+    def put(self, record):
+        """Replace the record with the same id, or append; returns the replaced record or None"""
+        positions = self.positions.get(record.get('id'))
+        if positions:
+            old = self.records[positions[0]]
+            self.records[positions[0]] = record
+            return old
+        if record.get('id') is not None:
+            self.positions[record.get('id')].append(len(self.records))
+        self.records.append(record)
+        return None
+
+    def delete(self, record_id):
+        """Remove the records with `record_id`; returns them"""
+        removed = []
+        for i in self.positions.pop(record_id, []):
+            removed.append(self.records[i])
+            self.records[i] = None
+        return removed
+
+    def result(self):
+        return [record for record in self.records if record is not None]
+
+def apply_journal(data, entries, on_change=None):
+    """Apply journal entries to `data` in order.
+
+    Entries are {"op": "put", "collection", "record"} upserts keyed by id and
+    {"op": "delete", "collection", "id"} removals, so replaying a log over a
+    snapshot that already contains its effects leaves the data unchanged.
+    `on_change(collection, old, new)` is called for every applied entry.
+    """
+    patches = {}
+    for entry in entries:
+        collection = entry.get('collection')
+        if collection not in data:
+            continue
+        if collection not in patches:
+            patches[collection] = RecordPatch(data[collection])
+        patch = patches[collection]
+        if entry.get('op') == 'put':
+            record = entry['record']
+            changes = [(patch.put(record), record)]
+        elif entry.get('op') == 'delete':
+            changes = [(old, None) for old in patch.delete(entry.get('id'))] or [(None, None)]
+        else:
+            continue
+        if on_change is not None:
+            for old, new in changes:
+                on_change(collection, old, new)
+
+    for collection, patch in patches.items():
+        data[collection] = patch.result()
+    return data
+
+class JournalStore(JsonStore):
+    """Snapshot plus append-only mutation log.
+
+    Each write appends its entries to `<data_file>.log` instead of rewriting
+    the snapshot. Loading replays the log over the snapshot, and
+    once the log holds `compact_threshold` entries a background thread folds
+    it into a fresh snapshot with an atomic rename.
+    """
+
+    def __init__(self, data_file, validate, default_factory, compact_threshold=1000):
+        super().__init__(data_file, validate, default_factory)
+        self.log_file = f"{data_file}.log"
+        self.compact_threshold = compact_threshold
+        self._log_ino = None
+        self._log_offset = 0
+        self._log_entries = 0
+        self._compacting = False
+
+    def version(self):
+        with self._lock:
+            self.load()
+            return '-'.join(str(part) for part in (self._signature or ()) + (self._log_ino, self._log_offset))
+
+    def load(self):
+        """Return the dataset, replaying only log entries not yet seen"""
+        try:
+            os.makedirs(os.path.dirname(self.data_file), exist_ok=True)
+
+            with self._lock:
+                snapshot_signature = _file_signature(self.data_file)
+                log_signature = _file_signature(self.log_file)
+                log_ino, log_size = (log_signature[0], log_signature[2]) if log_signature else (None, 0)
+
+                if (self._data is not None and snapshot_signature is not None
+                        and snapshot_signature == self._signature
+                        and log_ino == self._log_ino and log_size >= self._log_offset):
+                    if log_size > self._log_offset:
+                        self._replay_log(self._data, on_change=self._changed)
+                    return self._data
+
+                if snapshot_signature is not None:
+                    with open(self.data_file, 'r') as f:
+                        data = json.load(f)
+                else:
+                    data = self.default_factory()
+                    write_json_atomic(self.data_file, data)
+                    snapshot_signature = _file_signature(self.data_file)
+
+                self._signature = snapshot_signature
+                self._log_ino = log_ino
+                self._log_offset = 0
+                self._log_entries = 0
+                self._replay_log(data)
+                version = data.get('schema_version')
+                self._data = self.validate(data)
+                self._indexes = {}
+                if self._data.get('schema_version') != version:
+                    self._write_migrated()
+                return self._data
+        except Exception as e:
+            # Serving the seed data instead would let the next write save it over the real data
+            raise LoadError(f"Could not load data: {e}") from e
+
+    def save(self, data):
+        """Replace the whole dataset with a new snapshot and an empty log"""
+        os.makedirs(os.path.dirname(self.data_file), exist_ok=True)
+        with self._write_lock():
+            self._sync_ids(highest_ids(data))
+            self._write_snapshot(data)
+            self._indexes = {}
+            self._notify(None, [])
+
+    def _write_migrated(self):
+        """Fold the log into a snapshot of freshly migrated data, unless another worker wrote since it was read"""
+        with self._migration_lock():
+            log_signature = _file_signature(self.log_file)
+            log_state = (log_signature[0], log_signature[2]) if log_signature else (None, 0)
+            if (_file_signature(self.data_file) == self._signature
+                    and log_state == (self._log_ino, self._log_offset)):
+                self._write_snapshot(self._data)
+
+    def _commit(self, data, entries):
+        self._append(entries)
+
+    def _after_write(self):
+        self._maybe_compact()
+
+    def compact(self):
+        """Fold the log into a new snapshot"""
+        with self._write_lock():
+            # Pick up entries appended by other workers before folding
+            data = self.load()
+            if self._log_entries:
+                self._write_snapshot(data)
+
+    def _write_snapshot(self, data):
+        # The snapshot is renamed in before the log is emptied; a crash in
+        # between only means the old log is replayed again, which is harmless.
+        write_json_atomic(self.data_file, data)
+        self._empty_log()
+
+        self._signature = _file_signature(self.data_file)
+        self._log_ino = _file_signature(self.log_file)[0]
+        self._log_offset = 0
+        self._log_entries = 0
+        self._data = data
+
+    def _install(self, staging_file):
+        # Unlike a compaction, a restore must not have the old log replayed
+        # over it, so a crash between these two steps can resurrect records;
+        # re-running the restore fixes that.
+        os.replace(staging_file, self.data_file)
+        self._empty_log()
+        self.invalidate()
+
+    def _empty_log(self):
+        tmp_log = f"{self.log_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        open(tmp_log, 'w').close()
+        os.replace(tmp_log, self.log_file)
+
+    def _replay_log(self, data, on_change=None):
+        """Apply log entries past the current offset to `data`"""
+        if not os.path.exists(self.log_file):
+            return
+        with open(self.log_file, 'rb') as f:
+            f.seek(self._log_offset)
+            chunk = f.read()
+        # Another worker may be mid-append; stop at the last complete line
+        end = chunk.rfind(b'\n') + 1
+        entries = []
+        for line in chunk[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # Torn write from a crash; the entry never completed
+                continue
+        apply_journal(data, entries, on_change)
+        self._log_offset += end
+        self._log_entries += len(entries)
+
+    def _append(self, entries):
+        line = ''.join(json.dumps(entry, separators=(',', ':')) + '\n' for entry in entries).encode('utf-8')
+        with open(self.log_file, 'ab+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size:
+                f.seek(size - 1)
+                if f.read(1) != b'\n':
+                    # Terminate a torn line left by a crash so it stays isolated
+                    line = b'\n' + line
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+
+        log_signature = _file_signature(self.log_file)
+        self._log_ino = log_signature[0]
+        self._log_offset = size
+        self._log_entries += len(entries)
+
+    def _maybe_compact(self):
+        with self._lock:
+            if self._compacting or self._log_entries < self.compact_threshold:
+                return
+            self._compacting = True
+        threading.Thread(target=self._background_compact, daemon=True).start()
+
+    def _background_compact(self):
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"Error compacting journal: {e}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+SQLITE_INDEXES = {
+    'products': ['name', 'category', 'status'],
+    'customers': ['name', 'type', 'status', 'total_spent'],
+    'transactions': ['date', 'type, date', 'customer, type, date', 'status'],
+    'suppliers': ['status'],
+    'notes': ['category', 'created_at'],
+}
+
+# Customer rows with the totals from the ledger in place of the counters
+# copied out of the record body
+CUSTOMER_ROWS = ("(SELECT c.rowid AS rowid, c.id, c.name, c.type, c.status, c.body, "
+                 "COALESCE(t.spent, 0) AS total_spent, COALESCE(t.orders, 0) AS total_orders "
+                 "FROM customers c LEFT JOIN customer_totals t ON t.name = c.name) AS customers")
+
+class SqliteStore(IndexedStore):
+    """One indexed table per collection in a SQLite database.
+
+    Each row keeps the full record as JSON in `body` plus copies of the
+    fields that queries filter, sort or aggregate on. Sale line items are
+    also exploded into `transaction_items` for the per-product totals, and
+    the value of the stock on hand is kept as a running total.
+    """
+
+    def __init__(self, db_file, validate, default_factory):
+        self.db_file = db_file
+        self.validate = validate
+        self.default_factory = default_factory
+        self._lock = threading.RLock()
+        self._conn = None
+        self._data_version = None
+        self._data = None
+        self._indexes = {}
+        self._listeners = []
+
+    def invalidate(self):
+        with self._lock:
+            self._data_version = None
+            self._data = None
+            self._indexes = {}
+
+    def version(self):
+        """Return the write counter kept in the meta table"""
+        row = self._query("SELECT value FROM meta WHERE key = 'version'")
+        return row[0][0] if row else '0'
+
+    def load(self):
+        """Return the whole dataset, re-reading it only after another connection wrote"""
+        try:
+            with self._lock:
+                conn = self._connect()
+                data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+                if self._data is not None and data_version == self._data_version:
+                    return self._data
+
+                data = {}
+                for collection in INDEXED_FIELDS:
+                    rows = conn.execute(f'SELECT body FROM {collection} ORDER BY rowid')
+                    data[collection] = [json.loads(body) for (body,) in rows]
+                row = conn.execute("SELECT value FROM meta WHERE key = 'settings'").fetchone()
+                data['settings'] = json.loads(row[0]) if row else self.default_factory()['settings']
+                row = conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+                if row:
+                    data['schema_version'] = json.loads(row[0])
+
+                version = data.get('schema_version')
+                data = self.validate(data)
+                if data.get('schema_version') != version:
+                    # Our own commit leaves data_version as it was read
+                    self._replace(data.items())
+
+                self._data_version = data_version
+                self._data = data
+                self._indexes = {}
+                return data
+        except Exception as e:
+            # Serving the seed data instead would let the next write save it over the real data
+            raise LoadError(f"Could not load data: {e}") from e
+
+    def save(self, data):
+        """Replace the whole dataset in one transaction"""
+        members = [(key, data.get(key, [] if key in INDEXED_FIELDS else {})) for key in DATASET_KEYS]
+        if 'schema_version' in data:
+            members.append(('schema_version', data['schema_version']))
+        self._replace(members)
+        self._notify(None, [])
+
+    def restore(self, members):
+        """Replace the whole dataset from (key, value) members without holding it in memory.
+
+        Collection values may be any iterable of records; missing keys get
+        their defaults. Rows are written as they arrive inside one
+        transaction, so if iterating raises, the current data is untouched.
+        """
+        self._replace(self._with_defaults(members))
+        self._notify(None, [])
+
+    def _replace(self, members):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                for table in list(INDEXED_FIELDS) + ['transaction_items', 'sales_daily', 'product_sales_daily',
+                                                     'customer_totals']:
+                    conn.execute(f'DELETE FROM {table}')
+                conn.execute('UPDATE stock_totals SET value = 0')
+                conn.execute("DELETE FROM meta WHERE key = 'schema_version'")
+                highest = {}
+                for key, value in members:
+                    if key in ('settings', 'schema_version'):
+                        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                     (key, json.dumps(value)))
+                    elif key in INDEXED_FIELDS:
+                        for record in value:
+                            self._write_record(conn, key, record)
+                            _track_id(highest, key, record)
+                self._bump_version(conn)
+                for collection, last_id in highest.items():
+                    last = self._last_id(conn, collection)
+                    if last is None or last < last_id:
+                        self._set_last_id(conn, collection, last_id)
+            self._data = None
+            self._indexes = {}
+
+    def insert(self, collection, record):
+        with self._lock:
+            conn = self._connect()
+            with self._transaction(conn):
+                self._bump_version(conn)
+                self._assign_ids(conn, collection, [record])
+                self._write_record(conn, collection, record)
+                changes = [(collection, None, record)]
+                _notify_batch(self, changes)
+            self._committed(conn, changes)
+            return record
+
+    def insert_many(self, collection, records):
+        with self._lock:
+            conn = self._connect()
+            with self._transaction(conn):
+                self._bump_version(conn)
+                self._assign_ids(conn, collection, records)
+                for record in records:
+                    self._write_record(conn, collection, record)
+                changes = [(collection, None, record) for record in records]
+                _notify_batch(self, changes)
+            self._committed(conn, changes)
+            return records
+
+    def insert_transaction(self, transaction):
+        with self._lock:
+            conn = self._connect()
+            with self._transaction(conn):
+                self._bump_version(conn)
+                products = self._write_transaction(conn, transaction)
+                changes = [('transactions', None, transaction)] + [('products', old, new) for old, new in products]
+                _notify_batch(self, changes)
+            self._committed(conn, changes)
+            return transaction
+
+    def apply(self, operations):
+        """Apply create and delete operations in one SQLite transaction; see JsonStore.apply()"""
+        with self._lock:
+            conn = self._connect()
+            changes = []
+            results = []
+            with self._transaction(conn):
+                self._bump_version(conn)
+                for collection, records in _creations(operations).items():
+                    self._assign_ids(conn, collection, records)
+                for i, (op, collection, value) in enumerate(operations):
+                    if op == 'create':
+                        if collection == 'transactions':
+                            try:
+                                products = self._write_transaction(conn, value)
+                            except ValueError as e:
+                                raise BatchError(i, str(e)) from None
+                        else:
+                            self._write_record(conn, collection, value)
+                            products = []
+                        changes.append((collection, None, value))
+                        results.append(value)
+                    else:
+                        old, products = self._delete_record(conn, collection, value)
+                        if old is not None:
+                            changes.append((collection, old, None))
+                        results.append(old is not None)
+                    changes.extend(('products', old, new) for old, new in products)
+                _notify_batch(self, changes)
+            self._committed(conn, changes)
+            return results
+
+    def delete(self, collection, record_id):
+        with self._lock:
+            conn = self._connect()
+            with self._transaction(conn):
+                old, products = self._delete_record(conn, collection, record_id)
+                self._bump_version(conn)
+                changes = [(collection, old, None)] if old is not None else []
+                changes += [('products', old, new) for old, new in products]
+                _notify_batch(self, changes)
+            self._committed(conn, changes)
+
+    @staticmethod
+    @contextmanager
+    def _transaction(conn):
+        """Commit the block as one write that holds SQLite's write lock throughout.
+
+        The lock is taken before the first read, so the old records, the id
+        counter and the stock levels can't change underneath the write, and
+        listeners are notified before the commit releases it. That keeps the
+        change log in commit order across workers, as the file stores do
+        under their write lock.
+        """
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            yield
+
+    def _committed(self, conn, changes):
+        """Patch a committed write's (collection, old, new) changes into the cached dataset.
+
+        The old records come from the database, so a write never has to load
+        the dataset. A cache that is missing or already behind another
+        worker's commit is dropped for the next load() to re-read; our own
+        commits don't bump PRAGMA data_version.
+        """
+        if self._data is not None and \
+                conn.execute('PRAGMA data_version').fetchone()[0] == self._data_version:
+            self._patch_cache(changes)
+        else:
+            self._data = None
+            self._indexes = {}
+
+    def _patch_cache(self, changes):
+        grouped = {}
+        for collection, old, new in changes:
+            grouped.setdefault(collection, []).append((old, new))
+        for collection, pairs in grouped.items():
+            records = self._data[collection]
+            added = [new for old, new in pairs if old is None]
+            replaced = {old.get('id'): new for old, new in pairs if old is not None}
+            if not replaced:
+                records.extend(added)
+                for record in added:
+                    self._changed(collection, None, record)
+                continue
+            # A record created earlier in the same batch may also be replaced
+            # (a new product restocked by a later sale), so it is patched as
+            # if it had never been cached
+            patched = []
+            for cached, record in [(True, r) for r in records] + [(False, r) for r in added]:
+                if record.get('id') not in replaced:
+                    patched.append(record)
+                    if not cached:
+                        self._changed(collection, None, record)
+                    continue
+                new = replaced.pop(record.get('id'))
+                if new is not None:
+                    patched.append(new)
+                self._changed(collection, record if cached else None, new)
+            self._data[collection] = patched
+
+    def _write_transaction(self, conn, transaction):
+        """Write a new transaction and the stock moves of its items; returns the (old, new) product pairs"""
+        moves = stock_moves(transaction, lambda product_id, name: self._find_product(conn, product_id, name))
+        products = self._move_stock(conn, moves)
+        if moves:
+            transaction['stock_moves'] = [{'product_id': product_id, 'quantity': change}
+                                          for product_id, change in moves.items()]
+        self._assign_ids(conn, 'transactions', [transaction])
+        self._write_record(conn, 'transactions', transaction)
+        return products
+
+    def _delete_record(self, conn, collection, record_id):
+        """Delete a row and undo its rollups and stock moves; returns (the deleted record or None, product pairs)"""
+        products = []
+        old = self._fetch(conn, collection, record_id)
+        if collection == 'transactions':
+            if old is not None:
+                products = self._move_stock(conn, unapplied_moves([old]))
+                self._rollup(conn, old, -1)
+            conn.execute('DELETE FROM transaction_items WHERE transaction_id = ?', (record_id,))
+        elif collection == 'products' and old is not None:
+            self._add_stock_value(conn, old, -1)
+        conn.execute(f'DELETE FROM {collection} WHERE id = ?', (record_id,))
+        return old, products
+
+    @staticmethod
+    def _fetch(conn, collection, record_id):
+        row = conn.execute(f'SELECT body FROM {collection} WHERE id = ?', (record_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _find_product(self, conn, product_id, name):
+        if product_id is not None:
+            row = conn.execute('SELECT body FROM products WHERE id = ?', (product_id,)).fetchone()
+        else:
+            row = conn.execute('SELECT body FROM products WHERE name = ? ORDER BY rowid LIMIT 1', (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _move_stock(self, conn, moves):
+        """Write {product id: stock change} inside a write transaction; returns the (old, new) pairs.
+
+        A ValueError from restock() rolls the whole transaction back.
+        """
+        products = []
+        for product_id, change in moves.items():
+            old = self._find_product(conn, product_id, None)
+            if old is not None:
+                new = restock(old, change)
+                self._write_record(conn, 'products', new)
+                products.append((old, new))
+        return products
+
+    # Queries
+
+    def list_records(self, collection, filters=None, date_from=None, date_to=None,
+                     sort='id', descending=False, limit=None, after=None):
+        check_list_query(collection, filters or {}, sort, after)
+        table, columns = self._rows(collection)
+        where, params = self._where(filters, date_from, date_to)
+        where_sql = f" WHERE {' AND '.join(where)}" if where else ''
+        total = self._query(f'SELECT COUNT(*) FROM {table}{where_sql}', params)[0][0]
+
+        if after is not None:
+            where.append(f"({sort}, id) {'<' if descending else '>'} (?, ?)")
+            params.extend(after)
+        where_sql = f" WHERE {' AND '.join(where)}" if where else ''
+        direction = 'DESC' if descending else 'ASC'
+        sql = f'SELECT {columns} FROM {table}{where_sql} ORDER BY {sort} {direction}, id {direction}'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return [self._row_record(row) for row in self._query(sql, params)], total
+
+    def iter_records(self, collection, filters=None, date_from=None, date_to=None, batch_size=500):
+        """Stream matching records on a private connection so the store stays unlocked"""
+        check_list_query(collection, filters or {}, 'id')
+        table, columns = self._rows(collection)
+        where, params = self._where(filters, date_from, date_to)
+        where_sql = f" WHERE {' AND '.join(where)}" if where else ''
+        with self._lock:
+            self._connect()
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        try:
+            cursor = conn.execute(f'SELECT {columns} FROM {table}{where_sql} ORDER BY rowid', params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield self._row_record(row)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _rows(collection):
+        """Return the table and columns list queries read; customers are joined to their ledger totals"""
+        if collection != 'customers':
+            return collection, 'body'
+        return CUSTOMER_ROWS, ("body, total_spent, total_orders, (SELECT MAX(date) FROM transactions "
+                               "WHERE customer = customers.name AND type = 'sale')")
+
+    @staticmethod
+    def _row_record(row):
+        record = json.loads(row[0])
+        if len(row) > 1:
+            spent, orders, last_order = row[1:]
+            record.update(total_spent=spent, total_orders=orders, last_order=(last_order or '')[:10])
+        return record
+
+    @staticmethod
+    def _where(filters, date_from, date_to):
+        where, params = [], []
+        for field, value in (filters or {}).items():
+            where.append(f'{field} = ?')
+            params.append(value)
+        if date_from is not None:
+            where.append('date >= ?')
+            params.append(date_from)
+        if date_to is not None:
+            where.append('date <= ?')
+            params.append(date_to)
+        return where, params
+
+    def sales_by_day(self, start, end):
+        # Whole days come from the sales_daily rollup; the partial first and
+        # last day are summed from the (type, date) index.
+        start_day, end_day = start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+        daily_sales = dict(self._query(
+            "SELECT day, amount FROM sales_daily WHERE day > ? AND day < ?", (start_day, end_day)))
+        for low, high in self._partial_days(start, end):
+            total, count = self._query(
+                "SELECT SUM(amount), COUNT(*) FROM transactions "
+                "WHERE type = 'sale' AND date BETWEEN ? AND ? AND length(date) = 19",
+                (low, high))[0]
+            if count:
+                daily_sales[low[:10]] = total
+        return daily_sales
+
+    def sales_by_product(self, start, end, limit=10):
+        start_day, end_day = start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+        product_sales = defaultdict(float)
+        rows = self._query(
+            "SELECT name, SUM(revenue) FROM product_sales_daily WHERE day > ? AND day < ? GROUP BY name",
+            (start_day, end_day))
+        for low, high in self._partial_days(start, end):
+            rows += self._query(
+                "SELECT i.name, SUM(i.quantity * i.price) "
+                "FROM transactions t JOIN transaction_items i ON i.transaction_id = t.id "
+                "WHERE t.type = 'sale' AND t.date BETWEEN ? AND ? AND length(t.date) = 19 "
+                "GROUP BY i.name",
+                (low, high))
+        for name, revenue in rows:
+            product_sales[name] += revenue
+        return sorted(product_sales.items(), key=lambda x: x[1], reverse=True)[:limit]
+
+    def rebuild_sales_rollups(self):
+        """Recompute the rollup tables from the ledger and report drifted days"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                stored = dict(conn.execute('SELECT day, amount FROM sales_daily'))
+                fresh = self._write_rollups(conn)
+                self._bump_version(conn)
+            mismatched = [day for day in sorted(set(fresh.daily) | set(stored))
+                          if abs(fresh.daily.get(day, 0) - stored.get(day, 0)) > 1e-6]
+            return {'days': len(fresh.daily), 'mismatched_days': mismatched}
+
+    def rebuild_customer_totals(self):
+        """Recompute the customer_totals table from the ledger and report customers that had drifted"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                stored = {name: (spent, orders) for name, spent, orders in
+                          conn.execute('SELECT name, spent, orders FROM customer_totals')}
+                fresh = self._write_customer_totals(conn)
+                self._bump_version(conn)
+            mismatched = []
+            for name in sorted(set(fresh) | set(stored)):
+                old, new = stored.get(name, (0, 0)), fresh.get(name, (0, 0))
+                if abs(old[0] - new[0]) > 1e-6 or old[1] != new[1]:
+                    mismatched.append(name)
+            return {'customers': len(fresh), 'mismatched_customers': mismatched}
+
+    @staticmethod
+    def _partial_days(start, end):
+        """Return the (low, high) date bounds of the first and last day of a range"""
+        start_day, end_day = start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+        if start_day > end_day:
+            return []
+        if start_day == end_day:
+            return [(start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT))]
+        return [(start.strftime(DATE_FORMAT), f'{start_day} 23:59:59'),
+                (f'{end_day} 00:00:00', end.strftime(DATE_FORMAT))]
+
+    def balance_totals(self):
+        income, expenses = self._query(
+            "SELECT COALESCE(SUM(CASE WHEN type = 'sale' THEN amount END), 0), "
+            "COALESCE(SUM(CASE WHEN type IN ('purchase', 'expense') THEN amount END), 0) "
+            "FROM transactions")[0]
+        inventory_value = self._query("SELECT value FROM stock_totals")[0][0]
+        total_products = self._query("SELECT COUNT(*) FROM products")[0][0]
+        total_customers, active_customers = self._query(
+            "SELECT COUNT(*), COALESCE(SUM(status = 'active'), 0) FROM customers")[0]
+        return {
+            'income': income,
+            'expenses': expenses,
+            'stock_value': inventory_value,
+            'total_customers': total_customers,
+            'total_active_customers': active_customers,
+            'total_products': total_products
+        }
+
+    def recent_transactions(self, limit=5):
+        rows = self._query("SELECT body FROM transactions ORDER BY date DESC LIMIT ?", (limit,))
+        return [json.loads(body) for (body,) in rows]
+
+    def top_customers(self, limit=5):
+        # Walk the spend index; customers who spent nothing only fill up a short list
+        rows = self._query(
+            "SELECT c.body, t.spent, t.orders FROM customer_totals t JOIN customers c ON c.name = t.name "
+            "WHERE t.spent > 0 ORDER BY t.spent DESC, c.rowid LIMIT ?", (limit,))
+        if len(rows) < limit:
+            rows += self._query(
+                "SELECT c.body, COALESCE(t.spent, 0), COALESCE(t.orders, 0) FROM customers c "
+                "LEFT JOIN customer_totals t ON t.name = c.name WHERE COALESCE(t.spent, 0) <= 0 "
+                "ORDER BY COALESCE(t.spent, 0) DESC, c.rowid LIMIT ?", (limit - len(rows),))
+        customers = []
+        for body, spent, orders in rows:
+            customer = json.loads(body)
+            customers.append({**customer, 'total_spent': spent, 'total_orders': orders,
+                              'last_order': self._last_order(customer.get('name'))})
+        return customers
+
+    def customer_totals(self, customer_id):
+        rows = self._query(
+            "SELECT c.name, COALESCE(t.spent, 0), COALESCE(t.orders, 0) FROM customers c "
+            "LEFT JOIN customer_totals t ON t.name = c.name WHERE c.id = ?", (customer_id,))
+        if not rows:
+            return None
+        name, spent, orders = rows[0]
+        return spent, orders, self._last_order(name)
+
+    def _last_order(self, name):
+        row = self._query("SELECT MAX(date) FROM transactions WHERE customer = ? AND type = 'sale'", (name,))
+        return (row[0][0] or '')[:10]
+
+    def stock_alerts(self):
+        # Answered from the partial index over low-stock rows only
+        rows = self._query("SELECT body FROM products WHERE stock <= min_stock ORDER BY id")
+        return [stock_alert(json.loads(body)) for (body,) in rows]
+
+    def customer_stats(self):
+        customer_types = dict(self._query("SELECT type, COUNT(*) FROM customers GROUP BY type"))
+        total_customers, repeat_customers, total_spent, total_orders = self._query(
+            "SELECT COUNT(*), COALESCE(SUM(t.orders > 1), 0), COALESCE(SUM(t.spent), 0), "
+            "COALESCE(SUM(t.orders), 0) FROM customers c LEFT JOIN customer_totals t ON t.name = c.name")[0]
+        return {
+            'customer_types': customer_types,
+            'total_customers': total_customers,
+            'repeat_customers': repeat_customers,
+            'total_spent': total_spent,
+            'total_orders': total_orders
+        }
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def _connect(self):
+        if self._conn is not None:
+            return self._conn
+        os.makedirs(os.path.dirname(self.db_file) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.db_file, check_same_thread=False, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        with conn:
+            for collection, columns in INDEXED_FIELDS.items():
+                column_sql = ', '.join(
+                    f"{name} {'NUMERIC' if isinstance(default, (int, float)) else 'TEXT'}"
+                    for name, default in columns)
+                conn.execute(f'CREATE TABLE IF NOT EXISTS {collection} '
+                             f'(id PRIMARY KEY, {column_sql}, body TEXT NOT NULL)')
+                for index in SQLITE_INDEXES[collection]:
+                    index_name = f"idx_{collection}_{index.replace(', ', '_')}"
+                    conn.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON {collection} ({index})')
+            conn.execute('CREATE TABLE IF NOT EXISTS transaction_items '
+                         '(transaction_id, name TEXT, quantity REAL, price REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_transaction_items_transaction_id '
+                         'ON transaction_items (transaction_id)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            has_rollups = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sales_daily'").fetchone()
+            conn.execute('CREATE TABLE IF NOT EXISTS sales_daily '
+                         '(day TEXT PRIMARY KEY, amount NUMERIC, sales INTEGER)')
+            conn.execute('CREATE TABLE IF NOT EXISTS product_sales_daily '
+                         '(day TEXT, name TEXT, revenue REAL, items INTEGER, PRIMARY KEY (day, name))')
+            if not has_rollups:
+                # Database created before the rollups existed
+                self._write_rollups(conn)
+            has_customer_totals = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'customer_totals'").fetchone()
+            conn.execute('CREATE TABLE IF NOT EXISTS customer_totals '
+                         '(name TEXT PRIMARY KEY, spent NUMERIC, orders INTEGER)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_customer_totals_spent ON customer_totals (spent)')
+            if not has_customer_totals:
+                self._write_customer_totals(conn)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_products_low_stock ON products (id) WHERE stock <= min_stock')
+            conn.execute('CREATE TABLE IF NOT EXISTS stock_totals (value NUMERIC)')
+            if conn.execute('SELECT 1 FROM stock_totals').fetchone() is None:
+                value = sum(stock_value(json.loads(body)) for (body,) in conn.execute('SELECT body FROM products'))
+                conn.execute('INSERT INTO stock_totals VALUES (?)', (value,))
+        self._conn = conn
+
+        try:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'settings'").fetchone() is None:
+                # Fresh database: seed it the same way the JSON store seeds a new
+                # file, which is not a write listeners hear about
+                self._replace(self.validate(self.default_factory()).items())
+            self._check_schema(conn)
+        except Exception:
+            # Every later call connects again and fails the same way
+            self._conn = None
+            conn.close()
+            raise
+        return conn
+
+    def _check_schema(self, conn):
+        """Refuse data of an unknown schema version and migrate older data now.
+
+        Queries and writes don't go through load(), so this runs once per
+        connection instead; raises LoadError.
+        """
+        # An empty dataset at the stored version shows whether it is
+        # current, without reading the records
+        probe = {**{key: [] for key in INDEXED_FIELDS}, 'settings': {}}
+        row = conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+        if row:
+            probe['schema_version'] = json.loads(row[0])
+        version = probe.get('schema_version')
+        try:
+            probe = self.validate(probe)
+        except Exception as e:
+            raise LoadError(f"Could not load data: {e}") from e
+        if probe.get('schema_version') != version:
+            # Older data: load() migrates it and writes it back
+            self.load()
+
+    def _write_record(self, conn, collection, record):
+        if collection == 'transactions':
+            old = conn.execute('SELECT body FROM transactions WHERE id = ?', (record.get('id'),)).fetchone()
+            if old:
+                self._rollup(conn, json.loads(old[0]), -1)
+            self._rollup(conn, record, 1)
+        elif collection == 'products':
+            old = conn.execute('SELECT body FROM products WHERE id = ?', (record.get('id'),)).fetchone()
+            if old:
+                self._add_stock_value(conn, json.loads(old[0]), -1)
+            self._add_stock_value(conn, record, 1)
+
+        columns = INDEXED_FIELDS[collection]
+        names = ['id'] + [name for name, _ in columns] + ['body']
+        values = [record.get('id')] + [record.get(name, default) for name, default in columns]
+        values.append(json.dumps(record))
+        updates = ', '.join(f'{name} = excluded.{name}' for name in names[1:])
+        conn.execute(
+            f"INSERT INTO {collection} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))}) "
+            f"ON CONFLICT(id) DO UPDATE SET {updates}",
+            values)
+
+        if collection == 'transactions':
+            conn.execute('DELETE FROM transaction_items WHERE transaction_id = ?', (record.get('id'),))
+            items = []
+            for item in record.get('items') or []:
+                try:
+                    items.append((record.get('id'), item.get('name', 'Unknown'),
+                                  float(item.get('quantity', 1)), float(item.get('price', 0))))
+                except (TypeError, ValueError, AttributeError):
+                    continue
+            conn.executemany('INSERT INTO transaction_items VALUES (?, ?, ?, ?)', items)
+
+    def _assign_ids(self, conn, collection, records):
+        """Give records without an id the next ids of `collection`; call inside a write transaction"""
+        missing = [r for r in records if 'id' not in r]
+        if not missing:
+            return
+        last = self._last_id(conn, collection)
+        if last is None:
+            last = conn.execute(
+                f"SELECT COALESCE(MAX(id), 0) FROM {collection} WHERE typeof(id) = 'integer'").fetchone()[0]
+        self._set_last_id(conn, collection, last + len(missing))
+        for offset, record in enumerate(missing, 1):
+            record['id'] = last + offset
+
+    @staticmethod
+    def _last_id(conn, collection):
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (f'last_id:{collection}',)).fetchone()
+        return int(row[0]) if row else None
+
+    @staticmethod
+    def _set_last_id(conn, collection, value):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                     (f'last_id:{collection}', str(value)))
+
+    @staticmethod
+    def _bump_version(conn):
+        conn.execute("INSERT INTO meta (key, value) VALUES ('version', '1') ON CONFLICT(key) DO UPDATE "
+                     "SET value = CAST(CAST(value AS INTEGER) + 1 AS TEXT)")
+
+    @staticmethod
+    def _add_stock_value(conn, product, sign):
+        value = stock_value(product)
+        if value:
+            conn.execute('UPDATE stock_totals SET value = value + ?', (sign * value,))
+
+    def _rollup(self, conn, transaction, sign):
+        """Add (sign=1) or remove (sign=-1) a transaction's share of the sales rollups and customer totals"""
+        spend = customer_spend(transaction)
+        if spend is not None:
+            name, spent, orders = spend
+            conn.execute(
+                'INSERT INTO customer_totals VALUES (?, ?, ?) ON CONFLICT(name) DO UPDATE SET '
+                'spent = spent + excluded.spent, orders = orders + excluded.orders',
+                (name, sign * spent, sign * orders))
+            conn.execute('DELETE FROM customer_totals WHERE name = ? AND orders = 0 AND spent = 0', (name,))
+        if transaction.get('type') != 'sale' or parse_date(transaction.get('date')) is None:
+            return
+        day = transaction['date'][:10]
+        conn.execute(
+            'INSERT INTO sales_daily VALUES (?, ?, ?) ON CONFLICT(day) DO UPDATE SET '
+            'amount = amount + excluded.amount, sales = sales + excluded.sales',
+            (day, sign * transaction.get('amount', 0), sign))
+        conn.execute('DELETE FROM sales_daily WHERE day = ? AND sales <= 0', (day,))
+        for name, revenue in item_revenue(transaction):
+            conn.execute(
+                'INSERT INTO product_sales_daily VALUES (?, ?, ?, ?) ON CONFLICT(day, name) DO UPDATE SET '
+                'revenue = revenue + excluded.revenue, items = items + excluded.items',
+                (day, name, sign * revenue, sign))
+            conn.execute('DELETE FROM product_sales_daily WHERE day = ? AND name = ? AND items <= 0', (day, name))
+
+    def _write_rollups(self, conn):
+        """Rewrite the rollup tables from the transactions table"""
+        rows = conn.execute("SELECT body FROM transactions WHERE type = 'sale' ORDER BY rowid")
+        fresh = SalesRollup().rebuild({'transactions': [json.loads(body) for (body,) in rows]})
+        conn.execute('DELETE FROM sales_daily')
+        conn.execute('DELETE FROM product_sales_daily')
+        conn.executemany('INSERT INTO sales_daily VALUES (?, ?, ?)',
+                         [(day, amount, len(fresh.sales[day])) for day, amount in fresh.daily.items()])
+        conn.executemany('INSERT INTO product_sales_daily VALUES (?, ?, ?, ?)',
+                         [(day, name, revenue, fresh.product_items[day][name])
+                          for day, products in fresh.products.items()
+                          for name, revenue in products.items()])
+        return fresh
+
+    def _write_customer_totals(self, conn):
+        """Rewrite the customer_totals table from the transactions table; returns {name: (spent, orders)}"""
+        totals = {}
+        rows = conn.execute("SELECT body FROM transactions WHERE type IN ('sale', 'refund') ORDER BY rowid")
+        for (body,) in rows:
+            spend = customer_spend(json.loads(body))
+            if spend is not None:
+                name, spent, orders = spend
+                old_spent, old_orders = totals.get(name, (0, 0))
+                totals[name] = (old_spent + spent, old_orders + orders)
+        conn.execute('DELETE FROM customer_totals')
+        conn.executemany('INSERT INTO customer_totals VALUES (?, ?, ?)',
+                         [(name, spent, orders) for name, (spent, orders) in totals.items()])
+        return totals
+
+def migrate_json_to_sqlite(json_file, db_file, validate, default_factory):
+    """Copy a business_data.json document into a SQLite store; returns record counts"""
+    with open(json_file, 'r') as f:
+        data = validate(json.load(f))
+    SqliteStore(db_file, validate, default_factory).save(data)
+    return {collection: len(data.get(collection, [])) for collection in INDEXED_FIELDS}
+
+def create_store(backend, data_file, validate, default_factory, compact_threshold=1000, sqlite_file=None):
+    """Build the store for the configured backend name"""
+    if backend == 'json':
+        return JsonStore(data_file, validate, default_factory)
+    if backend == 'journal':
+        return JournalStore(data_file, validate, default_factory, compact_threshold)
+    if backend == 'sqlite':
+        return SqliteStore(sqlite_file or os.path.splitext(data_file)[0] + '.db', validate, default_factory)
+    raise ValueError(f"Unknown storage backend: {backend}")
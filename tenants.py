@@ -0,0 +1,183 @@
+"""Several businesses served from one deployment.
+
+With TENANT_MODE set, every request names the business it is for by
+subdomain, header or path prefix, and each business (tenant) has its own
+directory under TENANTS_DIR holding its data, events and change log. Open
+tenants sit in an LRU bounded by count and by the size of their data on disk;
+a tenant is opened on its first request and reopened lazily after eviction.
+
+The app keeps using module-level `store`, `event_log` and `change_log`
+names; in multi-tenant mode they are TenantProxy objects that resolve to the
+current request's (or job's) tenant on every attribute access.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, has_app_context
+
+TENANT_PATTERN = re.compile(r'[a-z0-9][a-z0-9_-]{0,62}')
+ENVIRON_KEY = 'bizsuite.tenant'
+MODES = ('subdomain', 'header', 'path')
+# Path-prefix mode serves tenant "acme" under /t/acme/...
+PATH_PREFIX = '/t/'
+
+# The tenant of code running outside a request, such as a background job
+_active = ContextVar('tenant', default=None)
+
+class Tenant:
+    """One business: its name, directory and the objects opened on its data"""
+
+    def __init__(self, name, directory, store, event_log, change_log):
+        self.name = name
+        self.directory = directory
+        self.store = store
+        self.event_log = event_log
+        self.change_log = change_log
+        self.size = 0
+
+    def data_size(self):
+        """Bytes of data on disk, which the cache budget is measured in"""
+        data_file = getattr(self.store, 'data_file', None) or getattr(self.store, 'db_file', None)
+        size = 0
+        for path in (data_file, f"{data_file}.log", f"{data_file}-wal"):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+class TenantRegistry:
+    """Tenant directories on disk and an LRU of the open ones.
+
+    `open_tenant(name, directory)` builds the Tenant; it runs on first access
+    and again after eviction. At most `max_open` tenants are kept open, and
+    with `max_bytes` the least recently used are also closed while the data
+    of the open ones adds up to more than that (the one in use always stays).
+    """
+
+    def __init__(self, directory, open_tenant, max_open=16, max_bytes=None):
+        self.directory = directory
+        self.open_tenant = open_tenant
+        self.max_open = max_open
+        self.max_bytes = max_bytes
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def names(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory)
+                      if TENANT_PATTERN.fullmatch(name) and os.path.isdir(self.path(name)))
+
+    def create(self, name):
+        """Add a tenant directory; its data is seeded on first load"""
+        check_name(name)
+        os.makedirs(self.path(name), exist_ok=True)
+
+    def get(self, name):
+        """Return the open tenant `name`, opening it if needed; raises LookupError if it doesn't exist"""
+        check_name(name)
+        with self._lock:
+            tenant = self._open.get(name)
+            if tenant is None:
+                if not os.path.isdir(self.path(name)):
+                    raise LookupError(f"Unknown tenant '{name}'")
+                tenant = self.open_tenant(name, self.path(name))
+                self._open[name] = tenant
+            else:
+                self._open.move_to_end(name)
+            tenant.size = tenant.data_size()
+            self._evict()
+            return tenant
+
+    def _evict(self):
+        # Dropping the last reference frees the tenant's cached dataset;
+        # requests still holding it finish with it undisturbed
+        while len(self._open) > self.max_open:
+            self._open.popitem(last=False)
+        if self.max_bytes:
+            total = sum(tenant.size for tenant in self._open.values())
+            while total > self.max_bytes and len(self._open) > 1:
+                _, tenant = self._open.popitem(last=False)
+                total -= tenant.size
+
+    def open_count(self):
+        with self._lock:
+            return len(self._open)
+
+    @contextmanager
+    def activate(self, name):
+        """Make `name` the current tenant of code outside a request"""
+        token = _active.set(self.get(name))
+        try:
+            yield
+        finally:
+            _active.reset(token)
+
+    def current(self):
+        """Return the tenant of the current request or activated block"""
+        tenant = g.get('tenant') if has_app_context() else None
+        if tenant is None:
+            tenant = _active.get()
+        if tenant is None:
+            raise LookupError("No tenant selected")
+        return tenant
+
+def check_name(name):
+    if not isinstance(name, str) or not TENANT_PATTERN.fullmatch(name):
+        raise LookupError("A tenant name is lowercase letters, digits, '-' and '_'" if name else "No tenant given")
+
+class TenantProxy:
+    """Stand-in for a per-tenant object that forwards to the current tenant's"""
+
+    def __init__(self, registry, attribute):
+        self._registry = registry
+        self._attribute = attribute
+
+    def __getattr__(self, name):
+        return getattr(getattr(self._registry.current(), self._attribute), name)
+
+class TenantMiddleware:
+    """WSGI middleware that puts the requested tenant's name in environ[ENVIRON_KEY].
+
+    subdomain: the first label of the Host, or the label before `domain` if
+    that is set. header: the value of `header`. path: a leading /t/<name>,
+    which moves into SCRIPT_NAME so the app routes the rest as usual.
+    """
+
+    def __init__(self, app, mode, header='X-Tenant', domain=None):
+        if mode not in MODES:
+            raise ValueError(f"TENANT_MODE must be one of {', '.join(MODES)}")
+        self.app = app
+        self.mode = mode
+        self.header_key = 'HTTP_' + header.upper().replace('-', '_')
+        self.domain = domain.lower().strip('.') if domain else None
+
+    def __call__(self, environ, start_response):
+        environ[ENVIRON_KEY] = self.tenant_name(environ)
+        return self.app(environ, start_response)
+
+    def tenant_name(self, environ):
+        if self.mode == 'header':
+            return environ.get(self.header_key)
+        if self.mode == 'subdomain':
+            host = (environ.get('HTTP_HOST') or environ.get('SERVER_NAME') or '').split(':')[0].lower()
+            if self.domain:
+                prefix = host[:-len(self.domain) - 1] if host.endswith('.' + self.domain) else ''
+                return prefix if prefix and '.' not in prefix else None
+            labels = host.split('.')
+            return labels[0] if len(labels) > 2 else None
+        path = environ.get('PATH_INFO', '')
+        if not path.startswith(PATH_PREFIX):
+            return None
+        name, _, rest = path[len(PATH_PREFIX):].partition('/')
+        environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + PATH_PREFIX + name
+        environ['PATH_INFO'] = '/' + rest
+        return name
@@ -0,0 +1,50 @@
+"""Every backend refuses reads and writes of data from a newer app version."""
+import importlib
+import json
+import sqlite3
+import sys
+
+import pytest
+
+NEWER_VERSION = 99
+
+@pytest.fixture(params=['json', 'journal', 'sqlite'])
+def client(request, tmp_path, monkeypatch):
+    data_file = tmp_path / 'business_data.json'
+    sqlite_file = tmp_path / 'business_data.db'
+    monkeypatch.setenv('STORAGE_BACKEND', request.param)
+    monkeypatch.setenv('DATA_FILE', str(data_file))
+    monkeypatch.setenv('SQLITE_FILE', str(sqlite_file))
+    monkeypatch.setenv('JOBS_DIR', str(tmp_path / 'jobs'))
+    monkeypatch.setenv('TENANTS_DIR', str(tmp_path / 'tenants'))
+    monkeypatch.delenv('TENANT_MODE', raising=False)
+    sys.modules.pop('app', None)
+    app = importlib.import_module('app')
+
+    # Write current data, then stamp it with a version this app doesn't know
+    app.store.load()
+    if request.param == 'sqlite':
+        conn = sqlite3.connect(sqlite_file)
+        with conn:
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'schema_version'", (json.dumps(NEWER_VERSION),))
+        conn.close()
+    else:
+        data = app.get_default_data()
+        data['schema_version'] = NEWER_VERSION
+        data_file.write_text(json.dumps(data))
+
+    sys.modules.pop('app', None)
+    app = importlib.import_module('app')
+    yield app.app.test_client()
+    sys.modules.pop('app', None)
+
+@pytest.mark.parametrize('path', ['/api/products', '/api/dashboard', '/api/analytics/balance'])
+def test_reads_are_refused(client, path):
+    assert client.get(path).status_code == 503
+
+@pytest.mark.parametrize('path, body', [
+    ('/api/products', {'name': 'Drum', 'price': 100, 'stock': 5}),
+    ('/api/transactions', {'type': 'purchase', 'amount': 100}),
+])
+def test_writes_are_refused(client, path, body):
+    assert client.post(path, json=body).status_code == 503